@@ -0,0 +1,246 @@
+"""
+Benchmarks of the QBP pipeline on synthetic photon cubes.
+
+Times patch_align_binary, patch_merge_binary, patch_merge, block_match_2d_multichannel and interp2 at several
+resolutions and burst lengths and reports the throughput in frames/s and megapixels/s, compared to a stored baseline:
+
+    python -m benchmarks.bench_qbp                      # compare to benchmarks/baseline.json
+    python -m benchmarks.bench_qbp --save-baseline      # store the results as the new baseline
+    python -m benchmarks.bench_qbp --sizes 256 --frames 400 --cases patch_merge_binary --check
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+# progress bars of the pipeline would interleave with the report
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+import numpy as np
+from qbp.burst.blockMatch2d import block_match_2d_multichannel
+from qbp.burst.patchAlignBinary import patch_align_binary
+from qbp.burst.patchMerge import patch_merge
+from qbp.burst.patchMergeBinary import patch_merge_binary
+from qbp.utils.interp2 import interp2
+from qbp.utils.ps_shape.param_from_json import param_from_json
+from qbp.sim import MotionModel, SyntheticPhotonCube, random_scene
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_SIZES = [128, 256, 512]
+DEFAULT_FRAMES = [200, 800]
+# cases that only depend on the resolution are run once per size
+PER_SIZE_CASES = ['patch_merge', 'block_match_2d_multichannel', 'interp2']
+CASES = ['patch_align_binary', 'patch_merge_binary'] + PER_SIZE_CASES
+
+
+def benchmark_param(num_frames):
+    """QBP parameters for a burst of num_frames frames, split into 10 align and merge blocks."""
+    param = param_from_json(None)
+    tw_size = max(1, num_frames // 10)
+    param.update({'alignTWSize': tw_size, 'alignTWNum': 10, 'mergeTWSize': tw_size, 'mergeTWNum': 10,
+                  'refFrame': 5 * tw_size, 'warpTWSize': 1, 'numWorkers': 1, 'num_ls': 1,
+                  'resultDir': os.path.join('benchmarks', 'results')})
+    return param
+
+
+class BurstData:
+    """Synthetic photon cubes and the alignment of each cube, generated once per (size, frames) and shared by cases."""
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self._scenes = {}
+        self._cubes = {}
+        self._flows = {}
+
+    def scene(self, size):
+        if size not in self._scenes:
+            self._scenes[size] = random_scene(size, size, self.seed)
+        return self._scenes[size]
+
+    def cube(self, size, num_frames):
+        key = (size, num_frames)
+        if key not in self._cubes:
+            # generated up front, so the cases time the pipeline and not the simulation
+            cube = SyntheticPhotonCube(self.scene(size), num_frames, MotionModel((0.04, 0.02)), max_flux=0.5,
+                                       seed=self.seed)
+            self._cubes[key] = list(cube.frames(0, num_frames))
+        return self._cubes[key]
+
+    def flows(self, size, num_frames):
+        key = (size, num_frames)
+        if key not in self._flows:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self._flows[key] = patch_align_binary(self.cube(size, num_frames), benchmark_param(num_frames))[0]
+        return self._flows[key]
+
+
+def setup_case(case, data, size, num_frames):
+    """
+    Inputs of a benchmark case.
+
+    Returns:
+        tuple: (fn, frames, megapixels), fn runs the case once, frames and megapixels are the number of frames and
+            the number of pixels (in millions) processed per run.
+    """
+    mp = size * size / 1e6
+    if case == 'patch_align_binary':
+        frames = data.cube(size, num_frames)
+        param = benchmark_param(num_frames)
+        return (lambda: patch_align_binary(frames, dict(param))), num_frames, num_frames * mp
+    if case == 'patch_merge_binary':
+        frames = data.cube(size, num_frames)
+        flows = data.flows(size, num_frames)
+        param = benchmark_param(num_frames)
+        return (lambda: patch_merge_binary(frames, flows, dict(param), None)), num_frames, num_frames * mp
+    if case == 'patch_merge':
+        # 10 pre-aligned merge blocks of the patch grid, as produced by patch_merge_binary
+        param = benchmark_param(num_frames)
+        patchSize = param['patchSizes'][0]
+        hs = ws = (size - patchSize) // (patchSize // 2) + 1
+        rng = np.random.default_rng(data.seed)
+        patches = rng.random((hs * patchSize, ws * patchSize, 1, param['mergeTWNum']))
+        param.update({'H': size, 'W': size, 'refImage': param['mergeTWNum'] // 2})
+        return (lambda: patch_merge(patches, dict(param))), param['mergeTWNum'], param['mergeTWNum'] * mp
+    if case == 'block_match_2d_multichannel':
+        # match all 16 x 16 blocks of a shifted copy of the scene
+        im0 = data.scene(size)
+        im1 = np.roll(im0, (2, -3), axis=(0, 1))
+        uls = [(y, x) for y in range(5, size - 20, 16) for x in range(5, size - 20, 16)]
+
+        def fn():
+            for y, x in uls:
+                block_match_2d_multichannel(im0, im1, [y, x], 16, 4)
+        return fn, 1, mp
+    if case == 'interp2':
+        # warp of the scene by a sub-pixel translation
+        V = data.scene(size)
+        Xq, Yq = np.meshgrid(np.arange(size) + 0.3, np.arange(size) - 0.6)
+        return (lambda: interp2(V, Xq, Yq, method='linear')), 1, mp
+    raise ValueError(f'Unknown benchmark case: {case}. Choose from {", ".join(CASES)}.')
+
+
+def time_case(fn, repeat, min_time=0.05):
+    """
+    Best wall time of a run of fn in seconds, out of repeat measurements. The output of the pipeline is suppressed.
+
+    The first run is a warm-up that only counts if repeat is 1. Fast cases are run several times per measurement, so
+    that each measurement takes at least min_time seconds.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        fn()
+        best = time.perf_counter() - start
+        loops = max(1, int(min_time / max(best, 1e-9)))
+        if repeat > 1:
+            best = np.inf
+        for _ in range(repeat if repeat > 1 else 0):
+            start = time.perf_counter()
+            for _ in range(loops):
+                fn()
+            best = min(best, (time.perf_counter() - start) / loops)
+    return best
+
+
+def run_benchmarks(sizes=None, frames=None, cases=None, repeat=3, seed=0, log=print):
+    """
+    Run the benchmark cases.
+
+    Args:
+        sizes (list): Image sizes (square images). Defaults to DEFAULT_SIZES.
+        frames (list): Burst lengths. Defaults to DEFAULT_FRAMES.
+        cases (list): Benchmark cases, see CASES. Defaults to all.
+        repeat (int): Number of runs per case, the best time is reported.
+        seed (int): Seed of the synthetic data.
+        log (callable): Called with a line per finished case.
+
+    Returns:
+        dict: Results by '<case>/<size>x<size>/T<frames>' (or '<case>/<size>x<size>' for cases independent of the
+            burst length), each with seconds, frames_per_s and megapixels_per_s.
+    """
+    sizes = DEFAULT_SIZES if sizes is None else sizes
+    frames = DEFAULT_FRAMES if frames is None else frames
+    cases = CASES if cases is None else cases
+    data = BurstData(seed)
+    results = {}
+    for size in sizes:
+        for case in cases:
+            for num_frames in frames[:1] if case in PER_SIZE_CASES else frames:
+                key = f'{case}/{size}x{size}' + ('' if case in PER_SIZE_CASES else f'/T{num_frames}')
+                fn, n, mp = setup_case(case, data, size, num_frames)
+                seconds = time_case(fn, repeat)
+                results[key] = {'seconds': seconds, 'frames_per_s': n / seconds, 'megapixels_per_s': mp / seconds}
+                log(f'{key:<45} {seconds:9.4f} s {n / seconds:12.1f} frames/s {mp / seconds:10.2f} MP/s')
+        data = BurstData(seed)  # free the cubes of this size
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compare results to a baseline.
+
+    Args:
+        results (dict): Results of run_benchmarks.
+        baseline (dict): Stored results of run_benchmarks.
+        tolerance (float): Relative slowdown that is reported as a regression.
+
+    Returns:
+        tuple: (lines, regressions), a report line per case found in both and the keys of the regressed cases.
+    """
+    lines = []
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        speedup = baseline[key]['seconds'] / result['seconds']
+        regressed = speedup < 1 / (1 + tolerance)
+        if regressed:
+            regressions.append(key)
+        lines.append(f'{key:<45} {speedup:6.2f}x baseline' + ('  REGRESSION' if regressed else ''))
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the QBP pipeline on synthetic photon cubes.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='image sizes (square)')
+    parser.add_argument('--frames', type=int, nargs='+', default=DEFAULT_FRAMES, help='burst lengths')
+    parser.add_argument('--cases', nargs='+', default=CASES, choices=CASES, help='benchmark cases')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the best time is reported')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline to compare to')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slowdown reported as a regression')
+    parser.add_argument('--check', action='store_true', help='exit with status 1 if a case regressed')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.frames, args.cases, args.repeat, args.seed)
+    report = {'machine': platform.machine(), 'processor': platform.processor(), 'python': platform.python_version(),
+              'numpy': np.__version__, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+    if not os.path.isfile(args.baseline):
+        print(f'No baseline at {args.baseline}, run with --save-baseline to create one.')
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    lines, regressions = compare(results, baseline, args.tolerance)
+    print(f'\nCompared to {args.baseline}:')
+    print('\n'.join(lines))
+    if regressions:
+        print(f'{len(regressions)} case(s) slower than the baseline by more than {args.tolerance:.0%}.')
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import itertools
+import numpy as np
+
+
+def iter_frame_chunks(frames, chunk_frames, start=0, stop=None):
+    """
+    Yield consecutive frames in chunks.
+
+    Args:
+        frames: Frame source. Either a sequence with a frames(start, stop) method (PhotonCube, PackedPhotonCube), which
+            is read chunk by chunk, or any sequence or iterator of (H, W) or (H, W, C) frames.
+        chunk_frames (int): Number of frames per chunk.
+        start (int): First frame (0-based).
+        stop (int, optional): Frame after the last frame. Defaults to the end of the source.
+
+    Yields:
+        numpy array: Chunk of shape (n, H, W) or (n, H, W, C) with n <= chunk_frames.
+    """
+    if hasattr(frames, 'frames') and hasattr(frames, '__len__'):
+        stop = len(frames) if stop is None else min(stop, len(frames))
+        for t0 in range(start, stop, chunk_frames):
+            yield frames.frames(t0, min(stop, t0 + chunk_frames))
+        return
+
+    it = itertools.islice(iter(frames), start, stop)
+    while True:
+        chunk = list(itertools.islice(it, chunk_frames))
+        if not chunk:
+            return
+        yield np.stack(chunk)
+
+
+def stream_window_sums(frames, start, tw_size, tw_num, dtype='double', chunk_frames=None, reduce_channels=False):
+    """
+    Sum consecutive temporal windows of frames in a streaming fashion.
+    Frames are consumed chunk by chunk, each chunk is reduced with one sum over its complete windows. Only one chunk is
+    held in memory at a time and only the frames start...start + tw_size * tw_num - 1 are read.
+
+    Args:
+        frames: Frame source, see iter_frame_chunks.
+        start (int): First frame of the first window (0-based).
+        tw_size (int): Number of frames per temporal window.
+        tw_num (int): Number of temporal windows.
+        dtype: Data type of the sums.
+        chunk_frames (int, optional): Number of frames per chunk. Defaults to a multiple of tw_size of about 256 frames.
+        reduce_channels (bool): If True, color frames are averaged over the channels before summing.
+
+    Returns:
+        list: tw_num window sums of shape (H, W) or (H, W, C).
+    """
+    if chunk_frames is None:
+        chunk_frames = tw_size * max(1, 256 // tw_size)
+
+    sums = []
+    partial = None  # sum of the window that is not complete yet
+    partial_size = 0
+    for chunk in iter_frame_chunks(frames, chunk_frames, start, start + tw_size * tw_num):
+        if reduce_channels and chunk.ndim == 4:
+            chunk = np.mean(chunk, axis=3)
+        pos = 0
+        # complete the window started in the previous chunk
+        if partial_size > 0:
+            pos = min(tw_size - partial_size, len(chunk))
+            partial += np.sum(chunk[:pos], axis=0, dtype=dtype)
+            partial_size += pos
+            if partial_size == tw_size:
+                sums.append(partial)
+                partial = None
+                partial_size = 0
+        # all complete windows of the chunk at once
+        k = (len(chunk) - pos) // tw_size
+        if k > 0:
+            windows = chunk[pos:pos + k * tw_size].reshape((k, tw_size) + chunk.shape[1:])
+            sums.extend(np.sum(windows, axis=1, dtype=dtype))
+            pos += k * tw_size
+        # start of the next window
+        if pos < len(chunk):
+            partial = np.sum(chunk[pos:], axis=0, dtype=dtype)
+            partial_size = len(chunk) - pos
+
+    if len(sums) < tw_num:
+        raise ValueError('tw_size * tw_num must be no greater than the number of frames!')
+    return sums
+
+
+class WindowSumCache:
+    """
+    Cache of per-window photon counts of a frame source.
+
+    Window sums are computed once (streamed, or with popcount for a PackedPhotonCube) and stored per
+    (first frame, window size). Requests for longer windows are served from cached shorter windows if the window size
+    is a multiple of the cached one and the windows line up, e.g. the sum of a whole burst from the sums of its
+    temporal windows. This way the naive reconstruction, the reference block reconstruction and the alignment block
+    images read the photons only once.
+    """
+
+    def __init__(self, frames, dtype='double'):
+        """
+        Args:
+            frames: Frame source, see iter_frame_chunks.
+            dtype: Data type of the sums.
+        """
+        self.frames = frames
+        self.dtype = dtype
+        self._sums = {}  # (start, tw_size) -> (tw_num, H, W[, C]) array
+
+    def window_sums(self, start, tw_size, tw_num):
+        """
+        Sums of tw_num consecutive windows of tw_size frames each, the first window starts at frame start (0-based).
+
+        Returns:
+            numpy array: (tw_num, H, W) or (tw_num, H, W, C) array.
+        """
+        for (s0, w0), sums in self._sums.items():
+            if start < s0 or (start - s0) % w0 or tw_size % w0:
+                continue
+            k = tw_size // w0
+            i0 = (start - s0) // w0
+            if i0 + tw_num * k <= len(sums):
+                windows = sums[i0:i0 + tw_num * k]
+                return windows if k == 1 else np.sum(windows.reshape((tw_num, k) + sums.shape[1:]), axis=1)
+
+        if hasattr(self.frames, 'window_sums'):
+            # packed frames: count photons with popcount
+            sums = self.frames.window_sums(start, tw_size, tw_num).astype(self.dtype)
+        else:
+            sums = np.stack(stream_window_sums(self.frames, start, tw_size, tw_num, self.dtype))
+        self._sums[(start, tw_size)] = sums
+        return sums
+
+    def window_sum(self, start, stop):
+        """Sum of the frames start...stop-1."""
+        return self.window_sums(start, stop - start, 1)[0]
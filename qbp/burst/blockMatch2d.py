@@ -1,11 +1,76 @@
-import time
 import numpy as np
-from testing.TestFunctions import test_logger
+from numpy.lib.stride_tricks import sliding_window_view
+from qbp.utils.instrumentation import test_logger
+
+
+def sad_scores(ref_patch, search_region, block_size):
+    """
+    Sum of absolute differences between a reference patch and every block_size x block_size window of a search region.
+
+    Args:
+        ref_patch (numpy array): Reference patch of shape (block_size, block_size) or (block_size, block_size, C).
+        search_region (numpy array): Region of the target image that contains all candidate windows.
+        block_size (int): Size of the block.
+
+    Returns:
+        numpy array: Scores of shape (nv, nu), where entry [v, u] belongs to the window with upper left corner (v, u).
+    """
+    # windows has shape (nv, nu, [C,] bs, bs) -> move the channel axis to the end to get the same element order as
+    # a single patch of the search region
+    windows = sliding_window_view(search_region, (block_size, block_size), axis=(0, 1))
+    if windows.ndim == 5:
+        windows = windows.transpose(0, 1, 3, 4, 2)
+    diff = np.abs(windows - ref_patch)
+    # summing along one contiguous axis reproduces the (pairwise) summation order of np.sum on a single patch,
+    # so scores are bit-identical to the per-candidate evaluation
+    diff = diff.reshape(diff.shape[0], diff.shape[1], -1)
+    return np.sum(diff, axis=2, dtype=np.float64)
+
+
+def select_best_score(scores, warn=True):
+    """
+    Pick the best candidate from scores given in scan order (last axis).
+
+    A candidate only replaces the current best if it is better by a relative margin (best_score*0.9999). This leeway
+    prevents numerical issues and keeps the selection consistent with the MATLAB implementation, so the scan order
+    matters and a plain argmin cannot be used. Leading axes are treated as independent searches.
+
+    Args:
+        scores (numpy array): Scores of shape (..., L), the last axis is the scan order.
+        warn (bool): If True, print a warning when an accepted score is dangerously close to the previous best.
+
+    Returns:
+        tuple: (best_idx, best_score)
+            - best_idx (numpy array): Index of the selected candidate along the last axis, -1 if nothing was selected.
+            - best_score (numpy array): Score of the selected candidate, inf if nothing was selected.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    best_idx = np.full(scores.shape[:-1], -1, dtype=int)
+    best_score = np.full(scores.shape[:-1], np.inf)
+    if scores.shape[-1] == 0:
+        return best_idx, best_score
+
+    # only strict prefix minima can ever be accepted, all other scan positions are skipped without changing the result
+    prefix_min = np.minimum.accumulate(scores, axis=-1)
+    is_candidate = np.concatenate((np.ones(scores.shape[:-1] + (1,), dtype=bool),
+                                   scores[..., 1:] < prefix_min[..., :-1]), axis=-1)
+    positions = np.flatnonzero(is_candidate.reshape(-1, scores.shape[-1]).any(axis=0))
+    for idx in positions:
+        cur_score = scores[..., idx]
+        accept = cur_score < best_score*0.9999 #some leeway to prevent numerical issues
+        # numerical precision is an issue here with Matlab compatibility, as the behavior for very similar patches oftentimes varies
+        if warn and np.any(np.abs(cur_score[accept] - best_score[accept]) < 0.0001):
+            print("warning: scores are dangerously close in blockMatch2d!")
+        best_score = np.where(accept, cur_score, best_score)
+        best_idx = np.where(accept, idx, best_idx)
+    return best_idx, best_score
+
 
 @test_logger
 def block_match_2d_multichannel(im0, im1, block_ul, block_size, search_radius, init_match=None, debug=False):
     """
     Brute-force block match in 2D for multi-channel images.
+    All candidate offsets of the search window are scored at once (see sad_scores).
 
     Args:
         im0 (numpy array): Reference image.
@@ -25,7 +90,6 @@ def block_match_2d_multichannel(im0, im1, block_ul, block_size, search_radius, i
         init_match = [0, 0]
 
     h, w = im0.shape[0], im0.shape[1]
-    c = im0.shape[2] if im0.ndim == 3 else 1
 
     # Upper left corner coordinates of the block in im0 (0-based)
     ylb, xlb = block_ul
@@ -33,10 +97,7 @@ def block_match_2d_multichannel(im0, im1, block_ul, block_size, search_radius, i
     xlb -= 1
 
     # Extract the reference patch from im0 (multi-channel)
-    if im0.ndim == 2:
-        ref_patch = im0[ylb:ylb + block_size, xlb:xlb + block_size]
-    else:
-        ref_patch = im0[ylb:ylb + block_size, xlb:xlb + block_size, :]
+    ref_patch = im0[ylb:ylb + block_size, xlb:xlb + block_size]
 
     best_score = float('inf')
     best_match = [np.nan, np.nan]
@@ -49,7 +110,7 @@ def block_match_2d_multichannel(im0, im1, block_ul, block_size, search_radius, i
         print("  ref_patch shape:", ref_patch.shape)
         print("  search_radius:", search_radius, "init_match:", init_match)
 
-    # Loop over search region
+    # Search region
     v_min = int(max(-ylb, init_match[1] - search_radius))
     v_max = int(min(h - block_size - ylb, init_match[1] + search_radius))
     u_min = int(max(-xlb, init_match[0] - search_radius))
@@ -60,32 +121,95 @@ def block_match_2d_multichannel(im0, im1, block_ul, block_size, search_radius, i
         print("    v range:", v_min, "to", v_max)
         print("    u range:", u_min, "to", u_max)
 
-    # move patch across reference image for template matching
-    for v in range(v_min, v_max+1):
-        t0_v = time.time()
-        for u in range(u_min, u_max+1):
-            # Extract current patch from im1 (multi-channel)
-            if im1.ndim == 2:
-                cur_patch = im1[ylb + v:ylb + v + block_size, xlb + u:xlb + u + block_size]
-            else:
-                cur_patch = im1[ylb + v:ylb + v + block_size, xlb + u:xlb + u + block_size, :]
-
-            # Calculate the score as the sum of absolute differences across all channels
-            cur_score = np.sum(np.abs(cur_patch - ref_patch), dtype=np.float64)
-
-            # Update the best match if the current score is better
-            if cur_score < best_score*0.9999: #some leeway to prevent numerical issues
-                # numerical precision is an issue here with Matlab compatibility, as the behavior for very similar patches oftentimes varies
-                if np.abs(cur_score - best_score) < 0.0001:
-                    print("warning: scores are dangerously close in blockMatch2d!")
-                best_score = cur_score
-                best_match = [u, v]
-
-                if debug:
-                    print("    New best score:", best_score, "at (u,v):", (u, v))
+    if v_min > v_max or u_min > u_max:
+        return np.array([best_match]).squeeze(), best_score
+
+    # score every window of the search region, scan order is v (rows) first, then u
+    search_region = im1[ylb + v_min:ylb + v_max + block_size, xlb + u_min:xlb + u_max + block_size]
+    scores = sad_scores(ref_patch, search_region, block_size)
+    best_idx, best_score = select_best_score(scores.ravel())
+    best_idx, best_score = int(best_idx), float(best_score)
+    if best_idx >= 0:
+        v, u = np.unravel_index(best_idx, scores.shape)
+        best_match = [u_min + int(u), v_min + int(v)]
+
     if debug:
         print("  Final best_match:", best_match, "best_score:", best_score)
 
     return np.array([best_match]).squeeze(), best_score #wrap in list to match MATLAB output
 
 
+@test_logger
+def block_match_level(refImg, tgtImg, patchSize, patchStride, searchRadius, initMatch, max_elements=2 ** 22):
+    """
+    Block match all patches of a pyramid level in one batched call.
+    Equivalent to calling block_match_2d_multichannel for every patch (j, k) and every candidate initMatch[j, k, m, :]
+    and keeping the best candidate, including the tie-breaking rules of both steps.
+
+    Args:
+        refImg (numpy array): Reference image (H, W) or (H, W, C).
+        tgtImg (numpy array): Image to be matched, same shape as refImg.
+        patchSize (int): Size of the patches.
+        patchStride (int): Distance between the upper left corners of neighbouring patches.
+        searchRadius (int): Radius of the search area around each candidate.
+        initMatch (numpy array): Candidate matches of shape (hl, wl, M, 2), given as (u, v).
+        max_elements (int): Upper bound for the number of elements of the cost volume that is evaluated at once.
+            Patches are processed in tiles to stay below this bound.
+
+    Returns:
+        tuple: (bestMatch, bestScore)
+            - bestMatch (numpy array): Best match (u, v) of shape (hl, wl, 2). Patches without a valid match are 0.
+            - bestScore (numpy array): Score of the best match of shape (hl, wl).
+    """
+    hl, wl, M = initMatch.shape[:3]
+    H, W = refImg.shape[:2]
+    C = refImg.shape[2] if refImg.ndim == 3 else 1
+    P = hl * wl
+    nd = 2 * int(searchRadius) + 1
+
+    # upper left corners of all patches (0-based)
+    ylb = np.repeat(np.arange(hl) * patchStride, wl)
+    xlb = np.tile(np.arange(wl) * patchStride, hl)
+    init = np.asarray(initMatch).reshape(P, M, 2)
+
+    # search ranges, same clipping and truncation as in block_match_2d_multichannel
+    v_min = np.trunc(np.maximum(-ylb[:, None], init[:, :, 1] - searchRadius)).astype(int)
+    v_max = np.trunc(np.minimum(H - patchSize - ylb[:, None], init[:, :, 1] + searchRadius)).astype(int)
+    u_min = np.trunc(np.maximum(-xlb[:, None], init[:, :, 0] - searchRadius)).astype(int)
+    u_max = np.trunc(np.minimum(W - patchSize - xlb[:, None], init[:, :, 0] + searchRadius)).astype(int)
+
+    # all windows of both images, channel axis last to match the element order of a single patch
+    ref_windows = sliding_window_view(refImg, (patchSize, patchSize), axis=(0, 1))
+    tgt_windows = sliding_window_view(tgtImg, (patchSize, patchSize), axis=(0, 1))
+    if refImg.ndim == 3:
+        ref_windows = ref_windows.transpose(0, 1, 3, 4, 2)
+        tgt_windows = tgt_windows.transpose(0, 1, 3, 4, 2)
+
+    # cost volume (patches x candidates x offsets), scan order of the offsets is v first, then u
+    d = np.arange(nd)
+    scores = np.full((P, M, nd, nd), np.inf)
+    tile = max(1, max_elements // (M * nd * nd * patchSize * patchSize * C))
+    for p0 in range(0, P, tile):
+        p1 = min(P, p0 + tile)
+        v = v_min[p0:p1, :, None] + d
+        u = u_min[p0:p1, :, None] + d
+        valid = (v <= v_max[p0:p1, :, None])[:, :, :, None] & (u <= u_max[p0:p1, :, None])[:, :, None, :]
+        Y = np.clip(ylb[p0:p1, None, None] + v, 0, H - patchSize)[:, :, :, None]
+        X = np.clip(xlb[p0:p1, None, None] + u, 0, W - patchSize)[:, :, None, :]
+        ref_patches = ref_windows[ylb[p0:p1], xlb[p0:p1]][:, None, None, None]
+        diff = np.abs(tgt_windows[Y, X] - ref_patches)
+        # sum along one contiguous axis to get the same values as block_match_2d_multichannel
+        diff = diff.reshape(diff.shape[:4] + (-1,))
+        tile_scores = np.sum(diff, axis=4, dtype=np.float64)
+        scores[p0:p1] = np.where(valid, tile_scores, np.inf)
+
+    # best offset per candidate, then best candidate per patch
+    offset_idx, cand_scores = select_best_score(scores.reshape(P, M, nd * nd))
+    cand_matches = np.stack((u_min + offset_idx % nd, v_min + offset_idx // nd), axis=2).astype(np.float64)
+    cand_idx, bestScore = select_best_score(cand_scores, warn=False)
+
+    bestMatch = np.zeros((P, 2))
+    found = cand_idx >= 0
+    bestMatch[found] = cand_matches[np.flatnonzero(found), cand_idx[found]]
+
+    return bestMatch.reshape(hl, wl, 2), bestScore.reshape(hl, wl)
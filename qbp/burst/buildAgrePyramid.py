@@ -1,6 +1,8 @@
 import numpy as np
 import cv2
-from testing.TestFunctions import test_logger
+from numpy.lib.stride_tricks import sliding_window_view
+from qbp.utils.partial_deriv_patch import DERIV_FILTER, image_gradients, patch_gradients
+from qbp.utils.instrumentation import test_logger
 @test_logger
 def build_aggre_pyramid(ims, upsample_ratios):
     """
@@ -28,4 +30,59 @@ def build_aggre_pyramid(ims, upsample_ratios):
         aggre_ratio *= upsample_ratios[i] ** 2
         P[i] = S0 / aggre_ratio
 
-    return P
\ No newline at end of file
+    return P
+
+
+class GradientPyramid:
+    """
+    Lazily computed derivatives of the levels of an aggregate pyramid, shared between Lucas-Kanade calls.
+
+    The derivatives of a level (see image_gradients) and the derivatives of all its patches of a given size and stride
+    (see patch_gradients) are computed on first access and cached. The reference pyramid of patch_align is the same for
+    all blocks, so its template derivatives are computed once per burst instead of once per block.
+    """
+
+    def __init__(self, pyramid, deriv_filter=None):
+        """
+        Args:
+            pyramid (list): Pyramid levels, e.g. from build_aggre_pyramid.
+            deriv_filter (numpy array, optional): 1D derivative filter. Defaults to DERIV_FILTER.
+        """
+        self.pyramid = pyramid
+        self.deriv_filter = DERIV_FILTER if deriv_filter is None else deriv_filter
+        self._gradients = {}
+        self._patch_gradients = {}
+
+    def __len__(self):
+        return len(self.pyramid)
+
+    def __getitem__(self, level):
+        return self.pyramid[level]
+
+    def gradients(self, level):
+        """
+        Derivatives of a whole level.
+
+        Returns:
+            tuple: (Ix, Iy), each of the shape of the level.
+        """
+        if level not in self._gradients:
+            self._gradients[level] = image_gradients(self.pyramid[level], self.deriv_filter)
+        return self._gradients[level]
+
+    def patch_gradients(self, level, patchSize, patchStride):
+        """
+        Derivatives of all patches of a level, each reflected at its own borders.
+
+        Returns:
+            tuple: (Ix, Iy), each of shape (hl, wl, patchSize, patchSize) with hl, wl the number of patches that fit
+                into the level along each axis.
+        """
+        key = (level, patchSize, patchStride)
+        if key not in self._patch_gradients:
+            patches = sliding_window_view(self.pyramid[level], (patchSize, patchSize))[::patchStride, ::patchStride]
+            hl, wl = patches.shape[:2]
+            Ix, Iy = patch_gradients(patches.reshape((-1, patchSize, patchSize)), self.deriv_filter)
+            self._patch_gradients[key] = (Ix.reshape((hl, wl, patchSize, patchSize)),
+                                          Iy.reshape((hl, wl, patchSize, patchSize)))
+        return self._patch_gradients[key]
@@ -1,20 +1,23 @@
 import numpy as np
 from qbp.utils.mleImage import mle_image
-from testing.TestFunctions import test_logger
+from qbp.burst.blockAggregation import WindowSumCache
+from qbp.utils.instrumentation import test_logger
 @test_logger
-def naive_recons(imbs, param):
+def naive_recons(imbs, param, cache=None, start=0):
     """
     Naive reconstruction by simple summing the binary images and compute MLE.
     V2: use mle_image instead of mle_intensity, ignores absolute intensity.
 
     Args:
-        imbs (list): 1D list of binary frames (numpy arrays).
+        imbs (list): 1D list of binary frames (numpy arrays) or a PackedPhotonCube.
         param (dict): Dictionary containing the following fields:
             - mergeTWSize: window size for temporal reconstruction.
             - mergeTWNum: number of temporal windows (determines total number of frames being used), > 2.
             - refFrame: reference frame #.
             - imgScale: linear scaling factor for intensity image.
             - debug: whether or not to print debug information.
+        cache (WindowSumCache, optional): Window sums of imbs shared with other stages. Defaults to a new cache.
+        start (int): First frame (0-based) of the reconstruction, e.g. the first frame of the reference block.
 
     Returns:
         tuple: (ima, S)
@@ -30,21 +33,15 @@ def naive_recons(imbs, param):
     tw_size = param['mergeTWSize']
     tw_num = param['mergeTWNum']
 
-    if tw_size * tw_num > N:
+    if start + tw_size * tw_num > N:
         raise ValueError('twSize * twNum must be no greater than N!')
 
-    def frame_idx(i, j):
-        return (i - 1) * tw_size + j
-
     img_scale = param['imgScale']
 
+    if cache is None:
+        cache = WindowSumCache(imbs, param['dataType'])
     S = np.zeros((H, W, C), dtype=param['dataType'])
-    for i in range(1, tw_num + 1):
-        for j in range(1, tw_size + 1):
-            if C==1:
-                S += imbs[frame_idx(i, j) - 1][:,:,np.newaxis]
-            else:
-                S += imbs[frame_idx(i, j) - 1]
+    S[:] = cache.window_sum(start, start + tw_num * tw_size).reshape(H, W, C)
 
     ima, sigma2 = mle_image(S, tw_num * tw_size * param['n_binary'], img_scale)
 
@@ -1,15 +1,85 @@
 import numpy as np
 import cv2
-from qbp.burst.buildAgrePyramid import build_aggre_pyramid
+from concurrent.futures import ProcessPoolExecutor
+from qbp.burst.buildAgrePyramid import build_aggre_pyramid, GradientPyramid
 from qbp.burst.patchAlign_subfuns.dc_coarseToFineMatch import coarse_to_fine_match
 from qbp.burst.patchAlign_subfuns.dc_refineFinestLevel import refine_finest_level
+from qbp.burst.patchAlign_subfuns.dc_upsampleMatches import match_upsample_plans
 from qbp.burst.patchAlign_subfuns.dc_debugVisualization import debug_visualization
-from testing.TestFunctions import test_logger
+from qbp.utils.sharedArrays import share_arrays, attach_arrays, release_arrays
+from qbp.utils.instrumentation import test_logger, profile_stage
 from tqdm import tqdm
+
+
+def align_block(P0, im, param, G0=None, plans=None):
+    """
+    Align a single block image against the reference pyramid P0.
+
+    Args:
+        P0 (list): Aggregate pyramid of the reference image.
+        im (numpy array): Block image to be aligned.
+        param (dict): Parameters, see patch_align.
+        G0 (GradientPyramid, optional): Gradient pyramid of P0, shared between the blocks so that the template
+            derivatives are only computed once.
+        plans (dict, optional): Match upsampling plans of the pyramid geometry (see match_upsample_plans), shared
+            between the blocks so that the index maps are only computed once.
+
+    Returns:
+        numpy array: Flow of shape (hs, ws, 2).
+    """
+    patchSizes = param['patchSizes']
+    patchStride = patchSizes[0] // 2
+    upsampleRatios = param['upsampleRatios']
+    searchRadii = param['searchRadii']
+
+    with profile_stage('pyramid build'):
+        P1 = build_aggre_pyramid(im, upsampleRatios)
+    if G0 is None:
+        G0 = GradientPyramid(P0)
+    G1 = GradientPyramid(P1)
+    if plans is None:
+        plans = match_upsample_plans([p.shape for p in P0], param)
+
+    ### Coarse-to-fine matching
+    with profile_stage('coarse-to-fine match'):
+        bestMatch = coarse_to_fine_match(P0, P1, patchSizes, searchRadii, upsampleRatios, param, G0, G1, plans)
+
+    ### Refine at finest level
+    with profile_stage('finest refine'):
+        return refine_finest_level(P0[0], P1[0], bestMatch, patchSizes, patchStride, searchRadii[0], param, G0, G1,
+                                   plans.get(0))
+
+
+# state of a worker process, set once by _init_worker
+_worker = {}
+
+
+def _init_worker(P0_specs, img_specs, param):
+    # attach to the shared reference pyramid and block images, they are not pickled per task
+    shms_P0, P0 = attach_arrays(P0_specs)
+    shms_img, img = attach_arrays(img_specs)
+    _worker['shms'] = shms_P0 + shms_img
+    _worker['P0'] = P0
+    # derivatives of the reference pyramid, computed lazily once per worker
+    _worker['G0'] = GradientPyramid(P0)
+    _worker['plans'] = match_upsample_plans([p.shape for p in P0], param)
+    _worker['img'] = img[0]
+    _worker['param'] = param
+
+
+def _align_block_worker(i):
+    # the ticks spent on the block are returned for the per-block timing of the debug output
+    timeBlockStart = cv2.getTickCount()
+    flow = align_block(_worker['P0'], _worker['img'][i], _worker['param'], _worker['G0'], _worker['plans'])
+    return flow, cv2.getTickCount() - timeBlockStart
+
+
 @test_logger
 def patch_align(ims, param, imv=None):
     """
     Python equivalent of patchAlign. Uses helper functions.
+    If param['numWorkers'] > 1, the blocks are aligned in a process pool. The reference pyramid and the block images
+    are shared with the workers through shared memory, the resulting flows are identical to the serial version.
     """
     H, W = ims[0].shape[:2]
     C = ims[0].shape[2] if ims[0].ndim == 3 else 1
@@ -26,36 +96,51 @@ def patch_align(ims, param, imv=None):
         img = [np.mean(im,axis=(0,1)) for im in ims]
 
     resultDir = param['resultDir']
-    numLevels = param['numLevels']
     patchSizes = param['patchSizes']
     patchStride = patchSizes[0] // 2
     upsampleRatios = param['upsampleRatios']
-    searchRadii = param['searchRadii']
     numStrides = patchSizes[0] // patchStride
     hs = (H - patchSizes[0]) // patchStride + 1
     ws = (W - patchSizes[0]) // patchStride + 1
+    numWorkers = int(param.get('numWorkers', 1))
     flows = [None] * N
 
-    P0 = build_aggre_pyramid(img[refImage], upsampleRatios)
-    for i in tqdm(range(N)):
-        if i == refImage:
-            flows[i] = np.zeros((hs, ws, 2))
-            continue
+    with profile_stage('pyramid build'):
+        P0 = build_aggre_pyramid(img[refImage], upsampleRatios)
+    G0 = GradientPyramid(P0)
+    # all blocks have the geometry of the reference, their match upsampling index maps are computed once
+    plans = match_upsample_plans([p.shape for p in P0], param)
+    blocks = [i for i in range(N) if i != refImage]
+    flows[refImage] = np.zeros((hs, ws, 2))
 
+    if numWorkers > 1 and len(blocks) > 1:
+        shms_P0, P0_specs = share_arrays(P0)
+        shms_img, img_specs = share_arrays([np.stack(img)])
+        try:
+            with ProcessPoolExecutor(max_workers=min(numWorkers, len(blocks)), initializer=_init_worker,
+                                     initargs=(P0_specs, img_specs, param)) as executor:
+                results = executor.map(_align_block_worker, blocks)
+                for i, (flow, blockTicks) in tqdm(zip(blocks, results), total=len(blocks)):
+                    flows[i] = flow
+                    # Debug visualization
+                    if param['debug']:
+                        print(f'Block {i}: ', end='')
+                        # time of this block in its worker, as in the serial path
+                        timeBlockStart = cv2.getTickCount() - blockTicks
+                        debug_visualization(flows[i], imv[i], H, W, param, resultDir, i, timeBlockStart, patchSizes[0], numStrides)
+        finally:
+            release_arrays(shms_P0 + shms_img)
+        return flows
+
+    for i in tqdm(blocks):
         if param['debug']:
             print(f'Block {i}: ', end='')
         timeBlockStart = cv2.getTickCount()
 
-        P1 = build_aggre_pyramid(img[i], upsampleRatios)
-
-        ### Coarse-to-fine matching
-        bestMatch = coarse_to_fine_match(P0, P1, patchSizes, searchRadii, upsampleRatios, param)
-
-        ### Refine at finest level
-        flows[i] = refine_finest_level(P0[0], P1[0], bestMatch, patchSizes, patchStride, searchRadii[0], param)
+        flows[i] = align_block(P0, img[i], param, G0, plans)
 
         # Debug visualization
         if param['debug']:
             debug_visualization(flows[i], imv[i], H, W, param, resultDir, i, timeBlockStart, patchSizes[0], numStrides)
 
-    return flows
\ No newline at end of file
+    return flows
@@ -4,16 +4,17 @@ from qbp.utils.mleImage import mle_image
 import h5py
 from qbp.burst.patchAlign import patch_align
 from qbp.burst.patchAlignRefine import patch_align_refine
-from testing.TestFunctions import test_logger
+from qbp.burst.blockAggregation import WindowSumCache
+from qbp.utils.instrumentation import test_logger, profile_stage
 
 
 @test_logger
-def patch_align_binary(imbs, param):
+def patch_align_binary(imbs, param, cache=None):
     """
     Align binary sequence using patchAlign.
 
     Args:
-        imbs (list): 1D list of binary frames (numpy arrays).
+        imbs (list): 1D list of binary frames (numpy arrays) or a PackedPhotonCube.
         param (dict): Dictionary containing the following fields:
             - alignTWSize: window size for temporal reconstruction.
             - alignTWNum: number of temporal windows (determines total number of frames being used), > 2.
@@ -27,6 +28,7 @@ def patch_align_binary(imbs, param):
             - doRefine: do flow refinement.
             - resultDir: directory to save results in.
             - debug: whether or not to print debug information.
+        cache (WindowSumCache, optional): Window sums of imbs shared with other stages. Defaults to a new cache.
 
     Returns:
         tuple: (flows, flowrs)
@@ -34,9 +36,6 @@ def patch_align_binary(imbs, param):
             - flowrs: 1D list of refined flows.
     """
     N = len(imbs)
-    H = imbs[0].shape[0]
-    W = imbs[0].shape[1]
-    C = imbs[0].shape[2] if len(imbs[0].shape) == 3 else 1
     alignTWSize = param['alignTWSize']
     alignTWNum = param['alignTWNum']
     if alignTWSize * alignTWNum > N:
@@ -48,22 +47,18 @@ def patch_align_binary(imbs, param):
     refBlock = (refFrame - 1) // alignTWSize + 1  # in matlab indexing!
     param['refImage'] = refBlock
 
-    def frame_idx(i, j):
-        return (i - 1) * alignTWSize + j
-
     imgScale = param['imgScale']
     resultDir = param['resultDir']
 
-    blockAggres = []
-    for i in range(1, alignTWNum + 1):
-        S = np.zeros((H, W), dtype=param['dataType'])
-        # get blocks by merging TWSize number of individual frames
-        for j in range(1, alignTWSize + 1):
-            if C == 1:
-                S += imbs[frame_idx(i, j) - 1]
-            else:
-                S += np.mean(imbs[frame_idx(i, j) - 1], axis=2)
-        blockAggres.append(S / alignTWSize)
+    # window sums are streamed from the frames (or taken from the shared cache), the burst is never held in memory
+    # as a whole
+    if cache is None:
+        cache = WindowSumCache(imbs, param['dataType'])
+    with profile_stage('block aggregation'):
+        blockSums = cache.window_sums(0, alignTWSize, alignTWNum)
+        if blockSums.ndim == 4:
+            blockSums = np.mean(blockSums, axis=3)
+        blockAggres = [blockSums[i] / alignTWSize for i in range(alignTWNum)]
 
     if param['debug']:
         blockRecons = []
@@ -1,11 +1,11 @@
 import numpy as np
 from qbp.burst.patchAlign_subfuns.dc_findBestMatches import find_best_matches
 from qbp.burst.patchAlign_subfuns.dc_upsampleMatches import upsample_matches
-from testing.TestFunctions import test_logger
+from qbp.utils.instrumentation import test_logger
 
 
 @test_logger
-def coarse_to_fine_match(P0, P1, patchSizes, searchRadii, upsampleRatios, param):
+def coarse_to_fine_match(P0, P1, patchSizes, searchRadii, upsampleRatios, param, G0=None, G1=None, plans=None):
     numLevels = param['numLevels']
     dataType = param['dataType']
     l = numLevels - 1
@@ -19,14 +19,18 @@ def coarse_to_fine_match(P0, P1, patchSizes, searchRadii, upsampleRatios, param)
             print(f'L{level}:', end='')
 
         ### Match patches at current level
+        # derivatives cached in the gradient pyramids of P0 and P1, if given
+        templateGrads = G0.patch_gradients(level, patchSizes[level], patchSizes[level]) if G0 is not None else None
+        tgtGrads = G1.gradients(level) if G1 is not None else None
         bestMatch = find_best_matches(P0[level], P1[level], patchSizes[level], searchRadii[level],
-                                      initMatch, param)
+                                      initMatch, param, templateGrads, tgtGrads)
         bestMatch_in = bestMatch.copy()
 
         ### Upsample matches from previous level
         if level > 1:
             initMatch, bestMatch = upsample_matches(bestMatch_in, P1[level - 1],
                                                     patchSizes[level - 1], patchSizes[level],
-                                                    upsampleRatios[level], dataType)
+                                                    upsampleRatios[level], dataType,
+                                                    plans[level] if plans is not None else None)
 
     return bestMatch
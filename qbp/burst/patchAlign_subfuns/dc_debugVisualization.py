@@ -2,7 +2,7 @@ import numpy as np
 import cv2
 import os
 from qbp.utils.flow_eval.drawFlowHSV import draw_flow_hsv
-from testing.TestFunctions import test_logger
+from qbp.utils.instrumentation import test_logger
 
 
 @test_logger
@@ -1,37 +1,30 @@
 import numpy as np
-from qbp.burst.blockMatch2d import block_match_2d_multichannel
-from qbp.utils.lkAlign import lk_align
-from testing.TestFunctions import test_logger
+from numpy.lib.stride_tricks import sliding_window_view
+from qbp.burst.blockMatch2d import block_match_level
+from qbp.utils.lkAlign import lk_align_batch
+from qbp.utils.instrumentation import test_logger
 
 
 @test_logger
-def find_best_matches(refImg, tgtImg, patchSize, searchRadius, initMatch, param):
+def find_best_matches(refImg, tgtImg, patchSize, searchRadius, initMatch, param, templateGrads=None, tgtGrads=None):
     dataType = param['dataType']
     hl, wl = initMatch.shape[:2]
-    bestMatch = np.zeros((hl, wl, 2), dtype=dataType)
 
-    # loop over templates -> refImg patch is only defined by lb and ub
-    for j in range(hl):
-        for k in range(wl):
-            ylb = j * patchSize
-            xlb = k * patchSize
-            bestScore = float('inf')
-            currBest = np.zeros(2)
+    # block match all templates (refImg patches are only defined by lb and ub) and candidates at once
+    blockMatch, _ = block_match_level(refImg, tgtImg, patchSize, patchSize, searchRadius, initMatch)
 
-            for m in range(initMatch.shape[2]):
-                currMatch, currScore = block_match_2d_multichannel(refImg, tgtImg, [ylb+1, xlb+1],  # +1 because function expects Matlab indexing
-                                                                   patchSize, searchRadius,
-                                                                   initMatch[j, k, m, :])
-                if currScore < bestScore*0.9999:
-                    currBest = currMatch
-                    bestScore = currScore
+    # LK refinement of all patches at once
+    templates = sliding_window_view(refImg, (patchSize, patchSize))[::patchSize, ::patchSize][:hl, :wl]
+    lb = np.stack(np.meshgrid(np.arange(wl) * patchSize, np.arange(hl) * patchSize), axis=2)  # (xlb, ylb)
+    if templateGrads is not None:
+        templateGrads = tuple(g[:hl, :wl].reshape((-1, patchSize, patchSize)) for g in templateGrads)
+    tempf = lk_align_batch(templates.reshape((-1, patchSize, patchSize)),
+                           tgtImg,
+                           param['numLKIters'],
+                           (blockMatch + lb).reshape((-1, 2)),
+                           grads=tgtGrads,
+                           template_grads=templateGrads)
 
-            # LK refinement
-            tempf = lk_align(refImg[ylb:ylb + patchSize, xlb:xlb + patchSize],
-                             tgtImg,
-                             param['numLKIters'],
-                             currBest + np.array([xlb, ylb]).astype(np.float32))
+    bestMatch = (tempf.reshape((hl, wl, 2)) - lb).astype(dataType)
 
-            bestMatch[j, k, :] = tempf - np.array([xlb, ylb])
-
-    return bestMatch
\ No newline at end of file
+    return bestMatch
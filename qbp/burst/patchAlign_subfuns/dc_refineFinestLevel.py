@@ -1,43 +1,44 @@
 import numpy as np
-from qbp.burst.blockMatch2d import block_match_2d_multichannel
-from qbp.utils.lkAlign import lk_align
+from numpy.lib.stride_tricks import sliding_window_view
+from qbp.burst.blockMatch2d import block_match_level
+from qbp.utils.lkAlign import lk_align_batch
 from qbp.burst.patchAlign_subfuns.initializeMatchesFromLevel2 import initialize_matches_from_level2
-from testing.TestFunctions import test_logger
+from qbp.utils.instrumentation import test_logger
 
 
 @test_logger
-def refine_finest_level(refImg, tgtImg, bestMatch, patchSizes, patchStride, searchRadius, param):
+def refine_finest_level(refImg, tgtImg, bestMatch, patchSizes, patchStride, searchRadius, param, G0=None, G1=None,
+                        plan=None):
     dataType = param['dataType']
     H, W = refImg.shape[:2]
     hs = (H - patchSizes[0]) // patchStride + 1
     ws = (W - patchSizes[0]) // patchStride + 1
 
 
-    initMatch = initialize_matches_from_level2(bestMatch, patchSizes, patchStride, param, refImg.shape)
+    initMatch = initialize_matches_from_level2(bestMatch, patchSizes, patchStride, param, refImg.shape, plan)
 
     finalFlow = np.zeros((hs, ws, 2), dataType)
 
-    for j in range(hs):
-        for k in range(ws):
-            ylb = j * patchStride
-            xlb = k * patchStride
-            bestScore = float('inf')
-            currBest = np.zeros(2)
-            for m in range(initMatch.shape[2]):
-                currMatch, currScore = block_match_2d_multichannel(refImg, tgtImg, [ylb +1, xlb+1], # +1 because function expects Matlab indexing
-                                                                   patchSizes[0], searchRadius,
-                                                                   initMatch[j, k, m, :])
-                if currScore < bestScore*0.9999:
-                    currBest = currMatch
-                    bestScore = currScore
-
-            if not (param['fastMode'] and not param['doSR']):
-                tempf = lk_align(refImg[ylb:ylb + patchSizes[0], xlb:xlb + patchSizes[0]],
-                                 tgtImg,
-                                 param['numLKIters'],
-                                 currBest + np.array([xlb, ylb]))
-                finalFlow[j, k, :] = tempf - np.array([xlb, ylb])
-            else:
-                finalFlow[j, k, :] = currBest
+    # block match all patches and candidates at once
+    blockMatch, _ = block_match_level(refImg, tgtImg, patchSizes[0], patchStride, searchRadius, initMatch)
+
+    if not (param['fastMode'] and not param['doSR']):
+        # LK refinement of all patches at once
+        templates = sliding_window_view(refImg, (patchSizes[0], patchSizes[0]))[::patchStride, ::patchStride][:hs, :ws]
+        lb = np.stack(np.meshgrid(np.arange(ws) * patchStride, np.arange(hs) * patchStride), axis=2)  # (xlb, ylb)
+        # derivatives cached in the gradient pyramids of the reference and target image, if given
+        templateGrads = None
+        if G0 is not None:
+            templateGrads = tuple(g[:hs, :ws].reshape((-1, patchSizes[0], patchSizes[0]))
+                                  for g in G0.patch_gradients(0, patchSizes[0], patchStride))
+        tempf = lk_align_batch(templates.reshape((-1, patchSizes[0], patchSizes[0])),
+                               tgtImg,
+                               param['numLKIters'],
+                               (blockMatch + lb).reshape((-1, 2)),
+                               grads=G1.gradients(0) if G1 is not None else None,
+                               template_grads=templateGrads)
+        finalFlow[:] = tempf.reshape((hs, ws, 2)) - lb
+    else:
+        finalFlow[:] = blockMatch
 
     return finalFlow
\ No newline at end of file
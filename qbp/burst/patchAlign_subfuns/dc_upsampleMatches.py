@@ -5,11 +5,122 @@ import pickle
 from qbp.burst.buildAgrePyramid import build_aggre_pyramid
 from qbp.utils.ps_shape.param_from_json import param_from_json
 from testing.io import get_eng
-from testing.TestFunctions import test_logger
+from qbp.utils.instrumentation import test_logger
+
+
+class MatchUpsamplePlan:
+    """
+    Index map from the matches of a coarse level to the three initial candidates of every patch of a finer grid.
+
+    A finer patch at (yv, xv) in coarse patch units takes the match of the coarse patch (floor(yv), floor(xv)) and of
+    its vertical and horizontal neighbour on the side of the fractional position (the next one at the first row or
+    column, the previous one at the last). The map only depends on the image size, the patch sizes and the ratio, so
+    it is computed once per level and reused for all blocks; upsampling is then a single gather.
+    """
+
+    def __init__(self, yv, xv, coarseShape):
+        """
+        Args:
+            yv (numpy array): Positions of the finer patch rows in coarse patch units.
+            xv (numpy array): Positions of the finer patch columns in coarse patch units.
+            coarseShape (tuple): (hl, wl) shape of the coarse patch grid.
+        """
+        self.coarseShape = (int(coarseShape[0]), int(coarseShape[1]))
+        self.shape = (len(yv), len(xv))
+        yr = np.floor(yv).astype(int)
+        xr = np.floor(xv).astype(int)
+        # masking is performed to account for fractional positions. If true, a patch is shifted by +1, if false, by -1.
+        yrn = yr - 1
+        masky = ((yv % 1 >= 0.5) & (yr < self.coarseShape[0] - 1)) | (yr == 0)
+        yrn[masky] = yr[masky] + 1
+        xrn = xr - 1
+        maskx = ((xv % 1 >= 0.5) & (xr < self.coarseShape[1] - 1)) | (xr == 0)
+        xrn[maskx] = xr[maskx] + 1
+        # (hl, wl, 3) rows and columns of the candidates: (yr, xr), (yrn, xr) and (yr, xrn)
+        rows = np.stack(np.broadcast_arrays(yr[:, None], yrn[:, None], yr[:, None]), axis=2)
+        cols = np.stack(np.broadcast_arrays(xr[None, :], xr[None, :], xrn[None, :]), axis=2)
+        rows, cols = np.broadcast_arrays(rows, cols)
+        if rows.size and (rows.max() >= self.coarseShape[0] or cols.max() >= self.coarseShape[1]):
+            raise IndexError('The finer patch grid is not covered by the coarse patch grid.')
+        # flat indices into the (hl * wl, 2) matches
+        self.index = rows * self.coarseShape[1] + cols
+
+    @classmethod
+    def for_level(cls, tgtShape, finerPatchSize, coarserPatchSize, ratio, coarseShape):
+        """
+        Plan of upsample_matches: non-overlapping patches of the finer level.
+
+        Args:
+            tgtShape (tuple): Shape of the finer level.
+            finerPatchSize (int): Patch size of the finer level.
+            coarserPatchSize (int): Patch size of the coarser level.
+            ratio (float): Upsampling ratio between the levels.
+            coarseShape (tuple): Shape of the coarse patch grid.
+        """
+        hl = tgtShape[0] // finerPatchSize
+        wl = tgtShape[1] // finerPatchSize
+        yv = np.arange(hl) * finerPatchSize / ratio / coarserPatchSize
+        xv = np.arange(wl) * finerPatchSize / ratio / coarserPatchSize
+        return cls(yv, xv, coarseShape)
+
+    @classmethod
+    def for_finest_level(cls, refShape, patchSizes, patchStride, ratio, coarseShape):
+        """
+        Plan of initialize_matches_from_level2: overlapping patches of the finest level from the matches of level 1.
+
+        Args:
+            refShape (tuple): Shape of the finest level.
+            patchSizes (list): Patch sizes of all levels.
+            patchStride (int): Stride of the finest level patches.
+            ratio (float): Upsampling ratio between level 1 and the finest level.
+            coarseShape (tuple): Shape of the patch grid of level 1.
+        """
+        yv = np.arange(0, refShape[0] - patchSizes[0] + 1, patchStride) / ratio / patchSizes[1]
+        xv = np.arange(0, refShape[1] - patchSizes[0] + 1, patchStride) / ratio / patchSizes[1]
+        return cls(yv, xv, coarseShape)
+
+    def gather(self, bestMatch, dataType):
+        """
+        Initial candidates from the (already scaled) coarse matches.
+
+        Args:
+            bestMatch (numpy array): (hl, wl, 2) matches of the coarse level.
+            dataType: numpy dtype of the result.
+
+        Returns:
+            numpy array: (hl, wl, 3, 2) initial matches of the finer level.
+        """
+        assert bestMatch.shape[:2] == self.coarseShape
+        # np.take along the first axis is much faster than fancy indexing for row gathers
+        return np.take(np.reshape(bestMatch, (-1, 2)), self.index, axis=0).astype(dataType, copy=False)
+
+
+def match_upsample_plans(shapes, param):
+    """
+    Upsampling plans of all levels of a pyramid geometry, see MatchUpsamplePlan.
+
+    Args:
+        shapes (list): Shapes of the pyramid levels, finest first.
+        param (dict): Parameters, uses numLevels, patchSizes and upsampleRatios.
+
+    Returns:
+        dict: The plan of upsample_matches from each level > 1 to the next finer one, and under key 0 the plan of
+            initialize_matches_from_level2 (if numLevels > 1).
+    """
+    patchSizes = param['patchSizes']
+    upsampleRatios = param['upsampleRatios']
+    coarseShapes = [(s[0] // p, s[1] // p) for s, p in zip(shapes, patchSizes)]
+    plans = {level: MatchUpsamplePlan.for_level(shapes[level - 1], patchSizes[level - 1], patchSizes[level],
+                                                upsampleRatios[level], coarseShapes[level])
+             for level in range(2, param['numLevels'])}
+    if param['numLevels'] > 1:
+        plans[0] = MatchUpsamplePlan.for_finest_level(shapes[0], patchSizes, patchSizes[0] // 2, upsampleRatios[1],
+                                                      coarseShapes[1])
+    return plans
 
 
 @test_logger
-def upsample_matches(bestMatch, tgtImg, finerPatchSize, coarserPatchSize, ratio, dataType):
+def upsample_matches(bestMatch, tgtImg, finerPatchSize, coarserPatchSize, ratio, dataType, plan=None):
     """
     Args:
         bestMatch: Contains the results of the previous matching step
@@ -18,41 +129,16 @@ def upsample_matches(bestMatch, tgtImg, finerPatchSize, coarserPatchSize, ratio,
         coarserPatchSize:
         ratio:
         dataType:
+        plan: MatchUpsamplePlan of this geometry, e.g. from match_upsample_plans. Computed if not given.
 
     Returns:
 
     Notes: bestMatch
     """
-
-    hl = tgtImg.shape[0] // finerPatchSize
-    wl = tgtImg.shape[1] // finerPatchSize
-    initMatch = np.zeros((hl, wl, 3, 2), dtype=dataType)
+    if plan is None:
+        plan = MatchUpsamplePlan.for_level(tgtImg.shape, finerPatchSize, coarserPatchSize, ratio, bestMatch.shape)
 
     bestMatch = np.round(bestMatch * ratio)
-    yv = np.arange(hl) * finerPatchSize / ratio / coarserPatchSize
-    xv = np.arange(wl) * finerPatchSize / ratio / coarserPatchSize
-    yr = np.floor(yv).astype(int)
-    xr = np.floor(xv).astype(int)
-
-    # Create a grid of indices to ensure all combinations are covered
-    grid_y, grid_x = np.meshgrid(yr, xr, indexing='ij')
-    initMatch[:, :, 0, 1] = bestMatch[grid_y, grid_x, 1]
-    initMatch[:, :, 0, 0] = bestMatch[grid_y, grid_x, 0]
-
-    yrn = yr - 1
-    # masking is performed to account for fractional positions. If true, a pixel is shifted up, if false, it is not.
-    masky = ((yv % 1 >= 0.5) & (yr < bestMatch.shape[0]-1)) | (yr == 0)
-    yrn[masky] = yr[masky] + 1 # shift up by one
-    grid_y, grid_x = np.meshgrid(yrn, xr, indexing='ij')
-    initMatch[:, :, 1, 1] = bestMatch[grid_y, grid_x, 1]
-    initMatch[:, :, 1, 0] = bestMatch[grid_y, grid_x, 0]
-
-    xrn = xr - 1
-    maskx = ((xv % 1 >= 0.5) & (xr < bestMatch.shape[1]-1)) | (xr == 0)
-    xrn[maskx] = xr[maskx] + 1 # shift right by one
-    grid_y, grid_x = np.meshgrid(yr, xrn, indexing='ij')
-    initMatch[:, :, 2, 1] = bestMatch[grid_y, grid_x, 1]
-    initMatch[:, :, 2, 0] = bestMatch[grid_y, grid_x, 0]
-
-
-    return initMatch, bestMatch
\ No newline at end of file
+    initMatch = plan.gather(bestMatch, dataType)
+
+    return initMatch, bestMatch
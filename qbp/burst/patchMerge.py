@@ -1,7 +1,54 @@
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from qbp.single_photon_imaging.src.window_fns.raised_cos_window_2D import raised_cos_window_2D
-from qbp.single_photon_imaging.src.merge.wiener_denoise_t import wiener_denoise_t
-from testing.TestFunctions import test_logger
+from qbp.single_photon_imaging.src.merge.wiener_denoise_t import wiener_denoise_t_batch
+from qbp.utils.sharedArrays import share_arrays, attach_arrays, release_arrays
+from qbp.utils.instrumentation import test_logger
+
+
+def denoise_patch_rows(patches, c, rows, patchSize, wienerC, max_elements=2 ** 22, fftWorkers=None):
+	"""
+	Wiener denoise all patches of the given patch rows of one channel.
+
+	Args:
+		patches: 4D numpy array of pre-aligned blocks of size (hs * patchSize, ws * patchSize, C, N)
+		c: channel index
+		rows: consecutive range of patch rows
+		patchSize: size of the patches
+		wienerC: tuning parameter C for Wiener filtering
+		max_elements: upper bound for the number of patch pixels that are denoised in one batch
+		fftWorkers: if set, the FFTs use scipy.fft with this number of threads (-1 uses all cores)
+
+	Returns:
+		Sdenoised: denoised patches of size (len(rows), ws, patchSize, patchSize)
+	"""
+	ws = patches.shape[1] // patchSize
+	N = patches.shape[3]
+	Sdenoised = np.zeros((len(rows), ws, patchSize, patchSize))
+	# batches of whole patch rows with bounded memory
+	chunk = max(1, max_elements // (ws * patchSize * patchSize * N))
+	for n in range(0, len(rows), chunk):
+		i0 = rows[n]
+		i1 = rows[min(n + chunk, len(rows)) - 1] + 1
+		patch_rows = patches[i0 * patchSize:i1 * patchSize, :ws * patchSize, c:c + 1, :]
+		Sdenoised[n:n + i1 - i0] = wiener_denoise_t_batch(patch_rows, patchSize, wienerC, workers=fftWorkers)[:, :, 0]
+	return Sdenoised
+
+
+# state of a worker process, set once by _init_worker
+_worker = {}
+
+
+def _init_worker(patches_specs):
+	# attach to the shared patches, they are not pickled per task
+	shms, patches = attach_arrays(patches_specs)
+	_worker['shms'] = shms
+	_worker['patches'] = patches[0]
+
+
+def _denoise_patch_rows_worker(args):
+	c, rows, patchSize, wienerC, fftWorkers = args
+	return denoise_patch_rows(_worker['patches'], c, rows, patchSize, wienerC, fftWorkers=fftWorkers)
 
 
 @test_logger
@@ -20,6 +67,10 @@ def patch_merge(patches, param):
             - H: height of the final output image
             - W: width of the final output image
             - dataType: numpy dtype for the final output
+            - numWorkers (optional): if > 1, the patch grid is split into row bands that are denoised in a
+              process pool. The overlap-add is done afterwards in the serial order, so the result is identical.
+            - fftWorkers (optional): if set, the FFTs of the Wiener filter use scipy.fft with this number of
+              threads (-1 uses all cores) instead of numpy.fft.
 
     Returns:
         S: Merged image of size (H, W, C)
@@ -34,6 +85,8 @@ def patch_merge(patches, param):
 	patchStride = patchSize // 2
 
 	refImage = param['refImage']
+	numWorkers = int(param.get('numWorkers', 1))
+	fftWorkers = param.get('fftWorkers')
 
 	winWeights = raised_cos_window_2D(patchSize, patchSize)
 
@@ -41,31 +94,44 @@ def patch_merge(patches, param):
 	hs = Hp // patchSize
 	ws = Wp // patchSize
 
+	# Swap the central block and the first block
 	for c in range(C):
-		# Swap the central block and the first block
 		patches_ = patches.copy()
 		patches[:, :, c, 0] = patches_[:, :, c, refImage-1]
 		patches[:, :, c, refImage-1] = patches_[:, :, c, 0]
 
+	# Denoise all patches
+	if param['debug']:
+		print('Block merging...')
+	if numWorkers > 1 and hs > 1:
+		# several bands per worker to balance the load
+		bands = np.array_split(np.arange(hs), min(hs, 4 * numWorkers))
+		tasks = [(c, rows, patchSize, param['wienerC'], fftWorkers) for c in range(C) for rows in bands]
+		shms, patches_specs = share_arrays([patches])
+		try:
+			with ProcessPoolExecutor(max_workers=numWorkers, initializer=_init_worker,
+									 initargs=(patches_specs,)) as executor:
+				results = list(executor.map(_denoise_patch_rows_worker, tasks))
+		finally:
+			release_arrays(shms)
+		Sdenoised = [np.concatenate(results[c * len(bands):(c + 1) * len(bands)]) for c in range(C)]
+	else:
+		Sdenoised = [denoise_patch_rows(patches, c, range(hs), patchSize, param['wienerC'], fftWorkers=fftWorkers)
+					  for c in range(C)]
+
+	for c in range(C):
 		# Merge all blocks
 		Sa = np.zeros((H, W), dtype=param['dataType'])
 		accWeights = np.zeros((H, W), dtype=param['dataType'])
-		if param['debug']:
-			print('Block merging...')
 
 		for i in range(hs):
 			if param['debug']:
 				print(f"{i}", end="")
 			for j in range(ws):
-				ylb = i * patchSize
-				xlb = j * patchSize
-				patch_stack = patches[ylb:ylb + patchSize, xlb:xlb + patchSize, c, :]
-				Sdenoised = wiener_denoise_t(patch_stack, param['wienerC'])
-
 				ylb = i * patchStride
 				xlb = j * patchStride
 
-				Sa[ylb:ylb + patchSize, xlb:xlb + patchSize] += Sdenoised * winWeights
+				Sa[ylb:ylb + patchSize, xlb:xlb + patchSize] += Sdenoised[c][i, j] * winWeights
 				accWeights[ylb:ylb + patchSize, xlb:xlb + patchSize] += winWeights
 
 				if param['debug']:
@@ -77,4 +143,4 @@ def patch_merge(patches, param):
 		imo[:, :, c] = Sa
 
 	imo[imo < 0] = 0
-	return imo
\ No newline at end of file
+	return imo
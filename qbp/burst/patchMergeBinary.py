@@ -1,7 +1,8 @@
 import numpy as np
-from qbp.utils.interp2 import interp2
+from qbp.burst.patchWarp import PatchWarper, FrameFlows
 from qbp.burst.patchMerge import patch_merge
-from testing.TestFunctions import test_logger
+from qbp.utils.ps_shape.packed_photon_cube import PackedPhotonCube
+from qbp.utils.instrumentation import test_logger, profile_stage
 
 
 @test_logger
@@ -36,133 +37,97 @@ def patch_merge_binary(imbs, flows, param, phase_ids):
     def frameIdx(i, j):
         return (i - 1) * mergeTWSize + j
 
-    def alignSub(idx):
-        i = np.floor((idx - 1) / alignTWSize) + 1
-        j = np.mod(idx - 1, alignTWSize) + 1
-        return i, j
-
     imgScale = param['imgScale']
 
     if alignTWNum == 1:
         assert mergeTWNum == 1 and alignTWSize == mergeTWSize
         S = np.zeros(imbs[0].shape, dtype=param['dataType'])
-        for i in range(0,alignTWSize):
-            S += imbs[frameIdx(1, i)]
+        if isinstance(imbs, PackedPhotonCube):
+            S += imbs.window_sum(frameIdx(1, 0), frameIdx(1, alignTWSize))
+        else:
+            for i in range(0,alignTWSize):
+                S += imbs[frameIdx(1, i)]
         print("Merging done.")
         return S
 
     alignCenFrame = (refFrame - 1) % alignTWSize + 1
 
-    flowsr = [None] * int(alignTWNum + 2)
-    for i in range(int(alignTWNum)):
-        flowsr[i + 1] = flows[i]
-    flowsr[0] = 2 * flowsr[1] - flowsr[2]
-    flowsr[-1] = 2 * flowsr[-2] - flowsr[-3]
-
-    def interpFlow(i, j):
-        idx = frameIdx(i, j)
-        ai, aj = alignSub(idx)
-        if aj < alignCenFrame:
-            return ((alignCenFrame - aj) / alignTWSize) * flowsr[int(ai) - 1] + \
-                   ((aj + alignTWSize - alignCenFrame) / alignTWSize) * flowsr[int(ai)]
-        else:
-            return ((alignCenFrame + alignTWSize - aj) / alignTWSize) * flowsr[int(ai)] + \
-                   ((aj - alignCenFrame) / alignTWSize) * flowsr[int(ai) + 1]
+    frameFlows = FrameFlows(flows[:alignTWNum], alignTWSize, alignCenFrame)
 
     hs = int((H - patchSize) / patchStride + 1)
     ws = int((W - patchSize) / patchStride + 1)
-    yv = np.repeat(np.arange(0, hs) * patchStride, patchSize) + np.tile(np.arange(1, patchSize + 1), hs)
-    xv = np.repeat(np.arange(0, ws) * patchStride, patchSize) + np.tile(np.arange(1, patchSize + 1), ws)
-    X, Y = np.meshgrid(xv, yv)
-
-    if phase_ids is not None and np.any(phase_ids):
-        blockPatches = np.zeros((int(hs * patchSize), int(ws * patchSize), num_ls, mergeTWNum), dtype=param['dataType'])
-        # Readjust images using the per-frame flow
-        for i in range(1, mergeTWNum + 1):
-            Sb = np.zeros_like(blockPatches[:, :, :, 0])
-            countMap = np.zeros_like(Sb)
-
-            for j in range(1, mergeTWSize + 1):
-                phase = int(phase_ids[frameIdx(i, j) - 1])
-                curFlow = interpFlow(i, j)
-                flowwarp = np.repeat(np.repeat(curFlow, patchSize, axis=0), patchSize, axis=1)
-
-                curFrame = np.array(imbs[frameIdx(i, j) - 1], dtype=float)
-
-                if param["fastMode"]:
-                    method = 'nearest'
-                else:
-                    method = 'linear'
-                imbwarped = interp2(curFrame, X + flowwarp[:, :, 0], Y + flowwarp[:, :, 1], method=method, indexing="mat")
-
-                countMap[:, :, phase] += np.isfinite(imbwarped)
-                imbwarped = np.array(imbwarped)
-                imbwarped[np.isnan(imbwarped)] = 0
-                Sb[:, :, phase] += imbwarped
-
-            countMap[countMap == 0] = 1 # avoid division by zero, if countMap is 0, the corresponding pixel will also be 0
-            Sb /= countMap
-            blockPatches[:, :, :, i - 1] = Sb
-    else: #  standard matching without phases
-        blockPatches = np.zeros((hs * patchSize, ws * patchSize, C, mergeTWNum), dtype=param['dataType'])
-        for c in range(C):
-            print(f'Pre-warping Channel {c + 1}...')
-            for i in range(1,mergeTWNum+1):
-                Sb = np.zeros((hs * patchSize, ws * patchSize), dtype=param['dataType'])
-                countMap = np.zeros_like(Sb, dtype=param['dataType'])
-                if param.get('debug', False):
-                    print('.')
-                if 'warpTWSize' in param and param['warpTWSize'] > 1:
-                    # this code section allows to treat sets of frames in merging by taking their average. This is
-                    # computationally more efficient, but introduces blur in the final image.
-                    warpTWSize = param['warpTWSize']
-                    mergeTWSize = param['mergeTWSize']
-                    assert mergeTWSize % warpTWSize == 0, "mergeTWSize must be divisible by warpTWSize"
-                    warpTWNum = mergeTWSize // warpTWSize
-                    for j in range(warpTWNum):
-                        curFlow = interpFlow(i, 1+((j) * warpTWSize + (warpTWSize + 1) // 2))
-                        flowwarp = np.repeat(curFlow, patchSize, axis=0).repeat(patchSize, axis=1)
-                        curFrame = np.zeros((H,W), dtype=param['dataType'])
-                        for k in range(warpTWSize):  # sum of images along
-                            frame_idx = frameIdx(i, j * warpTWSize + k)
-                            if C == 1:
-                                curFrame += imbs[frame_idx].astype(np.float64)
+    phased = phase_ids is not None and np.any(phase_ids)
+    # warps the frames onto the patch grid, the buffers of the warper are reused for all frames
+    if param.get('fastMode', False) and (phased or param.get('warpTWSize', 1) <= 1):
+        warper = PatchWarper(H, W, hs, ws, patchSize, method='nearest')
+    else:
+        warper = PatchWarper(H, W, hs, ws, patchSize, method='linear')
+
+    # warp the frames of each merge block onto the patch grid and average them
+    with profile_stage('warp'):
+        if phased:
+            blockPatches = np.zeros((int(hs * patchSize), int(ws * patchSize), num_ls, mergeTWNum), dtype=param['dataType'])
+            # Readjust images using the per-frame flow
+            for i in range(1, mergeTWNum + 1):
+                Sb = np.zeros_like(blockPatches[:, :, :, 0])
+                countMap = np.zeros_like(Sb)
+
+                for j in range(1, mergeTWSize + 1):
+                    phase = int(phase_ids[frameIdx(i, j) - 1])
+                    curFlow = frameFlows(frameIdx(i, j))
+                    warper.accumulate(imbs[frameIdx(i, j) - 1], curFlow, Sb[:, :, phase], countMap[:, :, phase])
+
+                countMap[countMap == 0] = 1 # avoid division by zero, if countMap is 0, the corresponding pixel will also be 0
+                Sb /= countMap
+                blockPatches[:, :, :, i - 1] = Sb
+        else: #  standard matching without phases
+            blockPatches = np.zeros((hs * patchSize, ws * patchSize, C, mergeTWNum), dtype=param['dataType'])
+            for c in range(C):
+                print(f'Pre-warping Channel {c + 1}...')
+                for i in range(1,mergeTWNum+1):
+                    Sb = np.zeros((hs * patchSize, ws * patchSize), dtype=param['dataType'])
+                    countMap = np.zeros_like(Sb, dtype=param['dataType'])
+                    if param.get('debug', False):
+                        print('.')
+                    if 'warpTWSize' in param and param['warpTWSize'] > 1:
+                        # this code section allows to treat sets of frames in merging by taking their average. This is
+                        # computationally more efficient, but introduces blur in the final image.
+                        warpTWSize = param['warpTWSize']
+                        mergeTWSize = param['mergeTWSize']
+                        assert mergeTWSize % warpTWSize == 0, "mergeTWSize must be divisible by warpTWSize"
+                        warpTWNum = mergeTWSize // warpTWSize
+                        for j in range(warpTWNum):
+                            curFlow = frameFlows(frameIdx(i, 1+((j) * warpTWSize + (warpTWSize + 1) // 2)))
+                            curFrame = np.zeros((H,W), dtype=param['dataType'])
+                            if isinstance(imbs, PackedPhotonCube):
+                                # count photons directly on the packed frames
+                                curFrame += imbs.window_sum(frameIdx(i, j * warpTWSize), frameIdx(i, (j + 1) * warpTWSize))
                             else:
-                                curFrame += imbs[frame_idx][:, :, c].astype(np.float64)
-                        interp = interp2(curFrame, X + flowwarp[:, :, 0], Y + flowwarp[:, :, 1], method='linear',
-                                indexing="mat")
-                        imbwarped = interp
-                        countMap += np.isfinite(imbwarped) * warpTWSize
-                        imbwarped[~np.isfinite(imbwarped)] = 0
-                        Sb += imbwarped
-                else:
-                    mergeTWSize = param['mergeTWSize']
-                    for j in range(1,mergeTWSize+1):
-                        curFlow = interpFlow(i, j)
-                        flowwarp = np.repeat(curFlow, patchSize, axis=0).repeat(patchSize, axis=1)
-                        frame_idx = frameIdx(i, j)
+                                for k in range(warpTWSize):  # sum of images along
+                                    frame_idx = frameIdx(i, j * warpTWSize + k)
+                                    if C == 1:
+                                        curFrame += imbs[frame_idx].astype(np.float64)
+                                    else:
+                                        curFrame += imbs[frame_idx][:, :, c].astype(np.float64)
+                            warper.accumulate(curFrame, curFlow, Sb, countMap, warpTWSize)
+                    else:
+                        mergeTWSize = param['mergeTWSize']
                         if C==1:
-                            curFrame = imbs[frame_idx-1].astype(np.float64)
-                        else:
-                            curFrame = imbs[frame_idx-1][:, :, c].astype(np.float64)
-                        if param.get('fastMode', False):
-                            interp = interp2(curFrame, X + flowwarp[:, :, 0], Y + flowwarp[:, :, 1], method='nearest',
-                                    indexing="mat")
+                            curFrames = (imbs[frameIdx(i, j)-1] for j in range(1,mergeTWSize+1))
                         else:
-                            interp = interp2(curFrame, X + flowwarp[:, :, 0], Y + flowwarp[:, :, 1], method='linear',
-                                    indexing="mat")
-                        imbwarped = interp
-                        countMap += np.isfinite(imbwarped)
-                        imbwarped[~np.isfinite(imbwarped)] = 0
-                        Sb += imbwarped
-                countMap[countMap == 0] = 1
-                Sb /= countMap
-                blockPatches[:, :, c, i-1] = Sb
+                            curFrames = (imbs[frameIdx(i, j)-1][:, :, c] for j in range(1,mergeTWSize+1))
+                        curFlows = (frameFlows(frameIdx(i, j)) for j in range(1,mergeTWSize+1))
+                        # in fastMode (nearest), frames with the same rounded shift of a patch are summed before warping
+                        warper.accumulate_frames(curFrames, curFlows, Sb, countMap)
+                    countMap[countMap == 0] = 1
+                    Sb /= countMap
+                    blockPatches[:, :, c, i-1] = Sb
 
     # Wiener merge
     param['H'] = H
     param['W'] = W
-    S = patch_merge(blockPatches, param) # fine-alignment (LK) and merge
+    with profile_stage('Wiener merge'):
+        S = patch_merge(blockPatches, param) # fine-alignment (LK) and merge
     S = np.array(S) * float(mergeTWNum * mergeTWSize)
     print("Merging done.")
 
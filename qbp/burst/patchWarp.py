@@ -0,0 +1,364 @@
+import math
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+if njit is not None:
+    @njit(cache=True, nogil=True)
+    def _warp_accumulate(frame, Y, X, flow, nearest, Sb, countMap, weight):
+        # fused PatchWarper.warp and accumulation, same operations per pixel as the NumPy version
+        H, W = frame.shape
+        hs, P = Y.shape
+        ws = X.shape[0]
+        for pi in range(hs):
+            for py in range(P):
+                y = pi * P + py
+                for pj in range(ws):
+                    fx = flow[pi, pj, 0]
+                    fy = flow[pi, pj, 1]
+                    for px in range(P):
+                        r = (Y[pi, py] + fy) - 1
+                        c = (X[pj, px] + fx) - 1
+                        if not (r >= 0 and r <= H - 1 and c >= 0 and c <= W - 1):
+                            continue
+                        if nearest:
+                            val = float(frame[int(math.floor(r + 0.5)), int(math.floor(c + 0.5))])
+                        else:
+                            i0 = min(max(math.floor(r), 0.0), H - 2.0)
+                            j0 = min(max(math.floor(c), 0.0), W - 2.0)
+                            wr = r - i0
+                            wc = c - j0
+                            i = int(i0)
+                            j = int(j0)
+                            val = frame[i, j] * (1 - wr) * (1 - wc)
+                            val = val + frame[i, j + 1] * (1 - wr) * wc
+                            val = val + frame[i + 1, j] * wr * (1 - wc)
+                            val = val + frame[i + 1, j + 1] * wr * wc
+                        x = pj * P + px
+                        Sb[y, x] += val
+                        countMap[y, x] += weight
+else:
+    _warp_accumulate = None
+
+
+class PatchWarper:
+    """
+    Warp frames onto the patch grid of patch_merge_binary.
+
+    For a frame and a per-patch flow, warp gives the same values as
+        interp2(frame, X + flowwarp[:, :, 0], Y + flowwarp[:, :, 1], method=method, indexing="mat")
+    with X, Y the 1-based pixel coordinates of the patch grid and flowwarp the flow repeated over the pixels of each
+    patch, but without building an interpolator per frame. For the linear method, integer indices and bilinear
+    weights are computed from the flow with a few array operations and the frame is gathered with np.take. For the
+    nearest method, the per-patch flow is an integer shift of each patch, which is copied as a rectangular block from
+    the frame. All intermediate arrays and the output are preallocated once and reused for every frame.
+    Pixels whose query point falls outside the frame (NaN in interp2) are 0 in the output and False in valid.
+    """
+
+    def __init__(self, H, W, hs, ws, patchSize, method='linear'):
+        """
+        Args:
+            H (int): Frame height.
+            W (int): Frame width.
+            hs (int): Number of patches along the height.
+            ws (int): Number of patches along the width.
+            patchSize (int): Patch size, patches overlap by half their size.
+            method (str): 'linear' or 'nearest'.
+        """
+        if method not in ('linear', 'nearest'):
+            raise ValueError(f"Invalid method: {method}. Choose from 'linear', 'nearest'.")
+        self.H = H
+        self.W = W
+        self.method = method
+        self.patchSize = patchSize
+        patchStride = patchSize // 2
+        # 1-based pixel coordinates of the patch grid, as (patch, pixel in patch)
+        self._Y = (np.arange(hs) * patchStride)[:, None] + np.arange(1, patchSize + 1)
+        self._X = (np.arange(ws) * patchStride)[:, None] + np.arange(1, patchSize + 1)
+        shape4 = (hs, patchSize, ws, patchSize)
+        shape = (hs * patchSize, ws * patchSize)
+        self.valid = np.empty(shape, dtype=bool)
+        self.out = np.empty(shape)
+        if method == 'linear':
+            # query coordinates (0-based), computed as (hs, patchSize, ws, patchSize) and used as (hs * P, ws * P)
+            self._r4 = np.empty(shape4)
+            self._c4 = np.empty(shape4)
+            self._r = self._r4.reshape(shape)
+            self._c = self._c4.reshape(shape)
+            self._idx = np.empty(shape, dtype=np.intp)
+            self._col = np.empty(shape, dtype=np.intp)
+            self._tmp = np.empty(shape)
+            self._mask = np.empty(shape, dtype=bool)
+            self._wr = np.empty(shape)
+            self._wc = np.empty(shape)
+        else:
+            # frame with a border of one patch, so that shifted patches can be copied as blocks
+            self._padded = np.zeros((H + 2 * patchSize, W + 2 * patchSize))
+            self._pi, self._pj = [a.ravel() for a in np.meshgrid(np.arange(hs), np.arange(ws), indexing='ij')]
+
+    def warp(self, frame, flow):
+        """
+        Warp a frame with a per-patch flow.
+
+        Args:
+            frame (numpy array): (H, W) frame.
+            flow (numpy array): (hs, ws, 2) flow, x displacement first.
+
+        Returns:
+            tuple: (out, valid)
+                - out: (hs * patchSize, ws * patchSize) warped frame, 0 where the query point is outside the frame.
+                - valid: boolean mask of the pixels whose query point is inside the frame.
+            Both arrays are buffers of the warper, they are overwritten by the next call.
+        """
+        if self.method == 'nearest':
+            return self._warp_nearest(frame, flow)
+
+        H, W = self.H, self.W
+        r, c = self._r, self._c
+        # same operations as interp2 with indexing="mat": (Y + flowwarp) - 1
+        np.add(self._Y[:, :, None, None], flow[:, None, :, None, 1], out=self._r4)
+        np.add(self._X[None, None, :, :], flow[:, None, :, None, 0], out=self._c4)
+        np.subtract(r, 1, out=r)
+        np.subtract(c, 1, out=c)
+
+        # query points inside the frame, NaN flows are outside as well
+        valid = self.valid
+        np.greater_equal(r, 0, out=valid)
+        valid &= np.less_equal(r, H - 1, out=self._mask)
+        valid &= np.greater_equal(c, 0, out=self._mask)
+        valid &= np.less_equal(c, W - 1, out=self._mask)
+        np.logical_not(valid, out=self._mask)
+        r[self._mask] = 0
+        c[self._mask] = 0
+
+        frame = np.ascontiguousarray(frame, dtype=np.float64).reshape(-1)
+        out = self.out
+        idx, col, tmp = self._idx, self._col, self._tmp
+        # lower grid index (clipped to the second to last one as in RegularGridInterpolator) and weights
+        wr, wc = self._wr, self._wc
+        np.floor(r, out=tmp)
+        np.clip(tmp, 0, H - 2, out=tmp)
+        np.subtract(r, tmp, out=wr)
+        np.copyto(idx, tmp, casting='unsafe')
+        np.floor(c, out=tmp)
+        np.clip(tmp, 0, W - 2, out=tmp)
+        np.subtract(c, tmp, out=wc)
+        np.copyto(col, tmp, casting='unsafe')
+        idx *= W
+        idx += col
+        # same order of operations as RegularGridInterpolator:
+        # v00 * (1 - wr) * (1 - wc) + v01 * (1 - wr) * wc + v10 * wr * (1 - wc) + v11 * wr * wc
+        r = np.subtract(1, wr, out=r)
+        c = np.subtract(1, wc, out=c)
+        np.take(frame, idx, out=out)
+        out *= r
+        out *= c
+        idx += 1
+        np.take(frame, idx, out=tmp)
+        tmp *= r
+        tmp *= wc
+        out += tmp
+        idx += W - 1
+        np.take(frame, idx, out=tmp)
+        tmp *= wr
+        tmp *= c
+        out += tmp
+        idx += 1
+        np.take(frame, idx, out=tmp)
+        tmp *= wr
+        tmp *= wc
+        out += tmp
+        out[self._mask] = 0
+        return out, valid
+
+    def _warp_nearest(self, frame, flow):
+        hs, ws = flow.shape[:2]
+        P = self.patchSize
+        rows, cols = self._patch_indices(flow)
+        self._padded[P:P + self.H, P:P + self.W] = frame
+        vals, valid = self._gather_patches(self._padded, self._pi, self._pj, rows.reshape(-1, P), cols.reshape(-1, P))
+        # (patch row, patch column, y, x) -> (patch row, y, patch column, x)
+        self.out.reshape(hs, P, ws, P)[...] = vals.reshape(hs, ws, P, P).transpose(0, 2, 1, 3)
+        self.valid.reshape(hs, P, ws, P)[...] = valid.reshape(hs, ws, P, P).transpose(0, 2, 1, 3)
+        return self.out, self.valid
+
+    def accumulate(self, frame, flow, Sb, countMap, weight=1):
+        """
+        Warp a frame and add it to Sb, add weight to countMap where the warped frame is valid.
+
+        With numba this is a single fused pass over the patch grid, otherwise warp is followed by two in-place
+        additions. Both give the same result.
+
+        Args:
+            frame (numpy array): (H, W) frame.
+            flow (numpy array): (hs, ws, 2) flow, x displacement first.
+            Sb (numpy array): (hs * patchSize, ws * patchSize) sum of the warped frames, updated in place.
+            countMap (numpy array): Same shape as Sb, number of valid frames per pixel, updated in place.
+            weight (int): Number of frames the frame stands for.
+        """
+        if _warp_accumulate is not None:
+            _warp_accumulate(np.asarray(frame), self._Y, self._X, np.asarray(flow, dtype=np.float64),
+                             self.method == 'nearest', Sb, countMap, weight)
+            return
+        out, valid = self.warp(frame, flow)
+        Sb += out
+        np.add(countMap, weight, out=countMap, where=valid)
+
+    def accumulate_frames(self, frames, flows, Sb, countMap):
+        """
+        Warp a sequence of frames and add them to Sb and countMap, same result as calling accumulate for every frame.
+
+        In nearest mode, a patch of a warped frame gathers whole rows and columns of the frame, given by the rounded
+        patch flow. As long as these rows and columns stay the same from one frame to the next, the sum of the warped
+        frames equals the warped sum of the frames. Each patch is therefore gathered from the running sum of the
+        frames only where its rounded shift changes, i.e. O(distinct shifts) instead of O(frames) gathers per patch.
+        The sums are kept in integers, so this is exact for integer frames (photon counts). Other frames and the
+        linear method are warped frame by frame.
+
+        Args:
+            frames: Iterable of (H, W) frames.
+            flows: Iterable of (hs, ws, 2) flows, one per frame. A flow is used before the next one is requested.
+            Sb (numpy array): (hs * patchSize, ws * patchSize) sum of the warped frames, updated in place.
+            countMap (numpy array): Same shape as Sb, number of valid frames per pixel, updated in place.
+        """
+        frames = iter(frames)
+        flows = iter(flows)
+        first = next(frames, None)
+        if first is None:
+            return
+        frame_is_int = np.issubdtype(np.asarray(first).dtype, np.integer) or np.asarray(first).dtype == bool
+        if self.method != 'nearest' or not frame_is_int:
+            self.accumulate(first, next(flows), Sb, countMap)
+            for frame, flow in zip(frames, flows):
+                self.accumulate(frame, flow, Sb, countMap)
+            return
+
+        hs, P = self._Y.shape
+        ws = self._X.shape[0]
+        # sum of the frames before frame t, with a border of one patch
+        running_padded = np.zeros((self.H + 2 * P, self.W + 2 * P), dtype=np.int64)
+        running = running_padded[P:P + self.H, P:P + self.W]
+        S = np.zeros((hs, ws, P, P), dtype=np.int64)
+        N = np.zeros((hs, ws, P, P), dtype=np.int64)
+        rows, cols = self._patch_indices(next(flows))
+        running += first
+        t = 1
+        for frame, flow in zip(frames, flows):
+            rows_t, cols_t = self._patch_indices(flow)
+            # patches whose shift changes at frame t: close the run of the previous shift, open one with the new shift
+            pi, pj = np.nonzero(np.any(rows_t != rows, axis=2) | np.any(cols_t != cols, axis=2))
+            if len(pi) > 0:
+                vals, valid = self._gather_patches(running_padded, pi, pj, rows[pi, pj], cols[pi, pj])
+                vals_t, valid_t = self._gather_patches(running_padded, pi, pj, rows_t[pi, pj], cols_t[pi, pj])
+                S[pi, pj] += vals - vals_t
+                N[pi, pj] += t * (valid.astype(np.int64) - valid_t)
+                rows[pi, pj] = rows_t[pi, pj]
+                cols[pi, pj] = cols_t[pi, pj]
+            running += frame
+            t += 1
+        vals, valid = self._gather_patches(running_padded, self._pi, self._pj, rows.reshape(-1, P),
+                                           cols.reshape(-1, P))
+        S += vals.reshape(S.shape)
+        N += t * valid.reshape(N.shape)
+        Sb += S.transpose(0, 2, 1, 3).reshape(Sb.shape)
+        countMap += N.transpose(0, 2, 1, 3).reshape(countMap.shape)
+
+    def _patch_indices(self, flow):
+        # nearest rows and columns of the frame for every patch, -1 outside the frame, same operations as warp
+        r = (self._Y[:, None, :] + flow[:, :, 1, None]) - 1
+        c = (self._X[None, :, :] + flow[:, :, 0, None]) - 1
+        with np.errstate(invalid='ignore'):
+            rows = np.where((r >= 0) & (r <= self.H - 1), np.floor(r + 0.5), -1).astype(np.intp)
+            cols = np.where((c >= 0) & (c <= self.W - 1), np.floor(c + 0.5), -1).astype(np.intp)
+        return rows, cols
+
+    def _gather_patches(self, padded, pi, pj, rows, cols):
+        """
+        Gather patches from an image with a zero border of one patch.
+
+        Args:
+            padded (numpy array): Image with a border of patchSize pixels.
+            pi, pj (numpy array): (n,) patch row and column indices.
+            rows, cols (numpy array): (n, P) rows and columns of the image to gather for each patch, -1 outside.
+
+        Returns:
+            tuple: (vals, valid), (n, P, P) patches, 0 where a row or column is -1, and the mask of the other pixels.
+        """
+        P = self.patchSize
+        k = np.arange(P)
+        valid_rows = rows >= 0
+        valid_cols = cols >= 0
+        # shift of the rows and columns relative to the patch, taken from the first valid ones
+        dy = rows - (self._Y[pi, :1] - 1) - k
+        dx = cols - (self._X[pj, :1] - 1) - k
+        sy = dy[np.arange(len(pi)), np.argmax(valid_rows, axis=1)]
+        sx = dx[np.arange(len(pj)), np.argmax(valid_cols, axis=1)]
+        if np.all((dy == sy[:, None]) | ~valid_rows) and np.all((dx == sx[:, None]) | ~valid_cols):
+            # integer shift per patch: copy rectangular blocks, the border keeps the blocks inside the image
+            y0 = np.where(valid_rows.any(axis=1), self._Y[pi, 0] - 1 + sy + P, 0)
+            x0 = np.where(valid_cols.any(axis=1), self._X[pj, 0] - 1 + sx + P, 0)
+            vals = sliding_window_view(padded, (P, P))[y0, x0]
+        else:
+            # rounding made the shift vary within a patch, gather pixel by pixel
+            vals = padded[np.where(valid_rows, rows + P, 0)[:, :, None], np.where(valid_cols, cols + P, 0)[:, None, :]]
+        # query points up to half a pixel outside the image round to its first or last row or column
+        valid = valid_rows[:, :, None] & valid_cols[:, None, :]
+        partial = ~(valid_rows.all(axis=1) & valid_cols.all(axis=1))
+        if partial.any():
+            vals[partial] *= valid[partial]
+        return vals, valid
+
+
+class FrameFlows:
+    """
+    Per-frame flows of patch_merge_binary, blended linearly from the flows of the two nearest alignment blocks.
+
+    The block flows (extended by one extrapolated block at both ends) are stacked once and the blend coefficients are
+    precomputed for every position within an alignment window. A per-frame flow is then two multiplications and an
+    addition into reused (hs, ws, 2) buffers. The flow stays at patch resolution, PatchWarper expands it over the
+    pixels of each patch on the fly.
+    """
+
+    def __init__(self, flows, alignTWSize, alignCenFrame):
+        """
+        Args:
+            flows (list): alignTWNum (hs, ws, 2) block flows, alignTWNum >= 2.
+            alignTWSize (int): Number of frames per alignment block.
+            alignCenFrame (int): Position (1-based) of the frame within a block that the block flow belongs to.
+        """
+        flowsr = np.zeros((len(flows) + 2,) + np.shape(flows[0]))
+        flowsr[1:-1] = flows
+        flowsr[0] = 2 * flowsr[1] - flowsr[2]
+        flowsr[-1] = 2 * flowsr[-2] - flowsr[-3]
+        self.alignTWSize = alignTWSize
+        self._flowsr = flowsr
+        # (offset of the first block relative to the block of the frame, weight of the first, weight of the second)
+        self._coeffs = []
+        for aj in range(1, alignTWSize + 1):
+            if aj < alignCenFrame:
+                self._coeffs.append((-1, (alignCenFrame - aj) / alignTWSize,
+                                     (aj + alignTWSize - alignCenFrame) / alignTWSize))
+            else:
+                self._coeffs.append((0, (alignCenFrame + alignTWSize - aj) / alignTWSize,
+                                     (aj - alignCenFrame) / alignTWSize))
+        self._flow = np.empty(flowsr.shape[1:])
+        self._tmp = np.empty(flowsr.shape[1:])
+
+    def __call__(self, idx):
+        """
+        Flow of frame idx (1-based).
+
+        Returns:
+            numpy array: (hs, ws, 2) flow. The array is a buffer, it is overwritten by the next call.
+        """
+        ai = (idx - 1) // self.alignTWSize + 1
+        offset, w0, w1 = self._coeffs[(idx - 1) % self.alignTWSize]
+        np.multiply(w0, self._flowsr[ai + offset], out=self._flow)
+        np.multiply(w1, self._flowsr[ai + offset + 1], out=self._tmp)
+        self._flow += self._tmp
+        return self._flow
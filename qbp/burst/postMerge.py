@@ -1,6 +1,6 @@
 import numpy as np
 from qbp.utils.mleImage import mle_image
-from testing.TestFunctions import test_logger
+from qbp.utils.instrumentation import test_logger
 
 @test_logger
 def post_merge(S, param, isSR=False, dcr=None):
@@ -1,30 +1,78 @@
 import os
+import math
 import numpy as np
 from qbp.utils.ps_shape.param_from_json import param_from_json
 from qbp.utils.ps_shape.load_dataset import load_dataset
+from qbp.burst.blockAggregation import WindowSumCache
 from qbp.burst.naiveRecons import naive_recons
 from qbp.burst.patchAlignBinary import patch_align_binary
 from qbp.burst.patchMergeBinary import patch_merge_binary
 from qbp.burst.postMerge import post_merge
+from qbp.utils.instrumentation import StageProfiler, profile_stage
+
+
+# parameters written to the profile report, to compare runs of the same dataset
+PROFILE_PARAMS = ['dataDir', 'dataset_type', 'alignTWSize', 'alignTWNum', 'mergeTWSize', 'mergeTWNum', 'warpTWSize',
+				  'numLevels', 'patchSizes', 'upsampleRatios', 'searchRadii', 'numLKIters', 'fastMode', 'dataType',
+				  'numWorkers', 'readWorkers', 'fftWorkers', 'lazyLoad', 'packBits']
+
+
+def profile_path(resultDir):
+	"""Path of the profile report of run_qbp, a JSON file next to resultDir."""
+	return os.path.normpath(resultDir) + '_profile.json'
+
 
 def run_qbp(json_path):
+	"""
+	Run the QBP pipeline configured in json_path.
+
+	If param['profile'] is set, the time and memory of each stage are recorded with a StageProfiler and written to
+	profile_path(param['resultDir']). param['profileAllocations'] additionally traces the allocations of each stage.
+	"""
 	param = param_from_json(json_path)
+	if not param.get('profile', False):
+		return _run_qbp(param)
+	with StageProfiler(trace_allocations=param.get('profileAllocations', False)) as profiler:
+		result = _run_qbp(param)
+	profiler.save(profile_path(param['resultDir']), json_path=json_path,
+				  param={key: param[key] for key in PROFILE_PARAMS if key in param})
+	return result
+
+
+def _run_qbp(param):
 	# Check if the parameters are equivalent
 	# run python version of load_dataset and check if equal
-	imbs_py, dcr_py, h5_info_py, dropped_py, phase_ids_py = load_dataset(param)
+	with profile_stage('load_dataset'):
+		imbs_py, dcr_py, h5_info_py, dropped_py, phase_ids_py = load_dataset(param)
+	try:
+		return _reconstruct(param, imbs_py, phase_ids_py)
+	finally:
+		# a lazily loaded PhotonCube keeps its HDF5 file open until the frames are no longer needed
+		if hasattr(imbs_py, 'close'):
+			imbs_py.close()
+
 
+def _reconstruct(param, imbs_py, phase_ids_py):
+	# Window sums shared by the naive reconstructions and the alignment block images: if one window size divides
+	# the other, the frames are summed only once at the finer window size, all other sums are derived from these
+	cache = WindowSumCache(imbs_py, param['dataType'])
+	twSize = math.gcd(param["mergeTWSize"], param["alignTWSize"])
+	if twSize == min(param["mergeTWSize"], param["alignTWSize"]):
+		numFrames = max(param["mergeTWSize"] * param["mergeTWNum"], param["alignTWSize"] * param["alignTWNum"])
+		with profile_stage('block aggregation'):
+			cache.window_sums(0, twSize, min(numFrames, len(imbs_py)) // twSize)
 
 	# Naive reconstruction
-	ima_py, S = naive_recons(imbs_py, param)
+	with profile_stage('naive_recons'):
+		ima_py, S = naive_recons(imbs_py, param, cache=cache)
 
 	# reference block naive reconstruction
 	asParam_py = param.copy()
 	asParam_py["mergeTWNum"] = 1
 	refBlock = np.floor((param["refFrame"] - 1) / param["mergeTWSize"])
 	start_idx = int(refBlock * param["mergeTWSize"])
-	stop_idx = int((refBlock + 1) * param["mergeTWSize"])
-	sliced_imbs_py = imbs_py[start_idx:stop_idx]
-	imas_py, S = naive_recons(sliced_imbs_py, asParam_py)
+	with profile_stage('naive_recons'):
+		imas_py, S = naive_recons(imbs_py, asParam_py, cache=cache, start=start_idx)
 
 	# Remove hot pixels
 	if param["removeHP"]:
@@ -35,14 +83,17 @@ def run_qbp(json_path):
 	print('Finished naive reconstruction.')
 
 	# Align
-	flows, flowrs = patch_align_binary(imbs_py, param)
+	with profile_stage('align'):
+		flows, flowrs = patch_align_binary(imbs_py, param, cache=cache)
 
 
 	# Merge
-	Sr = patch_merge_binary(imbs_py, flows, param, phase_ids_py)
+	with profile_stage('merge'):
+		Sr = patch_merge_binary(imbs_py, flows, param, phase_ids_py)
 
 	# Convert photon counts back to intensity
-	imr = post_merge(Sr, param, False)
+	with profile_stage('post_merge'):
+		imr = post_merge(Sr, param, False)
 
 	result = {
 		"ima": ima_py,
@@ -1,4 +1,6 @@
 import os
+# Enable logging, test_logger reads the variable once when qbp is imported
+os.environ["ENABLE_TEST_LOGGER"] = "1"
 import numpy as np
 import pickle
 from qbp.utils.ps_shape.param_from_json import param_from_json
@@ -11,7 +13,6 @@ from qbp.burst.postMerge import post_merge
 
 
 def run_qbp_stepwise_verbose(json_path, eng=None):
-	os.environ["ENABLE_TEST_LOGGER"] = "1"  # Enable logging
 	param = param_from_json(json_path)
 	# Check if the parameters are equivalent
 	# run python version of load_dataset and check if equal
@@ -0,0 +1,10 @@
+"""
+Simulation of single-photon captures, Python port of qbp_matlab/sim.
+
+sensor holds the per-frame image formation models (binary frames, single and multi-bit jots, sum images, dark count
+patterns), SyntheticPhotonCube streams seeded frames of a scene under a parametric MotionModel.
+"""
+from qbp.sim.sensor import (photon_flux, gen_bin_img, gen_single_bit_jot, gen_multi_bit_jot, gen_sum_img,
+                            gen_dcr_pattern)
+from qbp.sim.motion import MotionModel
+from qbp.sim.synthetic_cube import random_scene, SyntheticPhotonCube
@@ -0,0 +1,98 @@
+import numpy as np
+
+
+class MotionModel:
+    """
+    Parametric global motion of a scene: constant velocity translation, rotation and zoom about a center.
+
+    A scene point s (0-based pixel coordinates, x first) of frame 0 is at
+        x_t = center + z^t * R(omega * t) (s - center) + velocity * t
+    in frame t, with R the rotation matrix and z = exp(zoom_rate). Times can be fractional, e.g. the center of a
+    temporal window. Frames are rendered with the matrix of frame t (cv2.warpAffine convention, see matrix), flows are
+    the displacements of points between two times (patchWarp convention, see flow).
+    """
+
+    def __init__(self, velocity=(0, 0), angular_velocity=0, zoom_rate=0, center=None):
+        """
+        Args:
+            velocity (tuple): (vx, vy) translation in pixels per frame.
+            angular_velocity (float): Rotation in radians per frame, counterclockwise on the image.
+            zoom_rate (float): Logarithmic scale change per frame.
+            center (tuple, optional): (cx, cy) center of rotation and zoom. Defaults to the image center.
+        """
+        self.velocity = (float(velocity[0]), float(velocity[1]))
+        self.angular_velocity = float(angular_velocity)
+        self.zoom_rate = float(zoom_rate)
+        self.center = None if center is None else (float(center[0]), float(center[1]))
+
+    def _center(self, shape):
+        if self.center is not None:
+            return np.array(self.center)
+        return np.array([(shape[1] - 1) / 2, (shape[0] - 1) / 2])
+
+    def matrix(self, t, shape):
+        """
+        Affine matrix that maps the scene coordinates of frame 0 to the coordinates of frame t.
+
+        Args:
+            t (float): Time in frames.
+            shape (tuple): (H, W) image shape, used for the default center.
+
+        Returns:
+            numpy array: (2, 3) float64 matrix, frame t is cv2.warpAffine(scene, matrix, (W, H)).
+        """
+        c = self._center(shape)
+        a = self.angular_velocity * t
+        z = np.exp(self.zoom_rate * t)
+        # y points down, so a counterclockwise rotation on the image flips the sign of sin
+        A = z * np.array([[np.cos(a), np.sin(a)], [-np.sin(a), np.cos(a)]])
+        b = c - A @ c + np.array(self.velocity) * t
+        return np.hstack([A, b[:, None]])
+
+    def flow(self, x, y, t, t_ref, shape):
+        """
+        Displacement of points from time t_ref to time t.
+
+        The point (x, y) of frame t_ref is at (x + u, y + v) in frame t, so a frame t warped with the flow
+        (interp2(frame_t, x + u, y + v)) is aligned with frame t_ref.
+
+        Args:
+            x (numpy array): 0-based x coordinates in frame t_ref.
+            y (numpy array): 0-based y coordinates in frame t_ref.
+            t (float): Time of the target frame.
+            t_ref (float): Time of the reference frame.
+            shape (tuple): (H, W) image shape, used for the default center.
+
+        Returns:
+            numpy array: (..., 2) flow of the shape of x, x displacement first.
+        """
+        M = np.vstack([self.matrix(t, shape), [0, 0, 1]]) @ np.linalg.inv(
+            np.vstack([self.matrix(t_ref, shape), [0, 0, 1]]))
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        u = M[0, 0] * x + M[0, 1] * y + M[0, 2] - x
+        v = M[1, 0] * x + M[1, 1] * y + M[1, 2] - y
+        return np.stack([u, v], axis=-1)
+
+    def patch_flow(self, t, t_ref, shape, patchSize, patchStride=None):
+        """
+        Flow of the patch grid of patch_align, evaluated at the patch centers.
+
+        Args:
+            t (float): Time of the target frame.
+            t_ref (float): Time of the reference frame.
+            shape (tuple): (H, W) image shape.
+            patchSize (int): Size of the finest level patches.
+            patchStride (int, optional): Stride of the patches. Defaults to patchSize // 2.
+
+        Returns:
+            numpy array: (hs, ws, 2) flow, x displacement first.
+        """
+        if patchStride is None:
+            patchStride = patchSize // 2
+        hs = (shape[0] - patchSize) // patchStride + 1
+        ws = (shape[1] - patchSize) // patchStride + 1
+        y = np.arange(hs) * patchStride + (patchSize - 1) / 2
+        x = np.arange(ws) * patchStride + (patchSize - 1) / 2
+        xv, yv = np.meshgrid(x, y)
+        return self.flow(xv, yv, t, t_ref, shape)
@@ -0,0 +1,148 @@
+import numpy as np
+
+
+def _rng(rng):
+    return rng if isinstance(rng, np.random.Generator) else np.random.default_rng(rng)
+
+
+def photon_flux(I, max_flux, tau=1, eta=1, dcr=0):
+    """
+    Expected number of detections per pixel and frame, I * max_flux * tau * eta + dcr * tau.
+
+    Args:
+        I (numpy array): Intensity image, 0...1.
+        max_flux (float): Photons per pixel and unit exposure time at intensity 1.
+        tau (float): Exposure time.
+        eta (float): Quantum efficiency.
+        dcr (float or numpy array): Dark count rate, a scalar or a per-pixel pattern, see gen_dcr_pattern.
+
+    Returns:
+        numpy array: Flux of the shape of I.
+    """
+    return I * (max_flux * tau * eta) + dcr * tau
+
+
+def gen_bin_img(I, max_flux, tau=1, eta=1, dcr=0, rng=None):
+    """
+    Binary frame of an intensity image, Python port of qbp_matlab/sim/genBinImg.m.
+
+    A pixel is 1 if at least one photon (or dark count) arrived, which happens with probability 1 - exp(-flux).
+
+    Args:
+        I (numpy array): Intensity image, 0...1.
+        max_flux (float): Photons per pixel and unit exposure time at intensity 1.
+        tau (float): Exposure time.
+        eta (float): Quantum efficiency.
+        dcr (float or numpy array): Dark count rate.
+        rng (numpy.random.Generator or int, optional): Random number generator or seed.
+
+    Returns:
+        numpy array: uint8 frame of the shape of I.
+    """
+    P = np.exp(-photon_flux(I, max_flux, tau, eta, dcr))
+    # float32 images are sampled in float32, which halves the cost of the uniform draws
+    dtype = np.float32 if P.dtype == np.float32 else np.float64
+    return (_rng(rng).random(P.shape, dtype=dtype) > P).astype(np.uint8)
+
+
+def _jot_counts(I, max_flux, tau, eta, dcr, read_noise_sigma, rng):
+    # Poisson counts without the mean dark count, plus Gaussian read noise
+    rng = _rng(rng)
+    flux = photon_flux(I, max_flux, tau, eta, dcr)
+    P = rng.poisson(flux) - dcr * tau
+    if read_noise_sigma:
+        P = P + rng.normal(0, read_noise_sigma, np.shape(flux))
+    return P
+
+
+def gen_single_bit_jot(I, max_flux, tau=1, eta=1, dcr=0, read_noise_sigma=0, thresh=1, rng=None):
+    """
+    Single-bit jot frame with read noise, Python port of qbp_matlab/sim/genSingleBitJot.m.
+
+    Args:
+        I (numpy array): Intensity image, 0...1.
+        max_flux (float): Photons per pixel and unit exposure time at intensity 1.
+        tau (float): Exposure time.
+        eta (float): Quantum efficiency.
+        dcr (float or numpy array): Dark count rate.
+        read_noise_sigma (float): Standard deviation of the read noise in photo-electrons.
+        thresh (float): A pixel is 1 if the noisy count is above thresh - 0.5.
+        rng (numpy.random.Generator or int, optional): Random number generator or seed.
+
+    Returns:
+        numpy array: uint8 frame of the shape of I.
+    """
+    P = _jot_counts(I, max_flux, tau, eta, dcr, read_noise_sigma, rng)
+    return (P > thresh - 0.5).astype(np.uint8)
+
+
+def gen_multi_bit_jot(I, num_bits, max_flux, tau=1, eta=1, dcr=0, read_noise_sigma=0, rng=None, normalize=True):
+    """
+    Multi-bit jot frame, Python port of qbp_matlab/sim/genMultiBitJot.m.
+
+    The noisy counts are rounded and clipped to 0...2^num_bits - 1.
+
+    Args:
+        I (numpy array): Intensity image, 0...1.
+        num_bits (int): Bit depth of a jot.
+        max_flux (float): Photons per pixel and unit exposure time at intensity 1.
+        tau (float): Exposure time.
+        eta (float): Quantum efficiency.
+        dcr (float or numpy array): Dark count rate.
+        read_noise_sigma (float): Standard deviation of the read noise in photo-electrons.
+        rng (numpy.random.Generator or int, optional): Random number generator or seed.
+        normalize (bool): Divide the counts by 2^num_bits - 1 as the Matlab version does. Otherwise the integer
+            counts are returned as uint8 (up to 8 bits) or uint16.
+
+    Returns:
+        numpy array: Frame of the shape of I, float64 in 0...1 if normalize, integer counts otherwise.
+    """
+    L = 2 ** num_bits - 1
+    C = np.clip(np.round(_jot_counts(I, max_flux, tau, eta, dcr, read_noise_sigma, rng)), 0, L)
+    if normalize:
+        return C / L
+    return C.astype(np.uint8 if num_bits <= 8 else np.uint16)
+
+
+def gen_sum_img(I, T, max_flux, tau=1, eta=1, dcr=0, rng=None):
+    """
+    Sum of T binary frames of a static intensity image, Python port of qbp_matlab/sim/genSumImg.m.
+
+    Drawn directly from the binomial distribution, without generating the frames.
+
+    Args:
+        I (numpy array): Intensity image, 0...1.
+        T (int): Number of binary frames.
+        max_flux (float): Photons per pixel and unit exposure time at intensity 1.
+        tau (float): Exposure time.
+        eta (float): Quantum efficiency.
+        dcr (float or numpy array): Dark count rate.
+        rng (numpy.random.Generator or int, optional): Random number generator or seed.
+
+    Returns:
+        numpy array: int64 photon counts of the shape of I.
+    """
+    P = 1 - np.exp(-photon_flux(I, max_flux, tau, eta, dcr))
+    return _rng(rng).binomial(T, P)
+
+
+def gen_dcr_pattern(shape, dc_data, scale_median=None, rng=None):
+    """
+    Dark count rate fixed pattern, Python port of qbp_matlab/sim/genDcrPattern.m.
+
+    Every pixel draws its dark count rate from the measured dark counts of a sensor.
+
+    Args:
+        shape (tuple): Shape of the pattern.
+        dc_data (numpy array): Measured dark counts per pixel, any shape. They are scaled by 97700 / 130001 as in the
+            Matlab version.
+        scale_median (float, optional): Scale the distribution to this median.
+        rng (numpy.random.Generator or int, optional): Random number generator or seed.
+
+    Returns:
+        numpy array: float64 dark count rates of the given shape.
+    """
+    dc_data = np.sort(np.ravel(dc_data) / (130001 / 97700))
+    if scale_median is not None:
+        dc_data = dc_data / np.median(dc_data) * scale_median
+    return dc_data[_rng(rng).integers(0, dc_data.size, shape)]
@@ -0,0 +1,184 @@
+import copy
+import cv2
+import numpy as np
+from scipy.ndimage import gaussian_filter
+from qbp.sim.motion import MotionModel
+from qbp.sim.sensor import photon_flux
+
+
+def random_scene(H, W, seed=0):
+    """
+    Smooth random texture with edges, normalized to 0...1, used as the scene of synthetic photon cubes.
+
+    Args:
+        H (int): Height.
+        W (int): Width.
+        seed (int): Seed of the random texture.
+
+    Returns:
+        numpy array: (H, W) float64 image.
+    """
+    rng = np.random.default_rng(seed)
+    texture = gaussian_filter(rng.random((H, W)), 3) + 0.5 * gaussian_filter(rng.random((H, W)), 12)
+    # a few bright rectangles give sharp edges for the block matcher
+    for _ in range(8):
+        y, x = rng.integers(0, H), rng.integers(0, W)
+        texture[y:y + H // 8, x:x + W // 8] += rng.uniform(0.2, 0.5)
+    texture -= texture.min()
+    return texture / texture.max()
+
+
+class SyntheticPhotonCube:
+    """
+    Lazy sequence of simulated single-photon frames of a moving scene.
+
+    Behaves like PhotonCube: len(), integer indexing (returns a (H, W) frame), slicing (returns a new lazy
+    SyntheticPhotonCube), iteration and frames(start, stop), so it can be passed to the pipeline or to
+    PackedPhotonCube.from_frames in place of a capture. Frames are generated on request and never stored. Frame t
+    is rendered with the motion model at time t and sampled with its own random generator seeded with (seed, t),
+    so a frame is the same no matter in which order or in which chunks the cube is read.
+
+    With num_bits == 1 and no read noise, frames are binary as in qbp_matlab/sim/genBinImg.m. With read noise they
+    are single-bit jots (genSingleBitJot.m), with num_bits > 1 they are integer multi-bit jot counts in
+    0...2^num_bits - 1 (genMultiBitJot.m without the normalization).
+    """
+
+    def __init__(self, scene, num_frames, motion=None, max_flux=0.5, tau=1, eta=1, dcr=0, num_bits=1,
+                 read_noise_sigma=0, thresh=1, seed=0, chunk_frames=64):
+        """
+        Args:
+            scene (numpy array): (H, W) intensity image of frame 0, 0...1, e.g. from random_scene.
+            num_frames (int): Number of frames.
+            motion (MotionModel, optional): Motion of the scene. Defaults to a static scene.
+            max_flux (float): Photons per pixel and unit exposure time at intensity 1.
+            tau (float): Exposure time of a frame.
+            eta (float): Quantum efficiency.
+            dcr (float or numpy array): Dark count rate, a scalar or an (H, W) pattern from gen_dcr_pattern.
+            num_bits (int): Bit depth of a jot.
+            read_noise_sigma (float): Standard deviation of the read noise in photo-electrons.
+            thresh (float): Threshold of single-bit jots with read noise, see gen_single_bit_jot.
+            seed (int): Seed of the photon arrivals.
+            chunk_frames (int): Number of frames generated at once when the cube is iterated.
+        """
+        self.scene = np.asarray(scene, dtype=np.float32)
+        assert self.scene.ndim == 2
+        self.motion = MotionModel() if motion is None else motion
+        self.max_flux = max_flux
+        self.tau = tau
+        self.eta = eta
+        self.dcr = dcr if np.isscalar(dcr) else np.asarray(dcr, dtype=np.float32)
+        self.num_bits = int(num_bits)
+        self.read_noise_sigma = read_noise_sigma
+        self.thresh = thresh
+        self.seed = int(seed)
+        self.chunk_frames = int(chunk_frames)
+        self.frame_range = range(int(num_frames))
+        self.dtype = np.dtype(np.uint8 if self.num_bits <= 8 else np.uint16)
+
+    @property
+    def shape(self):
+        return (len(self),) + self.scene.shape
+
+    def __len__(self):
+        return len(self.frame_range)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            sub = copy.copy(self)
+            sub.frame_range = self.frame_range[idx]
+            return sub
+        t = self.frame_range[idx]
+        return self._generate([t])[0]
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            yield from chunk
+
+    def __array__(self, dtype=None, copy=None):
+        frames = self.frames(0, len(self))
+        return frames if dtype is None else frames.astype(dtype)
+
+    def frames(self, start, stop):
+        """
+        Generate consecutive frames start...stop-1 of this sequence at once.
+
+        Returns:
+            numpy array: Frames of shape (stop - start, H, W).
+        """
+        return self._generate(self.frame_range[start:stop])
+
+    def chunks(self, chunk_frames=None, start=0, stop=None):
+        """
+        Generate the frames start...stop-1 in chunks, only one chunk is held in memory at a time.
+
+        Yields:
+            numpy array: Chunk of shape (n, H, W) with n <= chunk_frames.
+        """
+        chunk_frames = self.chunk_frames if chunk_frames is None else chunk_frames
+        stop = len(self) if stop is None else min(stop, len(self))
+        for t0 in range(start, stop, chunk_frames):
+            yield self.frames(t0, min(stop, t0 + chunk_frames))
+
+    def render(self, t):
+        """
+        Noise-free intensity of the scene at time t.
+
+        Args:
+            t (float): Time in frames of the full cube, may be fractional.
+
+        Returns:
+            numpy array: (H, W) float32 image.
+        """
+        M = self.motion.matrix(t, self.scene.shape)
+        if np.array_equal(M, np.eye(2, 3)):
+            return self.scene
+        H, W = self.scene.shape
+        return cv2.warpAffine(self.scene, M, (W, H), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+
+    def _generate(self, times):
+        out = np.empty((len(times),) + self.scene.shape, dtype=self.dtype)
+        if len(times) == 0:
+            return out
+        flux = np.stack([self.render(t) for t in times])
+        flux = photon_flux(flux, self.max_flux, self.tau, self.eta, self.dcr)
+        binary = self.num_bits == 1 and not self.read_noise_sigma
+        if binary:
+            # probability of no detection, computed for the whole chunk at once
+            P = np.exp(-flux)
+        for n, t in enumerate(times):
+            rng = np.random.default_rng([self.seed, t])
+            if binary:
+                np.greater(rng.random(P.shape[1:], dtype=P.dtype), P[n], out=out[n], casting='unsafe')
+                continue
+            counts = rng.poisson(flux[n]) - self.dcr * self.tau
+            if self.read_noise_sigma:
+                counts = counts + rng.normal(0, self.read_noise_sigma, counts.shape)
+            if self.num_bits == 1:
+                out[n] = counts > self.thresh - 0.5
+            else:
+                out[n] = np.clip(np.round(counts), 0, 2 ** self.num_bits - 1)
+        return out
+
+    def _time(self, i):
+        # time in frames of the full cube of the (possibly fractional) frame i of this sequence
+        return self.frame_range.start + self.frame_range.step * i
+
+    def block_flows(self, param):
+        """
+        Ground truth of the flows computed by patch_align_binary on this sequence.
+
+        The flow of a block is the motion between the centers of its temporal window and of the reference window,
+        evaluated at the patch centers. For translations this is the mean displacement of the frames of the block.
+
+        Args:
+            param (dict): QBP parameters, uses alignTWSize, alignTWNum, refFrame and patchSizes.
+
+        Returns:
+            list: alignTWNum (hs, ws, 2) flows, x displacement first.
+        """
+        tw = param['alignTWSize']
+        refBlock = (param['refFrame'] - 1) // tw  # 0-based
+        t_ref = self._time(refBlock * tw + (tw - 1) / 2)
+        patchSize = int(param['patchSizes'][0])
+        return [self.motion.patch_flow(self._time(i * tw + (tw - 1) / 2), t_ref, self.scene.shape, patchSize)
+                for i in range(param['alignTWNum'])]
@@ -8,7 +8,7 @@ from qbp.single_photon_imaging.src.window_fns.box_window_2D import box_window_2D
 from testing.io import get_eng
 from qbp.single_photon_imaging.src.sigproc.dft_2D import dft_2D
 from qbp.single_photon_imaging.src.sigproc.idft_2D import idft_2D
-from testing.TestFunctions import test_logger
+from qbp.utils.instrumentation import test_logger
 
 
 @test_logger
@@ -43,4 +43,63 @@ def wiener_denoise_t(patch_stack, c0, window_fn=None):
 
     FT_merged /= D
     merged = idft_2D(FT_merged, window_fn)
-    return merged
\ No newline at end of file
+    return merged
+
+@test_logger
+def wiener_denoise_t_batch(patches, patch_size, c0, window_fn=None, workers=None):
+    """Denoises all aligned patch stacks of a patch grid at once using Wiener filtering along the time axis.
+    Batched equivalent of calling wiener_denoise_t for every patch of the grid.
+
+    Args:
+        patches (numpy.ndarray): 4D array (hs * P, ws * P, C, N) of pre-aligned blocks, P is the patch size.
+        patch_size (int): Patch size P.
+        c0 (float): Wiener filtering tuning parameter.
+        window_fn (callable, optional): A function to generate a window. Defaults to a box window.
+        workers (int, optional): If set, scipy.fft is used with the given number of workers (-1 uses all cores).
+            Defaults to numpy.fft.
+
+    Returns:
+        numpy.ndarray: The denoised patches (hs, ws, C, P, P).
+    """
+    if window_fn is None:
+        window_fn = box_window_2D  # Default to a box window.
+
+    Hp, Wp, C, D = patches.shape
+    P = patch_size
+    hs = Hp // P
+    ws = Wp // P
+    if not np.issubdtype(patches.dtype, np.floating):
+        patches = patches.astype(np.float64)
+
+    if workers is None:
+        fft2 = np.fft.fft2
+        ifft2 = np.fft.ifft2
+    else:
+        import scipy.fft
+        fft2 = lambda x: scipy.fft.fft2(x, workers=workers)
+        ifft2 = lambda x: scipy.fft.ifft2(x, workers=workers)
+
+    # (hs * P, ws * P, C, N) -> (hs, ws, C, N, P, P), the last two axes are the spatial axes of a patch
+    stacks = patches[:hs * P, :ws * P].reshape(hs, P, ws, P, C, D).transpose(0, 2, 4, 5, 1, 3)
+    base_frame = stacks[:, :, :, 0]
+    noise_variance = np.maximum(np.finfo(float).eps, np.std(base_frame, axis=(-2, -1), ddof=1) ** 2)
+
+    # windowing as in dft_2D
+    if window_fn != box_window_2D:
+        window = window_fn(P, P)
+        m = np.mean(stacks, axis=(-2, -1), keepdims=True)
+        stacks = m + (stacks - m) * window
+    FT = fft2(stacks)
+    FT_base = FT[:, :, :, :1]
+    FT_frames = FT[:, :, :, 1:]
+    c = P * P * 2 * c0
+
+    Dz2 = np.abs(FT_frames - FT_base) ** 2
+    Az = Dz2 / (Dz2 + c * noise_variance[:, :, :, None, None, None])
+    FT_merged = FT_base[:, :, :, 0] + np.sum(Az * FT_base + (1 - Az) * FT_frames, axis=3)
+
+    FT_merged /= D
+    merged = np.real(ifft2(FT_merged))
+    if window_fn != box_window_2D:
+        merged = merged / window
+    return merged
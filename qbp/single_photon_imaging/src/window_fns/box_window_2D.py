@@ -7,7 +7,7 @@ function [w] = box_window_2D(M, N)
 end
 """
 import numpy as np
-from testing.TestFunctions import test_logger
+from qbp.utils.instrumentation import test_logger
 
 @test_logger
 def box_window_2D(M, N):
@@ -4,7 +4,7 @@ import pickle
 import unittest
 from qbp.burst.patchAlign_subfuns.dc_utils import save_to_mat
 from testing.io import get_eng
-from testing.TestFunctions import test_logger
+from qbp.utils.instrumentation import test_logger
 
 
 def raised_cos_window_1D(L):
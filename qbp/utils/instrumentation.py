@@ -0,0 +1,185 @@
+import contextlib
+import functools
+import inspect
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# environment variable that enables saving the inputs of all functions decorated with test_logger
+LOGGING_ENV = "ENABLE_TEST_LOGGER"
+
+# decided once when qbp is imported, so the variable has to be set before the first qbp import
+LOGGING_ENABLED = os.getenv(LOGGING_ENV, "0") in ("1", "true", "True")
+
+
+def test_logger(func):
+    """
+    Save the inputs of every call of func (and the error, if it raises) to testing/test_data_inputs.
+
+    Logging is enabled with the ENABLE_TEST_LOGGER environment variable, which is read once at import time. If logging
+    is disabled, func is returned unchanged, so decorated functions have no call overhead in production. The writers
+    in testing.io are only imported if logging is enabled.
+    """
+    if not LOGGING_ENABLED:
+        return func
+
+    from testing.io import save_inputs, save_error
+    sig = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            # Convert args to a dict using the function's signature
+            bound_args = sig.bind(*args, **kwargs)
+            bound_args.apply_defaults()  # Fill in default values for missing arguments
+            input_dict = bound_args.arguments  # OrderedDict of parameter names and values
+
+            # Save the inputs as a dictionary
+            save_inputs(func.__name__, dict(input_dict))
+            return func(*args, **kwargs)     # Call the original function
+        except Exception as e:
+            save_error(func.__name__, args, str(e))  # Save error details
+            raise
+    return wrapper
+
+
+# active profilers, stages are recorded by the most recently activated one
+_profilers = []
+
+
+def _peak_rss():
+    # high-water mark of the resident set size of this process in bytes, None if not available (e.g. on Windows)
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class StageProfiler:
+    """
+    Records wall time, CPU time, peak RSS and the array allocations of named pipeline stages.
+
+    Stages are marked in the pipeline code with profile_stage(name), which does nothing unless a profiler is active:
+
+        with StageProfiler() as profiler:
+            ...  # code calling profile_stage
+        profiler.save(path)
+
+    Stages can be nested, the time of a stage includes the time of the stages called from it. A stage that runs
+    several times accumulates its times. Only stages of the current process are recorded, stages run in the worker
+    processes of a pool are included in the stage that runs the pool.
+
+    Per stage, the report holds:
+        - calls: number of times the stage ran
+        - wall_time, cpu_time: seconds (CPU time of all threads of this process)
+        - peak_rss_bytes: high-water mark of the resident set size of the process at the end of the stage
+        - alloc_peak_bytes, alloc_net_bytes: peak and net memory allocated during the stage (Python objects and NumPy
+          arrays), only if trace_allocations is set, which slows down the pipeline
+    """
+
+    def __init__(self, trace_allocations=False):
+        """
+        Args:
+            trace_allocations (bool): Trace allocations with tracemalloc.
+        """
+        self.trace_allocations = trace_allocations
+        self.stages = {}
+        self._stack = []
+        self._started_tracing = False
+        self._start = None
+
+    def __enter__(self):
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._start = (time.perf_counter(), time.process_time())
+        _profilers.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _profilers.remove(self)
+        self.total = {'wall_time': time.perf_counter() - self._start[0],
+                      'cpu_time': time.process_time() - self._start[1],
+                      'peak_rss_bytes': _peak_rss()}
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager that records the enclosed code as stage name."""
+        tracing = self.trace_allocations and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # keep the peak of the enclosing stage before the peak is reset for this stage
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+        frame = {'start': current if tracing else 0, 'peak': current if tracing else 0}
+        self._stack.append(frame)
+        record = self.stages.setdefault(name, {'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'peak_rss_bytes': None})
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            self._stack.pop()
+            record['calls'] += 1
+            record['wall_time'] += wall
+            record['cpu_time'] += cpu
+            rss = _peak_rss()
+            if rss is not None:
+                record['peak_rss_bytes'] = max(record['peak_rss_bytes'] or 0, rss)
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(frame['peak'], peak)
+                record['alloc_peak_bytes'] = max(record.get('alloc_peak_bytes', 0), peak - frame['start'])
+                record['alloc_net_bytes'] = record.get('alloc_net_bytes', 0) + current - frame['start']
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+                tracemalloc.reset_peak()
+
+    def report(self, **info):
+        """
+        Report of all recorded stages.
+
+        Args:
+            **info: Additional entries of the report, e.g. the dataset and the parameters of the run.
+
+        Returns:
+            dict: The entries of info, 'total' (if the profiler was used as context manager) and 'stages', a list of
+                dicts with the name and the measurements of each stage, in the order the stages first ran.
+        """
+        report = dict(info)
+        if hasattr(self, 'total'):
+            report['total'] = dict(self.total)
+        report['stages'] = [dict(name=name, **record) for name, record in self.stages.items()]
+        return report
+
+    def save(self, path, **info):
+        """Write the report (see report) as JSON to path."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.report(**info), f, indent=2, default=str)
+
+
+@contextlib.contextmanager
+def profile_stage(name):
+    """
+    Record the enclosed code as stage name of the active StageProfiler, does nothing if no profiler is active.
+    """
+    if not _profilers:
+        yield
+        return
+    with _profilers[-1].stage(name):
+        yield
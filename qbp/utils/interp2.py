@@ -1,11 +1,57 @@
+import os
+from collections import OrderedDict
+from functools import partial
 import numpy as np
+import cv2
 from scipy.interpolate import RegularGridInterpolator, RectBivariateSpline
 from scipy.ndimage import map_coordinates
-from testing.TestFunctions import test_logger
+from qbp.utils.instrumentation import test_logger
+
+
+# environment variable with the default backend of interp2, used if method_selection is None
+INTERP2_BACKEND_ENV = 'QBP_INTERP2_BACKEND'
+DEFAULT_INTERP2_BACKEND = 'regular_grid'
+
+# name -> function(V, Xq, Yq, method) with 0-based query points, NaN outside the grid
+_BACKENDS = {}
+# name -> methods supported by the backend, None if it supports all methods
+_BACKEND_METHODS = {}
+
+
+def register_interp2_backend(name, fn=None, methods=None):
+    """
+    Register an interp2 backend, can be used as a decorator.
+
+    Args:
+        name (str): Name of the backend, selected with method_selection or the QBP_INTERP2_BACKEND variable.
+        fn (callable): fn(V, Xq, Yq, method) returning the values of V at the 0-based query points (Xq along the
+            columns, Yq along the rows) and NaN outside of V.
+        methods (iterable, optional): Methods supported by the backend. interp2 falls back to the scipy reference
+            for other methods. Defaults to all methods.
+    """
+    if fn is None:
+        return partial(register_interp2_backend, name, methods=methods)
+    _BACKENDS[name] = fn
+    _BACKEND_METHODS[name] = None if methods is None else frozenset(methods)
+    return fn
+
+
+def interp2_backend(method_selection=None):
+    """
+    Name of the backend used by interp2 for the given method_selection.
+
+    If method_selection is None, the backend is read from the QBP_INTERP2_BACKEND environment variable, the default is
+    'regular_grid' (scipy, same results as MATLAB).
+    """
+    if method_selection is None:
+        method_selection = os.getenv(INTERP2_BACKEND_ENV, DEFAULT_INTERP2_BACKEND)
+    if method_selection not in _BACKENDS:
+        raise ValueError(f"Unknown interp2 backend: {method_selection}. Choose from {', '.join(_BACKENDS)}.")
+    return method_selection
 
 
 @test_logger
-def interp2(V, Xq, Yq, method='cubic', method_selection='regular_grid', indexing="py", X=None, Y=None):
+def interp2(V, Xq, Yq, method='cubic', method_selection=None, indexing="py", X=None, Y=None):
     """
     INTERP2 2-D interpolation for uniformly-spaced data.
     Vq = interp2(X, Y, V, Xq, Yq, method='cubic', method_selection='regular_grid') interpolates
@@ -13,31 +59,47 @@ def interp2(V, Xq, Yq, method='cubic', method_selection='regular_grid', indexing
     Xq and Yq, using bicubic interpolation.
 
     Parameters:
-    - X, Y: Coordinates of the original grid.
+    - X, Y: Coordinates of the original grid. Only supported by the scipy backends.
     - V: Values at the grid points.
     - Xq, Yq: Coordinates of the query points.
     - method: Interpolation method, default is 'cubic'.
-    - method_selection: Choose the interpolation method.
-        - 'regular_grid' (default) for RegularGridInterpolator.
+    - method_selection: Choose the interpolation backend. Defaults to the QBP_INTERP2_BACKEND environment variable or
+      'regular_grid'.
+        - 'regular_grid' (default) for RegularGridInterpolator, the MATLAB-exact reference.
         - 'map_coordinates' for ndimage.map_coordinates.
         - 'rect_bivariate_spline' for RectBivariateSpline.
         - 'bicubic_convolution_*' for custom bicubic convolution interpolation.
           * denotes padding selection. Options are: 'reflect', 'constant', 'wrap', 'nearest'.
+        - 'cv2_remap' for cv2.remap, for float32 and float64 values. Linear weights are quantized to 1/32 pixel and
+          cubic uses the kernel of OpenCV, NaN outside the grid as for the reference.
+        - 'precomputed' for interpolation weights that are cached per query grid, same results as 'regular_grid' for
+          'linear' and as 'map_coordinates' for 'nearest' (float64 with NaN outside the grid for integer V as well).
+          Fast for repeated queries at the same points, see Interp2Weights.
+      Methods a backend does not support (e.g. 'cubic' for 'precomputed') use the 'regular_grid' reference.
     """
-    # copy inputs to prevent them from changing
-    V = V.copy()
-    Xq = Xq.copy()
-    Yq = Yq.copy()
-
+    backend = interp2_backend(method_selection)
 
     if indexing == "mat": # if top-level calls the function with matlab indexing
-        Xq -=1
-        Yq-=1
+        Xq = Xq - 1
+        Yq = Yq - 1
         # switch Xq and Yq
         assert X is None, "currently not implemented"
 
+    if (X is not None) or (Y is not None):
+        assert (X is not None) and (Y is not None)
+        if backend not in _SCIPY_BACKENDS:
+            raise ValueError(f"Custom grids are not supported by the interp2 backend {backend}.")
+        return _interp2_scipy(V, Xq, Yq, method, backend, X, Y)
+
+    methods = _BACKEND_METHODS[backend]
+    if methods is not None and method not in methods:
+        return _interp2_scipy(V, Xq, Yq, method, DEFAULT_INTERP2_BACKEND)
+    return _BACKENDS[backend](V, Xq, Yq, method)
+
+
+def _interp2_scipy(V, Xq, Yq, method, method_selection, X=None, Y=None):
+    # reference implementation with scipy, the inputs are not modified
     if (X is None) or (Y is None):
-        assert (X is None) and (Y is None)
         # Create grid and values for interpolation
         X = np.arange(0, V.shape[0])
         Y = np.arange(0, V.shape[1])
@@ -45,6 +107,9 @@ def interp2(V, Xq, Yq, method='cubic', method_selection='regular_grid', indexing
 
     # Ensure no NaNs in V
     assert np.sum(np.isnan(V)) == 0
+    if not V.flags.writeable:
+        # RegularGridInterpolator only takes its fast path for writeable values
+        V = V.copy()
 
     if method == 'nearest':
         # Using scipy.ndimage.map_coordinates
@@ -66,7 +131,9 @@ def interp2(V, Xq, Yq, method='cubic', method_selection='regular_grid', indexing
     elif 'bicubic_convolution' in method_selection:
         padding_mode = method_selection.split("_")[-1]
         # Bicubic convolution interpolation using a custom kernel
-        Vq = bicubic_convolution_interpolation(V, Yq, Xq, padding_mode=padding_mode)
+        Vq = bicubic_convolution_interpolation(V, Xq, Yq, padding_mode=padding_mode)
+        # NaN outside the grid, as for MATLAB and the other methods
+        Vq[~((Xq >= 0) & (Xq <= V.shape[1] - 1) & (Yq >= 0) & (Yq <= V.shape[0] - 1))] = np.nan
 
     else:
         # Using scipy.interpolate.RegularGridInterpolator
@@ -94,13 +161,199 @@ def interp2(V, Xq, Yq, method='cubic', method_selection='regular_grid', indexing
 
     return Vq
 
+
+_SCIPY_BACKENDS = ['regular_grid', 'map_coordinates', 'rect_bivariate_spline'] + \
+                  [f'bicubic_convolution_{mode}' for mode in ('reflect', 'constant', 'wrap', 'nearest')]
+for _name in _SCIPY_BACKENDS:
+    register_interp2_backend(_name, partial(_interp2_scipy, method_selection=_name))
+
+
+_CV2_METHODS = {'linear': cv2.INTER_LINEAR, 'nearest': cv2.INTER_NEAREST, 'cubic': cv2.INTER_CUBIC}
+# cv2.remap needs maps with less than SHRT_MAX rows and columns, larger query grids are remapped in tiles of this width
+_CV2_TILE_WIDTH = 4096
+
+
+@register_interp2_backend('cv2_remap', methods=_CV2_METHODS)
+def _interp2_cv2_remap(V, Xq, Yq, method):
+    if method not in _CV2_METHODS:
+        raise ValueError(f"Invalid method: {method}. Choose from {', '.join(_CV2_METHODS)}.")
+    V = np.asarray(V)
+    if V.dtype not in (np.float32, np.float64):
+        V = V.astype(np.float64)
+    H, W = V.shape[:2]
+    Xq = np.asarray(Xq, dtype=np.float64)
+    Yq = np.asarray(Yq, dtype=np.float64)
+    # query points outside the grid are NaN, as for RegularGridInterpolator
+    valid = (Xq >= 0) & (Xq <= W - 1) & (Yq >= 0) & (Yq <= H - 1)
+    if method == 'nearest':
+        # round half up as map_coordinates, the maps then hold whole pixels
+        Xq = np.floor(Xq + 0.5)
+        Yq = np.floor(Yq + 0.5)
+    shape2d = (1, -1) if Xq.ndim < 2 else (-1, Xq.shape[-1])
+    mapx = Xq.reshape(shape2d).astype(np.float32)
+    mapy = Yq.reshape(shape2d).astype(np.float32)
+    if max(mapx.shape) >= np.iinfo(np.int16).max:
+        # rows of _CV2_TILE_WIDTH points, the padding points are cropped after the remap
+        n = mapx.size
+        pad = -n % _CV2_TILE_WIDTH
+        mapx = np.pad(mapx.ravel(), (0, pad)).reshape((-1, _CV2_TILE_WIDTH))
+        mapy = np.pad(mapy.ravel(), (0, pad)).reshape((-1, _CV2_TILE_WIDTH))
+        rows = np.iinfo(np.int16).max - 1
+        Vq = np.concatenate([cv2.remap(V, mapx[r:r + rows], mapy[r:r + rows], interpolation=_CV2_METHODS[method],
+                                       borderMode=cv2.BORDER_REPLICATE) for r in range(0, mapx.shape[0], rows)])
+        Vq = Vq.reshape((-1,) + V.shape[2:])[:n]
+    else:
+        Vq = cv2.remap(V, mapx, mapy, interpolation=_CV2_METHODS[method], borderMode=cv2.BORDER_REPLICATE)
+    Vq = Vq.reshape(Xq.shape + V.shape[2:])
+    Vq[~valid] = np.nan
+    return Vq
+
+
+class Interp2Weights:
+    """
+    Interpolation weights of a fixed set of query points on a grid of a fixed shape.
+
+    The indices and weights are computed once, interpolating values on the grid is then a gather and a few products.
+    The results are identical to RegularGridInterpolator ('linear') and map_coordinates ('nearest'), including NaN for
+    query points outside the grid.
+    """
+
+    def __init__(self, shape, Xq, Yq, method='linear'):
+        """
+        Args:
+            shape (tuple): Shape of the grid (H, W).
+            Xq (numpy array): 0-based query points along the columns.
+            Yq (numpy array): 0-based query points along the rows, same shape as Xq.
+            method (str): 'linear' or 'nearest'.
+        """
+        if method not in ('linear', 'nearest'):
+            raise ValueError(f"Invalid method: {method}. Choose from 'linear', 'nearest'.")
+        H, W = int(shape[0]), int(shape[1])
+        self.shape = (H, W)
+        self.method = method
+        self.query_shape = np.shape(Xq)
+        x = np.asarray(Xq, dtype=np.float64).ravel()
+        y = np.asarray(Yq, dtype=np.float64).ravel()
+        self.invalid = ~((x >= 0) & (x <= W - 1) & (y >= 0) & (y <= H - 1))
+        x = np.where(self.invalid, 0, x)
+        y = np.where(self.invalid, 0, y)
+        if method == 'nearest':
+            self.idx = np.floor(y + 0.5).astype(np.intp) * W + np.floor(x + 0.5).astype(np.intp)
+            return
+        if H < 2 or W < 2:
+            raise ValueError('Linear interpolation needs at least 2 grid points along each axis.')
+        # lower grid index, clipped to the second to last one as in RegularGridInterpolator
+        i0 = np.clip(np.floor(y), 0, H - 2)
+        j0 = np.clip(np.floor(x), 0, W - 2)
+        self.wr = y - i0
+        self.wc = x - j0
+        self.wr1 = 1 - self.wr
+        self.wc1 = 1 - self.wc
+        self.idx = i0.astype(np.intp) * W + j0.astype(np.intp)
+
+    def __call__(self, V):
+        """
+        Interpolate V at the query points.
+
+        Args:
+            V (numpy array): Values of shape (H, W) or (H, W, ...).
+
+        Returns:
+            numpy array: Values of shape Xq.shape + V.shape[2:], NaN outside the grid.
+        """
+        V = np.asarray(V)
+        if V.shape[:2] != self.shape:
+            raise ValueError(f'Expected values on a grid of shape {self.shape}, got {V.shape[:2]}.')
+        tail = V.shape[2:]
+        # RegularGridInterpolator converts integer values to float64 and keeps other float types
+        fast = V.ndim == 2 and (V.dtype == np.float64 or not np.issubdtype(V.dtype, np.inexact))
+        v = V.reshape((self.shape[0] * self.shape[1], -1)).astype(np.float64, copy=False)
+        if self.method == 'nearest':
+            Vq = v[self.idx]
+        else:
+            W = self.shape[1]
+            wr, wc, wr1, wc1 = (w[:, None] for w in (self.wr, self.wc, self.wr1, self.wc1))
+            # same order of operations as RegularGridInterpolator:
+            # v00 * (1 - wr) * (1 - wc) + v01 * (1 - wr) * wc + v10 * wr * (1 - wc) + v11 * wr * wc
+            # for 2D float64 values, v00 * ((1 - wr) * (1 - wc)) + ... otherwise
+            if fast:
+                Vq = v[self.idx] * wr1 * wc1
+                Vq += v[self.idx + 1] * wr1 * wc
+                Vq += v[self.idx + W] * wr * wc1
+                Vq += v[self.idx + W + 1] * wr * wc
+            else:
+                Vq = v[self.idx] * (wr1 * wc1)
+                Vq += v[self.idx + 1] * (wr1 * wc)
+                Vq += v[self.idx + W] * (wr * wc1)
+                Vq += v[self.idx + W + 1] * (wr * wc)
+        Vq[self.invalid] = np.nan
+        return Vq.reshape(self.query_shape + tail)
+
+
+# weights of the most recently used query grids of the 'precomputed' backend
+_WEIGHTS_CACHE = OrderedDict()
+_WEIGHTS_CACHE_SIZE = 8
+
+
+@register_interp2_backend('precomputed', methods=('linear', 'nearest'))
+def _interp2_precomputed(V, Xq, Yq, method):
+    Xq = np.ascontiguousarray(Xq, dtype=np.float64)
+    Yq = np.ascontiguousarray(Yq, dtype=np.float64)
+    key = (V.shape[:2], method, Xq.shape, Xq.tobytes(), Yq.tobytes())
+    weights = _WEIGHTS_CACHE.get(key)
+    if weights is None:
+        weights = Interp2Weights(V.shape, Xq, Yq, method)
+        _WEIGHTS_CACHE[key] = weights
+        if len(_WEIGHTS_CACHE) > _WEIGHTS_CACHE_SIZE:
+            _WEIGHTS_CACHE.popitem(last=False)
+    else:
+        _WEIGHTS_CACHE.move_to_end(key)
+    return weights(V)
+
+def _cubic_kernel(x):
+    # Keys cubic convolution kernel with a = -0.5, as used by MATLAB's interp2(..., 'cubic')
+    abs_x = np.abs(x)
+    abs_x2 = abs_x ** 2
+    abs_x3 = abs_x ** 3
+
+    return np.where(
+        abs_x <= 1,
+        (1.5 * abs_x3 - 2.5 * abs_x2 + 1),
+        np.where(
+            abs_x < 2,
+            (-0.5 * abs_x3 + 2.5 * abs_x2 - 4 * abs_x + 2),
+            0
+        )
+    )
+
+
+def _pad_indices(idx, n, padding_mode):
+    # map indices outside 0...n-1 to the index of the padded value, -1 for 'constant'
+    if padding_mode == 'constant':
+        return np.where((idx >= 0) & (idx < n), idx, -1)
+    elif padding_mode == 'reflect':
+        # reflect without repeating the edge value (np.pad mode 'reflect'), repeated for far away indices
+        if n == 1:
+            return np.zeros_like(idx)
+        idx = np.mod(idx, 2 * n - 2)
+        return np.where(idx >= n, 2 * n - 2 - idx, idx)
+    elif padding_mode == 'wrap':
+        return np.mod(idx, n)
+    elif padding_mode == 'nearest':
+        return np.clip(idx, 0, n - 1)
+    raise ValueError(f"Invalid padding_mode: {padding_mode}. Choose from 'constant', 'reflect', 'wrap', 'nearest'.")
+
+
 def bicubic_convolution_interpolation(V, Xq, Yq, padding_mode='reflect', constant_value=0):
     """
     Custom bicubic convolution interpolation with different padding options.
 
+    The 4 x 4 tap weights are computed for all query points at once and the taps are gathered from V with fancy
+    indexing, the taps outside V are taken from the padding.
+
     Parameters:
     - V: The input 2D array.
-    - Xq, Yq: Query points for interpolation.
+    - Xq, Yq: Query points for interpolation (Xq along the columns, Yq along the rows).
     - padding_mode: Type of padding to handle edges. Options are:
         - 'constant': Pad with a constant value (specified by constant_value).
         - 'reflect': Reflect the values at the boundary.
@@ -111,60 +364,35 @@ def bicubic_convolution_interpolation(V, Xq, Yq, padding_mode='reflect', constan
     Returns:
     - Vq: The interpolated values at the query points.
     """
-    # Define the cubic convolution kernel
-    def cubic_kernel(x):
-        abs_x = np.abs(x)
-        abs_x2 = abs_x ** 2
-        abs_x3 = abs_x ** 3
-
-        return np.where(
-            abs_x <= 1,
-            (1.5 * abs_x3 - 2.5 * abs_x2 + 1),
-            np.where(
-                abs_x < 2,
-                (-0.5 * abs_x3 + 2.5 * abs_x2 - 4 * abs_x + 2),
-                0
-            )
-        )
+    if padding_mode not in ('constant', 'reflect', 'wrap', 'nearest'):
+        raise ValueError(f"Invalid padding_mode: {padding_mode}. Choose from 'constant', 'reflect', 'wrap', 'nearest'.")
+    V = np.asarray(V)
+    H, W = V.shape[:2]
+    Xq = np.asarray(Xq, dtype=np.float64)
+    Yq = np.asarray(Yq, dtype=np.float64)
+
+    # Determine the four nearest neighbors in each direction
+    x0 = np.floor(Xq)
+    y0 = np.floor(Yq)
+
+    # tap indices and weights along each axis, the offsets run over -1...2
+    offsets = range(-1, 3)
+    cols = [_pad_indices(x0.astype(np.intp) + m, W, padding_mode) for m in offsets]
+    rows = [_pad_indices(y0.astype(np.intp) + n, H, padding_mode) for n in offsets]
+    wx = [_cubic_kernel(Xq - (x0 + m)) for m in offsets]
+    wy = [_cubic_kernel(Yq - (y0 + n)) for n in offsets]
 
-    # Pad the original data based on the chosen padding mode
     if padding_mode == 'constant':
-        V_padded = np.pad(V, 2, mode='constant', constant_values=constant_value)
-    elif padding_mode == 'reflect':
-        V_padded = np.pad(V, 2, mode='reflect')
-    elif padding_mode == 'wrap':
-        V_padded = np.pad(V, 2, mode='wrap')
-    elif padding_mode == 'nearest':
-        V_padded = np.pad(V, 2, mode='edge')
-    else:
-        raise ValueError(f"Invalid padding_mode: {padding_mode}. Choose from 'constant', 'reflect', 'wrap', 'nearest'.")
+        # one extra value for the taps outside V, addressed with index -1
+        V_padded = np.full((H + 1, W + 1), constant_value, dtype=V.dtype)
+        V_padded[:H, :W] = V
+        V = V_padded
 
-    # Prepare output array
+    # Accumulate weighted contribution from each neighbor, in the same order as for a single point
     Vq = np.zeros(Xq.shape)
-
-    # Perform bicubic convolution interpolation
-    for i in range(Vq.shape[0]):
-        for j in range(Vq.shape[1]):
-            x = Xq[i, j]
-            y = Yq[i, j]
-
-            # Determine the four nearest neighbors in each direction
-            x0 = int(np.floor(x))
-            y0 = int(np.floor(y))
-
-            # Accumulate weighted contribution from each neighbor
-            for m in range(-1, 3):
-                for n in range(-1, 3):
-                    # Adjust indices to access padded data correctly
-                    x_idx = x0 + m + 2  # +2 due to padding on both sides
-                    y_idx = y0 + n + 2
-
-                    # Compute the distance to the neighbor
-                    dx = x - (x0 + m)
-                    dy = y - (y0 + n)
-
-                    # Add contribution from the neighboring point
-                    Vq[i, j] += V_padded[y_idx, x_idx] * cubic_kernel(dx) * cubic_kernel(dy)
+    for m in range(4):
+        for n in range(4):
+            Vq += V[rows[n], cols[m]] * wx[m] * wy[n]
 
     return Vq
 
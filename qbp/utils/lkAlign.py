@@ -4,13 +4,13 @@ import unittest
 import os
 from qbp.utils.ps_shape.param_from_json import param_from_json
 from qbp.burst.buildAgrePyramid import build_aggre_pyramid
-from qbp.utils.partial_deriv_patch import partial_deriv_patch
+from qbp.utils.partial_deriv_patch import partial_deriv_patch, image_gradients, patch_gradients
 from testing.io import get_eng
-from testing.TestFunctions import test_logger
+from qbp.utils.instrumentation import test_logger
 
 
 @test_logger
-def lk_align(im0, im1, iters, uv0=None, eng=None):
+def lk_align(im0, im1, iters, uv0=None, eng=None, grads=None):
     """
     Align two images (2D translation) using Lucas-Kanade.
 
@@ -19,6 +19,8 @@ def lk_align(im0, im1, iters, uv0=None, eng=None):
         im1 (numpy array): Image to be aligned.
         iters (int): Number of iterations.
         uv0 (numpy array, optional): Initial displacement. Default is None.
+        grads (tuple, optional): (Ix, Iy) derivatives of im1, e.g. from a GradientPyramid. If None, the derivatives
+            are computed in the window of im1 around the patch in every iteration.
 
     Returns:
         numpy array: Displacement vector.
@@ -38,7 +40,7 @@ def lk_align(im0, im1, iters, uv0=None, eng=None):
             for t0, t1 in zip(test0, test1):
                 assert np.allclose(t0, t1, equal_nan=True)
         # compute partial derivatives for the opical flow constraint equation
-        It, Ix, Iy = partial_deriv_patch(im0, im1, uv)
+        It, Ix, Iy = partial_deriv_patch(im0, im1, uv, grads=grads)
         # lucas kanade equation - solve for the displacement across patch
         A = np.stack((Ix.ravel(), Iy.ravel()), axis=1)
         b = -It.ravel()
@@ -54,6 +56,113 @@ def lk_align(im0, im1, iters, uv0=None, eng=None):
 
     return uv.reshape((1, 2))
 
+
+def _interp_linear_patches(ims, y, x):
+    """
+    Bilinear interpolation of several images at the same query points, same operations as interp2 (linear).
+
+    Args:
+        ims (list): (H, W) images.
+        y, x (numpy array): Query rows and columns (0-based), broadcastable arrays.
+
+    Returns:
+        list: Interpolated values per image, NaN outside the images.
+    """
+    H, W = ims[0].shape
+    valid = (y >= 0) & (y <= H - 1) & (x >= 0) & (x <= W - 1)
+    y = np.where(valid, y, 0)
+    x = np.where(valid, x, 0)
+    # lower grid index, clipped to the second to last one as in RegularGridInterpolator
+    y0 = np.clip(np.floor(y), 0, H - 2)
+    x0 = np.clip(np.floor(x), 0, W - 2)
+    wy = y - y0
+    wx = x - x0
+    idx = y0.astype(np.intp) * W + x0.astype(np.intp)
+    out = []
+    for im in ims:
+        im = im.ravel()
+        v = im[idx] * (1 - wy) * (1 - wx) + im[idx + 1] * (1 - wy) * wx + im[idx + W] * wy * (1 - wx) + \
+            im[idx + W + 1] * wy * wx
+        v[~valid] = np.nan
+        out.append(v)
+    return out
+
+
+@test_logger
+def lk_align_batch(im0s, im1, iters, uv0, deriv_filter=None, b=0.5, grads=None, template_grads=None):
+    """
+    Align many template patches to one image (2D translation per patch) using Lucas-Kanade.
+
+    Batched version of lk_align: the derivatives of im1 are computed once and the derivatives of all templates at
+    once, every iteration samples im1 and its derivatives at the displaced positions of all patches in one gather and
+    solves the 2x2 normal equations of all patches in closed form. Patches whose system is rank deficient (same
+    tolerance as np.linalg.matrix_rank) stop iterating, as in lk_align.
+
+    Args:
+        im0s (numpy array): (n, P, P) template patches.
+        im1 (numpy array): Image to be aligned to.
+        iters (int): Number of iterations.
+        uv0 (numpy array): (n, 2) initial displacements (x, y) of the templates in im1.
+        deriv_filter (numpy array, optional): Derivative filter, see partial_deriv_patch.
+        b (float): Blending ratio of the derivatives of im1 and the templates, see partial_deriv_patch.
+        grads (tuple, optional): (Ix, Iy) derivatives of im1 as computed by image_gradients, e.g. from a
+            GradientPyramid. Computed here if None.
+        template_grads (tuple, optional): (Ix, Iy) derivatives of the templates as computed by patch_gradients.
+            Computed here if None.
+
+    Returns:
+        numpy array: (n, 2) displacements.
+    """
+    n, h, w = im0s.shape
+    uv = np.array(uv0, dtype=np.float64).reshape((n, 2))
+
+    # derivatives of the image and the templates (reflected at the template borders, as for a single patch)
+    I2x, I2y = image_gradients(im1, deriv_filter) if grads is None else grads
+    I1x, I1y = patch_gradients(im0s, deriv_filter) if template_grads is None else template_grads
+    y = np.arange(h)[None, :, None]
+    x = np.arange(w)[None, None, :]
+    tol = h * w * np.finfo(np.float64).eps
+
+    active = np.arange(n)
+    for _ in range(iters):
+        if len(active) == 0:
+            break
+        # partial derivatives for the optical flow constraint equation
+        y2 = y + uv[active, 1, None, None]
+        x2 = x + uv[active, 0, None, None]
+        warpIm, Ix, Iy = _interp_linear_patches([im1, I2x, I2y], y2, x2)
+        It = warpIm - im0s[active]
+        Ix = b * Ix + (1 - b) * I1x[active]
+        Iy = b * Iy + (1 - b) * I1y[active]
+        mask = ~np.isfinite(It) | ~np.isfinite(Ix) | ~np.isfinite(Iy)
+        It[mask] = 0
+        Ix[mask] = 0
+        Iy[mask] = 0
+
+        # normal equations A^T A x = A^T b of A = [Ix, Iy], b = -It
+        a11 = np.sum(Ix * Ix, axis=(1, 2))
+        a12 = np.sum(Ix * Iy, axis=(1, 2))
+        a22 = np.sum(Iy * Iy, axis=(1, 2))
+        b1 = -np.sum(Ix * It, axis=(1, 2))
+        b2 = -np.sum(Iy * It, axis=(1, 2))
+
+        # rank of A from its singular values, the square roots of the eigenvalues of A^T A
+        mean = (a11 + a22) / 2
+        dev = np.sqrt(((a11 - a22) / 2) ** 2 + a12 ** 2)
+        s_max = np.sqrt(mean + dev)
+        s_min = np.sqrt(np.maximum(mean - dev, 0))
+        full_rank = s_min > s_max * tol
+        active = active[full_rank]
+        a11, a12, a22, b1, b2 = a11[full_rank], a12[full_rank], a22[full_rank], b1[full_rank], b2[full_rank]
+
+        det = a11 * a22 - a12 ** 2
+        d = np.stack(((a22 * b1 - a12 * b2) / det, (a11 * b2 - a12 * b1) / det), axis=1)
+        norm = np.linalg.norm(d, axis=1)
+        d[norm > 1] /= norm[norm > 1, None]
+        uv[active] += d
+
+    return uv
+
 class TestLKAlign(unittest.TestCase):
     def setUp(self):
         # Setup: Load environment and MATLAB engine if available
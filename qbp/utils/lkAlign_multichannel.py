@@ -5,7 +5,7 @@ from qbp.utils.ps_shape.param_from_json import param_from_json
 from qbp.burst.buildAgrePyramid import build_aggre_pyramid
 from qbp.utils.partial_deriv_patch import partial_deriv_patch
 from testing.io import get_eng
-from testing.TestFunctions import test_logger
+from qbp.utils.instrumentation import test_logger
 
 
 @test_logger
@@ -1,5 +1,5 @@
 import numpy as np
-from testing.TestFunctions import test_logger
+from qbp.utils.instrumentation import test_logger
 
 
 @test_logger
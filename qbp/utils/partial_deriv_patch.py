@@ -1,12 +1,80 @@
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy.ndimage import convolve
-from qbp.utils.interp2 import interp2
-from testing.TestFunctions import test_logger
+from qbp.utils.interp2 import interp2, interp2_backend
+from qbp.utils.instrumentation import test_logger
+
+
+DERIV_FILTER = np.array([1, -8, 0, 8, -1]) / 12  # Used in Wedel et al.
+
+
+def image_gradients(img, deriv_filter=None):
+    """
+    Spatial derivatives of an image, as used by partial_deriv_patch.
+
+    Args:
+        img (ndarray): (H, W) or (H, W, C) image.
+        deriv_filter (ndarray): Derivative filter. Default is used if None.
+
+    Returns:
+        tuple: (Ix, Iy), derivatives along x and y with the image reflected at its borders.
+    """
+    if deriv_filter is None:
+        deriv_filter = DERIV_FILTER
+    if img.ndim == 3:
+        Ix = np.zeros_like(img)
+        Iy = np.zeros_like(img)
+        for j in range(img.shape[2]):
+            Ix[..., j], Iy[..., j] = image_gradients(img[..., j], deriv_filter)
+        return Ix, Iy
+    return (convolve(img, deriv_filter[None, ::-1], mode='reflect'),
+            convolve(img, deriv_filter[::-1, None], mode='reflect'))
+
+
+def patch_gradients(patches, deriv_filter=None):
+    """
+    Spatial derivatives of a stack of (H, W) patches, each patch is reflected at its own borders.
+
+    Args:
+        patches (ndarray): (n, H, W) patches.
+        deriv_filter (ndarray): Derivative filter. Default is used if None.
+
+    Returns:
+        tuple: (Ix, Iy), same values as image_gradients of every single patch.
+    """
+    if deriv_filter is None:
+        deriv_filter = DERIV_FILTER
+    return (convolve(patches, deriv_filter[None, None, ::-1], mode='reflect'),
+            convolve(patches, deriv_filter[None, ::-1, None], mode='reflect'))
+
+
+# interp2 backends whose linear interpolation only depends on the neighbouring grid points
+_LOCAL_BACKENDS = ('regular_grid', 'map_coordinates', 'cv2_remap', 'precomputed')
+
+
+def _query_window(shape, x, y, margin):
+    """
+    Window of an image of the given shape that contains all query points with a margin of whole pixels.
+
+    Returns:
+        tuple: (r0, r1, c0, c1) so that img[r0:r1, c0:c1] contains the points, or None if a query point is not finite
+            or the window is smaller than 2x2 pixels.
+    """
+    if x.size == 0 or not (np.all(np.isfinite(x)) and np.all(np.isfinite(y))):
+        return None
+    H, W = shape[:2]
+    r0 = int(min(max(np.floor(y.min()) - margin, 0), H))
+    r1 = int(max(min(np.ceil(y.max()) + margin + 1, H), r0))
+    c0 = int(min(max(np.floor(x.min()) - margin, 0), W))
+    c1 = int(max(min(np.ceil(x.max()) + margin + 1, W), c0))
+    if r1 - r0 < 2 or c1 - c0 < 2:
+        # too small to interpolate, e.g. all points are outside the image
+        return None
+    return r0, r1, c0, c1
 
 
 @test_logger
-def partial_deriv_patch(img1, img2, uv_prev, interpolation_method='bi-linear', deriv_filter=None, b=0.5, eng=None, method_selection='regular_grid'):
+def partial_deriv_patch(img1, img2, uv_prev, interpolation_method='bi-linear', deriv_filter=None, b=0.5, eng=None, method_selection=None, grads=None):
     """
     Compute spatio-temporal derivatives for aligning a template image img1 to img2.
 
@@ -17,6 +85,13 @@ def partial_deriv_patch(img1, img2, uv_prev, interpolation_method='bi-linear', d
         interpolation_method (str): Interpolation method ('cubic' or 'linear').
         deriv_filter (ndarray): Derivative filter. Default is used if None.
         b (float): Blending ratio.
+        method_selection (str, optional): Backend of interp2, see interp2.
+        grads (tuple, optional): (I2x, I2y) derivatives of img2 as computed by image_gradients, e.g. from a
+            GradientPyramid. Computed here if None.
+
+    For linear interpolation only a window of img2 around the displaced template is interpolated (and differentiated,
+    if grads is None), so the cost scales with the template size instead of the image size. The result is identical to
+    interpolating the whole image.
 
     Returns:
         It (ndarray): Temporal derivative.
@@ -24,7 +99,7 @@ def partial_deriv_patch(img1, img2, uv_prev, interpolation_method='bi-linear', d
         Iy (ndarray): Spatial derivative along y.
     """
     if deriv_filter is None:
-        deriv_filter = np.array([1, -8, 0, 8, -1]) / 12  # Used in Wedel et al.
+        deriv_filter = DERIV_FILTER
 
     # generate query indices
     H, W = img1.shape[:2]
@@ -32,6 +107,29 @@ def partial_deriv_patch(img1, img2, uv_prev, interpolation_method='bi-linear', d
     x2 = x + uv_prev[..., 0]
     y2 = y + uv_prev[..., 1]
 
+    # crop img2 (and its derivatives) to the window needed for linear interpolation of the displaced template
+    method_selection = interp2_backend(method_selection)
+    window = None
+    if interpolation_method in ['bi-linear', 'linear'] and method_selection in _LOCAL_BACKENDS and eng is None:
+        window = _query_window(img2.shape, x2, y2, 1)
+    if window is not None:
+        r0, r1, c0, c1 = window
+        if grads is None:
+            # derivatives of a window enlarged by the filter radius equal those of the whole image within the window
+            rad = len(deriv_filter) // 2
+            e0, e1 = max(r0 - rad, 0), min(r1 + rad, img2.shape[0])
+            f0, f1 = max(c0 - rad, 0), min(c1 + rad, img2.shape[1])
+            grads = image_gradients(img2[e0:e1, f0:f1], deriv_filter)
+            grads = tuple(g[r0 - e0:r1 - e0, c0 - f0:c1 - f0] for g in grads)
+        else:
+            grads = tuple(g[r0:r1, c0:c1] for g in grads)
+        # integer offsets, the fractional parts of the query points and thus the interpolation weights are unchanged
+        img2 = img2[r0:r1, c0:c1]
+        x2 = x2 - c0
+        y2 = y2 - r0
+    elif grads is None:
+        grads = image_gradients(img2, deriv_filter)
+
     # do the same for matlab version --> different
     if eng is not None:
         x_matlab, y_matlab = eng.meshgrid(np.arange(W) + 1, np.arange(H) + 1, nargout=2)
@@ -48,8 +146,7 @@ def partial_deriv_patch(img1, img2, uv_prev, interpolation_method='bi-linear', d
                 warpIm_matlab = eng.interp2(img2, x2_matlab, y2_matlab, method)
                 assert np.allclose(warpIm, warpIm_matlab, equal_nan=True)
             It = warpIm - img1
-            I2x = convolve(img2, deriv_filter[None, ::-1], mode='reflect')
-            I2y = convolve(img2, deriv_filter[::-1, None], mode='reflect')
+            I2x, I2y = grads
             if eng is not None:
                 I2x_matlab = eng.imfilter(img2, deriv_filter[None,:],  'corr', 'symmetric', 'same')
                 I2y_matlab = eng.imfilter(img2, deriv_filter[:,None],  'corr', 'symmetric', 'same')
@@ -73,8 +170,8 @@ def partial_deriv_patch(img1, img2, uv_prev, interpolation_method='bi-linear', d
 
             for j in range(img1.shape[2]):
                 warpIm[..., j] = interp2(img2[..., j], x2, y2, method=method, method_selection=method_selection)
-                I2x = convolve(img2[..., j], deriv_filter[None, ::-1], mode='reflect')
-                I2y = convolve(img2[..., j], deriv_filter[::-1, None], mode='reflect')
+                I2x = grads[0][..., j]
+                I2y = grads[1][..., j]
 
                 Ix[..., j] = interp2(I2x, x2, y2, method=method, method_selection=method_selection)
                 Iy[..., j] = interp2(I2y, x2, y2, method=method, method_selection=method_selection)
@@ -1,7 +1,8 @@
-import h5py
 import numpy as np
 from scipy.io import loadmat
 from qbp.utils.ss2_1b_range_read import ss2_1b_range_read
+from qbp.utils.ps_shape.photon_cube import PhotonCube
+from qbp.utils.ps_shape.packed_photon_cube import PackedPhotonCube
 
 def load_dataset(param):
     h5_info = {}  # Dictionary to store HDF5 file information
@@ -19,27 +20,26 @@ def load_dataset(param):
 
         # Check for valid dimensions (3 or 4) and permute the data accordingly
         data_path = '/photon_cube'  # Path to the dataset within the HDF5 file
-        with h5py.File(h5_file_path, 'r') as f:
-            data = f[data_path][:]  # Read the dataset
-            # Reshape the data to match the desired target size and format
-            # Determine the number of dimensions
-            num_dims = data.ndim
-            assert num_dims == 3
-            # Single light modality: shape for example 512x512x801 -> convert to 801x512x512
-            data = np.transpose(data, (2, 0, 1))
-            t = data.shape[0]  # Number of time slices
-            imbs = [np.pad(data[i], ((0, target_size[0] - data.shape[1]), (0, target_size[1] - data.shape[2])), 'constant') for i in range(t)]
-            # Attempt to read the dark count rate if available
-            try:
-                dcr = f['/dcr'][:]  # Read the DCR if available
-            except KeyError:
-                dcr = np.zeros(target_size)  # Fallback if DCR is not present
-                print('Dark count rate not found in HDF5 file. Using default zeros.')
-            dropped = f['/meta_dropped'][:]  # Read the dropped dataset
-            if PS:
-                phase_ids = f['/meta_phase_ids'][:]  # Read the phase_ids dataset
-            else:
-                phase_ids = False # np.zeros(len(imbs))
+        # Single light modality: shape for example 512x512x801 -> frames of 512x512, padded to the target size.
+        # Frames are read lazily from the file when they are accessed, the cube is never loaded as a whole.
+        imbs = PhotonCube(h5_file_path, data_path, target_size)
+        f = imbs.h5_file
+        # Attempt to read the dark count rate if available
+        try:
+            dcr = f['/dcr'][:]  # Read the DCR if available
+        except KeyError:
+            dcr = np.zeros(target_size)  # Fallback if DCR is not present
+            print('Dark count rate not found in HDF5 file. Using default zeros.')
+        dropped = f['/meta_dropped'][:]  # Read the dropped dataset
+        if PS:
+            phase_ids = f['/meta_phase_ids'][:]  # Read the phase_ids dataset
+        else:
+            phase_ids = False # np.zeros(len(imbs))
+        if not param.get('lazyLoad', True):
+            # load all frames into memory
+            imbs_lazy = imbs
+            imbs = list(imbs_lazy)
+            imbs_lazy.close()
         # Save relevant HDF5 information to the dictionary
         h5_info['file_path'] = h5_file_path
         h5_info['data_path'] = data_path
@@ -47,7 +47,8 @@ def load_dataset(param):
         print('Finished reading HDF5 data.')
     elif dataset_type == "mat":
         im_range = param["range"]
-        imbs = ss2_1b_range_read(data_dir, im_range[0] - 1, im_range[1])
+        # parts are decoded in a thread pool, readWorkers None uses min(8, number of CPUs) threads
+        imbs = ss2_1b_range_read(data_dir, im_range[0] - 1, im_range[1], param.get('readWorkers'))
         # Attempt to read the dark count rate if available
         try:
             dcr = np.array(loadmat(dcr_path)['dcr']) # Read the DCR if available
@@ -62,4 +63,11 @@ def load_dataset(param):
     else:
         raise ValueError(f'Unsupported dataset type: {dataset_type}')
 
+    if param.get('packBits', False):
+        # store the binary frames with one bit per pixel and frame
+        imbs_unpacked = imbs
+        imbs = PackedPhotonCube.from_frames(imbs_unpacked)
+        if isinstance(imbs_unpacked, PhotonCube):
+            imbs_unpacked.close()
+
     return imbs, dcr, h5_info, dropped, phase_ids
\ No newline at end of file
@@ -0,0 +1,137 @@
+import numpy as np
+
+if hasattr(np, 'bitwise_count'):
+	popcount = np.bitwise_count
+else:
+	_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+	def popcount(x):
+		return _POPCOUNT_TABLE[x]
+
+
+class PackedPhotonCube:
+	"""
+	Bit-packed sequence of binary (single-photon) frames.
+
+	Frames are packed along the time axis with np.packbits (little bit order), frame t is bit t % 8 of bits[t // 8].
+	This needs one bit per pixel and frame, i.e. 8x less memory than uint8 frames and 64x less than double frames.
+	Indexing returns the unpacked (H, W) uint8 frame, so the cube can be used wherever a list of frames is expected.
+	Sums over consecutive frames are computed directly on the packed bytes with popcount, see window_sum.
+	"""
+
+	def __init__(self, bits, num_frames):
+		"""
+		Args:
+			bits (numpy array): Packed frames of shape (ceil(num_frames / 8), H, W) and dtype uint8.
+			num_frames (int): Number of frames.
+		"""
+		assert bits.dtype == np.uint8 and bits.shape[0] == (num_frames + 7) // 8
+		self.bits = bits
+		self.num_frames = int(num_frames)
+
+	@classmethod
+	def from_frames(cls, frames, chunk_frames=1024):
+		"""
+		Pack a sequence of binary frames.
+
+		Args:
+			frames: Sequence of (H, W) binary frames, e.g. a list, a (T, H, W) array or a PhotonCube.
+			chunk_frames (int): Number of frames that are packed at once.
+
+		Returns:
+			PackedPhotonCube: The packed frames.
+		"""
+		T = len(frames)
+		H, W = frames[0].shape[:2]
+		chunk_frames = max(8, chunk_frames - chunk_frames % 8)
+		bits = np.zeros(((T + 7) // 8, H, W), dtype=np.uint8)
+		for t0 in range(0, T, chunk_frames):
+			t1 = min(T, t0 + chunk_frames)
+			if hasattr(frames, 'frames'):
+				block = frames.frames(t0, t1)
+			else:
+				block = np.stack([frames[t] for t in range(t0, t1)])
+			if block.ndim != 3:
+				raise ValueError('Only single channel frames can be packed.')
+			if np.any((block != 0) & (block != 1)):
+				raise ValueError('Only binary frames can be packed.')
+			bits[t0 // 8:(t1 + 7) // 8] = np.packbits(block.astype(bool), axis=0, bitorder='little')
+		return cls(bits, T)
+
+	@property
+	def shape(self):
+		return (self.num_frames,) + self.bits.shape[1:]
+
+	def __len__(self):
+		return self.num_frames
+
+	def __getitem__(self, idx):
+		if isinstance(idx, slice):
+			start, stop, step = idx.indices(self.num_frames)
+			if step == 1 and start % 8 == 0:
+				num_frames = max(0, stop - start)
+				bits = self.bits[start // 8:(start + num_frames + 7) // 8].copy()
+				if num_frames % 8:
+					# clear the bits of frames behind the end of the slice
+					bits[-1] &= np.uint8((1 << (num_frames % 8)) - 1)
+				return PackedPhotonCube(bits, num_frames)
+			return PackedPhotonCube.from_frames([self[t] for t in range(start, stop, step)])
+		t = range(self.num_frames)[idx]
+		return (self.bits[t // 8] >> np.uint8(t % 8)) & np.uint8(1)
+
+	def __iter__(self):
+		for t in range(self.num_frames):
+			yield self[t]
+
+	def __array__(self, dtype=None, copy=None):
+		frames = np.unpackbits(self.bits, axis=0, count=self.num_frames, bitorder='little')
+		return frames if dtype is None else frames.astype(dtype)
+
+	def frames(self, start, stop):
+		"""
+		Unpack consecutive frames start...stop-1 at once.
+
+		Returns:
+			numpy array: uint8 frames of shape (stop - start, H, W).
+		"""
+		start, stop, _ = slice(start, stop).indices(self.num_frames)
+		stop = max(start, stop)
+		frames = np.unpackbits(self.bits[start // 8:(stop + 7) // 8], axis=0, bitorder='little')
+		return frames[start % 8:start % 8 + stop - start]
+
+	def window_sum(self, start, stop, chunk_bytes=64):
+		"""
+		Photon counts of the frames start...stop-1.
+
+		Args:
+			start (int): First frame (0-based).
+			stop (int): Frame after the last frame.
+			chunk_bytes (int): Number of packed bytes (8 frames each) that are counted at once.
+
+		Returns:
+			numpy array: (H, W) int64 array with the number of detected photons per pixel.
+		"""
+		S = np.zeros(self.bits.shape[1:], dtype=np.int64)
+		if stop <= start:
+			return S
+		b0 = start // 8
+		b1 = (stop + 7) // 8
+		# masks for the partially used first and last byte
+		masks = np.full(b1 - b0, 0xFF, dtype=np.uint8)
+		masks[0] &= np.uint8((0xFF << (start % 8)) & 0xFF)
+		if stop % 8:
+			masks[-1] &= np.uint8((1 << (stop % 8)) - 1)
+		for c0 in range(b0, b1, chunk_bytes):
+			c1 = min(b1, c0 + chunk_bytes)
+			chunk = self.bits[c0:c1] & masks[c0 - b0:c1 - b0, None, None]
+			S += np.sum(popcount(chunk), axis=0, dtype=np.int64)
+		return S
+
+	def window_sums(self, start, tw_size, tw_num):
+		"""
+		Photon counts of tw_num consecutive temporal windows of tw_size frames each, starting at frame start.
+
+		Returns:
+			numpy array: (tw_num, H, W) int64 array.
+		"""
+		return np.stack([self.window_sum(start + i * tw_size, start + (i + 1) * tw_size) for i in range(tw_num)])
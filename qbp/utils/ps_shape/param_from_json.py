@@ -32,10 +32,12 @@ def param_from_json(json_file_path):
 		'bm3dSigma': 0,
 		'hpThresh': 50, 'correctDCR': False, 'removeHP': True,
 		'dcrPath': dcr_path,
-		'fastMode': True, 'dataType': 'double',
+		'fastMode': True, 'dataType': 'double', 'numWorkers': 1, 'readWorkers': None, 'fftWorkers': None,
+		'lazyLoad': True, 'packBits': False,
 		'doRefine': False, 'doSR': False, 'doRefineSR': False,
 		'computePSNR': False,
 		'debug': False, 'saveImages': True, 'resultDir': result_dir,
+		'profile': False, 'profileAllocations': False,
 		'image_path': data_dir, 'use_gt_flow': "not defined",
 		'calculate_flow': True, 'debug_flow': True, 'perFrameGt': False,
 		'loop_lvl': 0
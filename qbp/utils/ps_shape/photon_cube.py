@@ -0,0 +1,102 @@
+import h5py
+import numpy as np
+
+
+class PhotonCube:
+	"""
+	Lazy, read-only frame sequence backed by a (H, W, T) photon cube in an HDF5 file.
+
+	Behaves like the list of frames that load_dataset used to build: len(), integer indexing (returns a (H, W) frame
+	padded with zeros to target_size), slicing (returns a new lazy PhotonCube) and iteration. Frames are read from the
+	file in slabs of chunk_frames consecutive frames on first access, only the most recent slab is kept in memory.
+	"""
+
+	def __init__(self, h5_file_path, data_path='/photon_cube', target_size=None, frame_range=None, chunk_frames=None,
+				 h5_file=None):
+		"""
+		Args:
+			h5_file_path (str): Path to the HDF5 file.
+			data_path (str): Path of the (H, W, T) dataset within the HDF5 file.
+			target_size (list, optional): Frames are zero padded to this size. Defaults to the size of the data.
+			frame_range (range, optional): Frames of the cube that belong to this sequence. Defaults to all frames.
+			chunk_frames (int, optional): Number of frames read at once. Defaults to the chunk size of the dataset
+				along the time axis (at least 64).
+			h5_file (h5py.File, optional): Already opened file, used to share the file handle between slices.
+		"""
+		self.h5_file_path = h5_file_path
+		self.data_path = data_path
+		self.h5_file = h5_file if h5_file is not None else h5py.File(h5_file_path, 'r')
+		self._data = self.h5_file[data_path]
+		assert self._data.ndim == 3
+		H, W, T = self._data.shape
+		self.target_size = (H, W) if target_size is None else (int(target_size[0]), int(target_size[1]))
+		self.frame_range = range(T) if frame_range is None else frame_range
+		if chunk_frames is None:
+			chunk_frames = max(64, self._data.chunks[2]) if self._data.chunks is not None else 64
+		self.chunk_frames = int(chunk_frames)
+		self.dtype = self._data.dtype
+		self._slab_start = None
+		self._slab = None
+
+	@property
+	def shape(self):
+		return (len(self),) + self.target_size
+
+	def __len__(self):
+		return len(self.frame_range)
+
+	def __getitem__(self, idx):
+		if isinstance(idx, slice):
+			return PhotonCube(self.h5_file_path, self.data_path, self.target_size, self.frame_range[idx],
+							  self.chunk_frames, h5_file=self.h5_file)
+		return self._frame(self.frame_range[idx])
+
+	def __iter__(self):
+		for t in self.frame_range:
+			yield self._frame(t)
+
+	def __array__(self, dtype=None, copy=None):
+		return self.frames(0, len(self)) if dtype is None else self.frames(0, len(self)).astype(dtype)
+
+	def _frame(self, t):
+		# read the slab containing frame t, if it is not cached yet
+		if self._slab_start is None or not (self._slab_start <= t < self._slab_start + self._slab.shape[2]):
+			self._slab_start = (t // self.chunk_frames) * self.chunk_frames
+			self._slab = self._data[:, :, self._slab_start:self._slab_start + self.chunk_frames]
+		frame = self._slab[:, :, t - self._slab_start]
+		return self._pad(frame)
+
+	def _pad(self, frame):
+		if frame.shape[:2] == self.target_size:
+			return np.array(frame)
+		padded = np.zeros(self.target_size + frame.shape[2:], dtype=frame.dtype)
+		padded[:frame.shape[0], :frame.shape[1]] = frame
+		return padded
+
+	def frames(self, start, stop):
+		"""
+		Read consecutive frames start...stop-1 of this sequence at once.
+
+		Returns:
+			numpy array: Frames of shape (stop - start, target_size[0], target_size[1]).
+		"""
+		sub = self.frame_range[start:stop]
+		out = np.zeros((len(sub),) + self.target_size, dtype=self.dtype)
+		if len(sub) == 0:
+			return out
+		if sub.step == 1:
+			slab = self._data[:, :, sub.start:sub.stop]
+			out[:, :slab.shape[0], :slab.shape[1]] = np.transpose(slab, (2, 0, 1))
+		else:
+			for n, t in enumerate(sub):
+				out[n] = self._frame(t)
+		return out
+
+	def close(self):
+		self.h5_file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
@@ -0,0 +1,55 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+def share_arrays(arrays):
+	"""
+	Copy numpy arrays into shared memory blocks, so that worker processes can access them without pickling.
+
+	Args:
+		arrays (list): List of numpy arrays.
+
+	Returns:
+		tuple: (shms, specs)
+			- shms: list of SharedMemory objects. The caller owns them and has to call release_arrays when done.
+			- specs: list of (name, shape, dtype) tuples, pass these to attach_arrays in the worker.
+	"""
+	shms = []
+	specs = []
+	for arr in arrays:
+		arr = np.ascontiguousarray(arr)
+		shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+		np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+		shms.append(shm)
+		specs.append((shm.name, arr.shape, arr.dtype.str))
+	return shms, specs
+
+
+def attach_arrays(specs):
+	"""
+	Attach to shared memory blocks created by share_arrays.
+
+	Args:
+		specs (list): List of (name, shape, dtype) tuples as returned by share_arrays.
+
+	Returns:
+		tuple: (shms, arrays)
+			- shms: list of SharedMemory objects, keep a reference as long as the arrays are used.
+			- arrays: list of read-only numpy arrays backed by the shared memory.
+	"""
+	shms = []
+	arrays = []
+	for name, shape, dtype in specs:
+		shm = shared_memory.SharedMemory(name=name)
+		arr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+		arr.flags.writeable = False
+		shms.append(shm)
+		arrays.append(arr)
+	return shms, arrays
+
+
+def release_arrays(shms):
+	"""Close and unlink shared memory blocks created by share_arrays."""
+	for shm in shms:
+		shm.close()
+		shm.unlink()
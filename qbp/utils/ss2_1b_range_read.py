@@ -1,58 +1,74 @@
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from scipy.io import loadmat
 import json
 
-def ss2_1b_range_read(img_dir, start_frame, end_frame):
+
+def _load_part(img_dir, part):
+    return loadmat(os.path.join(img_dir, f'part_{part}.mat'))['OUTPUT']
+
+
+def ss2_1b_range_read(img_dir, start_frame, end_frame, num_workers=None):
+    """
+    Read the frames start_frame...end_frame-1 (0-based) of a SwissSPAD capture stored in parts.
+
+    Part part_{i}.mat (1-based) holds the frames (i - 1) * no_frames...i * no_frames - 1 as an (H, W, no_frames) array.
+    The parts are decoded in a thread pool, up to num_workers + 1 parts ahead of the one that is being copied, and
+    copied into one contiguous (T, H, W) array.
+
+    Args:
+        img_dir (str): Directory with info.json and the parts.
+        start_frame (int): First frame (0-based).
+        end_frame (int): Frame after the last frame.
+        num_workers (int, optional): Number of parts decoded concurrently. Defaults to min(8, number of CPUs).
+
+    Returns:
+        list: end_frame - start_frame (H, W) frames, slices of one contiguous (T, H, W) array.
+    """
     # Read and parse the JSON file
     json_file_path = os.path.join(img_dir, 'info.json')
     with open(json_file_path, 'r') as f:
         seq_info = json.load(f)
 
     no_frames = seq_info['no_frames']
-    start_part = (start_frame - 1) // no_frames + 1
-    start_offset = start_frame - (start_part - 1) * no_frames
+    if end_frame <= start_frame:
+        return []
+    start_part = start_frame // no_frames + 1
     end_part = (end_frame - 1) // no_frames + 1
-    end_offset = end_frame - (end_part - 1) * no_frames
-
-    imbs = [None] * (end_frame - start_frame)
-
-    if start_part == end_part:
-        # Single part
-        part_path = os.path.join(img_dir, f'part_{start_part}.mat')
-        data = loadmat(part_path)
-        output = data['OUTPUT']
-        for j in range(start_offset, end_offset + 1):
-            imbs[j - start_offset] = output[:, :, j - 1]
-    else:
-        # Multiple parts
-        # First part
-        part_path = os.path.join(img_dir, f'part_{start_part}.mat')
-        data = loadmat(part_path)
-        output = data['OUTPUT']
-        for j in range(start_offset, no_frames ):
-            imbs[j - start_offset] = output[:, :, j]
-
-        # Middle parts
-        for i in range(start_part + 1, end_part):
-            part_path = os.path.join(img_dir, f'part_{i}.mat')
-            data = loadmat(part_path)
-            output = data['OUTPUT']
-            for j in range(no_frames):
-                index = (i - start_part) * no_frames - start_offset + j
-                imbs[index] = output[:, :, j]
-
-        # Final part
-        part_path = os.path.join(img_dir, f'part_{end_part}.mat')
-        data = loadmat(part_path)
-        output = data['OUTPUT']
-        for j in range(end_offset):
-            index = (end_part - start_part) * no_frames - start_offset + j
-            imbs[index] = output[:, :, j]
-
-    return imbs
+    parts = range(start_part, end_part + 1)
+
+    if num_workers is None:
+        num_workers = min(8, os.cpu_count() or 1)
+    num_workers = max(1, min(num_workers, len(parts)))
+
+    frames = None
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        # decode the next parts while the current one is copied
+        pending = deque()
+        for part in parts[:num_workers + 1]:
+            pending.append((part, executor.submit(_load_part, img_dir, part)))
+        while pending:
+            part, future = pending.popleft()
+            output = future.result()
+            part_ahead = part + num_workers + 1
+            if part_ahead <= end_part:
+                pending.append((part_ahead, executor.submit(_load_part, img_dir, part_ahead)))
+
+            if frames is None:
+                frames = np.empty((end_frame - start_frame,) + output.shape[:2], dtype=output.dtype)
+            # frames of this part within the range
+            t0 = max(start_frame, (part - 1) * no_frames)
+            t1 = min(end_frame, part * no_frames)
+            j0 = t0 - (part - 1) * no_frames
+            frames[t0 - start_frame:t1 - start_frame] = np.moveaxis(output[:, :, j0:j0 + t1 - t0], 2, 0)
+            del output, future
+
+    return list(frames)
 
 # Example usage
 # img_dir = "output_images"
-# start_frame = 1
+# start_frame = 0
 # end_frame = 100
 # images = ss2_1b_range_read(img_dir, start_frame, end_frame)
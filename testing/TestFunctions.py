@@ -3,36 +3,16 @@ import unittest
 import numpy as np
 from testing.io import get_eng
 import os
-import matlab
-from testing.io import save_inputs, save_error
 import pickle
-import inspect
-
-def test_logger(func):
-    def wrapper(*args, **kwargs):
-        if os.getenv("ENABLE_TEST_LOGGER", "0") in ("1", "true", "True"):
-            try:
-                # Convert args to a dict using the function's signature
-                sig = inspect.signature(func)
-                bound_args = sig.bind(*args, **kwargs)
-                bound_args.apply_defaults()  # Fill in default values for missing arguments
-                input_dict = bound_args.arguments  # OrderedDict of parameter names and values
-
-                # Save the inputs as a dictionary
-                save_inputs(func.__name__, dict(input_dict))
-                return func(*args, **kwargs)     # Call the original function
-            except Exception as e:
-                save_error(func.__name__, args, str(e))  # Save error details
-                raise
-        else:
-            # Skip logging and call the function directly
-            return func(*args, **kwargs)
-    return wrapper
+# the decorator lives in qbp, re-exported for existing imports
+from qbp.utils.instrumentation import test_logger
+
+
 class TestFunctions(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
-        # set ENABLE_TEST_LOGGER=0 to disable logging (we do not want to save inputs for every test)
-        os.environ["ENABLE_TEST_LOGGER"] = "0"
+        # test_logger reads ENABLE_TEST_LOGGER once, when qbp is first imported, so inputs are only saved if the
+        # variable is set before the test run starts (see qbp/utils/instrumentation.py)
         cls.eng = get_eng()  # Initialize MATLAB engine once for the test class
         cls.base = os.getenv("QBPY_BASE_DIR")
         if not cls.base:
@@ -40,7 +20,8 @@ class TestFunctions(unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
-        cls.eng.quit()  # Stop MATLAB engine
+        if cls.eng is not None:
+            cls.eng.quit()  # Stop MATLAB engine
 
     def check_matlab_available(self):
         if self.eng is None:
@@ -87,6 +68,7 @@ class TestFunctions(unittest.TestCase):
             tuple: (py_result, matlab_result) - Results from Python and MATLAB functions, not normalized to comparable types.
         """
         if matlab_inputs is None:
+            import matlab  # only needed, and available, if MATLAB is installed
             # Convert Python inputs to MATLAB-friendly inputs
             matlab_inputs = [matlab.double([x]) if isinstance(x, (int, float)) else x for x in python_inputs]
 
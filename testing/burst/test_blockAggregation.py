@@ -0,0 +1,47 @@
+import unittest
+import numpy as np
+from qbp.burst.blockAggregation import stream_window_sums, WindowSumCache
+from qbp.utils.ps_shape.packed_photon_cube import PackedPhotonCube
+
+
+class TestBlockAggregation(unittest.TestCase):
+    def setUp(self):
+        self.frames = [(np.random.rand(16, 24) < 0.3).astype(np.uint8) for _ in range(45)]
+        # reference: mean of each temporal window
+        self.expected = [np.sum(self.frames[i * 8:(i + 1) * 8], axis=0) / 8 for i in range(5)]
+
+    def test_chunk_sizes(self):
+        """Windows that span chunk boundaries must give the same aggregates for any chunk size."""
+        for chunk_frames in [1, 3, 8, 13, 40, 256]:
+            sums = stream_window_sums(self.frames, 0, 8, 5, chunk_frames=chunk_frames, reduce_channels=True)
+            self.assertEqual(len(sums), 5)
+            for S, S_expected in zip(sums, self.expected):
+                np.testing.assert_array_equal(S / 8, S_expected)
+
+    def test_iterator(self):
+        """Frames can come from a plain iterator, e.g. a reader that yields frames one by one."""
+        sums = stream_window_sums(iter(self.frames), 0, 8, 5, chunk_frames=12, reduce_channels=True)
+        for S, S_expected in zip(sums, self.expected):
+            np.testing.assert_array_equal(S / 8, S_expected)
+
+    def test_not_enough_frames(self):
+        with self.assertRaises(ValueError):
+            stream_window_sums(self.frames[:20], 0, 8, 5)
+
+    def test_window_sum_cache(self):
+        """Sums derived from cached finer windows equal the directly computed sums, for lists and packed frames."""
+        for frames in [self.frames, PackedPhotonCube.from_frames(self.frames)]:
+            cache = WindowSumCache(frames)
+            sums = cache.window_sums(0, 4, 10)
+            np.testing.assert_array_equal(sums[2], np.sum(self.frames[8:12], axis=0))
+            # derived: 8-frame windows, a shifted window and the whole range
+            np.testing.assert_array_equal(cache.window_sums(0, 8, 5), 8 * np.stack(self.expected))
+            np.testing.assert_array_equal(cache.window_sum(12, 36), np.sum(self.frames[12:36], axis=0))
+            self.assertEqual(len(cache._sums), 1)
+            # not aligned to the cached windows, computed from the frames
+            np.testing.assert_array_equal(cache.window_sum(1, 44), np.sum(self.frames[1:44], axis=0))
+            self.assertEqual(len(cache._sums), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 import numpy as np
 import unittest
-from qbp.burst.blockMatch2d import block_match_2d_multichannel
+from qbp.burst.blockMatch2d import block_match_2d_multichannel, block_match_level, sad_scores
 from testing.TestFunctions import TestFunctions
 
 class TestBlockMatch(TestFunctions):
@@ -92,5 +92,43 @@ class TestBlockMatch(TestFunctions):
         # Check the result
         self.assertEqual(currMatch_py.tolist(), [SHIFT_U, SHIFT_V])
 
+    def test_sad_scores(self):
+        """The batched SAD scores must be bit-identical to scoring each candidate patch on its own."""
+        BLOCK_SIZE = 6
+        for shape in [(15, 17), (15, 17, 3)]:
+            ref_patch = np.random.rand(BLOCK_SIZE, BLOCK_SIZE, *shape[2:])
+            search_region = np.random.rand(*shape)
+            scores = sad_scores(ref_patch, search_region, BLOCK_SIZE)
+            self.assertEqual(scores.shape, (shape[0] - BLOCK_SIZE + 1, shape[1] - BLOCK_SIZE + 1))
+            for v in range(scores.shape[0]):
+                for u in range(scores.shape[1]):
+                    cur_patch = search_region[v:v + BLOCK_SIZE, u:u + BLOCK_SIZE]
+                    self.assertEqual(scores[v, u], np.sum(np.abs(cur_patch - ref_patch), dtype=np.float64))
+
+    def test_block_match_level(self):
+        """The level-wide matcher must pick the same matches as looping over patches and candidates."""
+        PATCH_SIZE, PATCH_STRIDE, SEARCH_RADIUS = 8, 4, 2
+        im0 = np.random.rand(32, 40, 3)
+        im1 = np.roll(im0, (2, -1), axis=(0, 1))
+        hl = (im0.shape[0] - PATCH_SIZE) // PATCH_STRIDE + 1
+        wl = (im0.shape[1] - PATCH_SIZE) // PATCH_STRIDE + 1
+        initMatch = np.random.randint(-4, 5, size=(hl, wl, 3, 2)).astype(float)
+
+        # use a small tile size to exercise the tiling
+        bestMatch, bestScore = block_match_level(im0, im1, PATCH_SIZE, PATCH_STRIDE, SEARCH_RADIUS, initMatch,
+                                                 max_elements=5000)
+        for j in range(hl):
+            for k in range(wl):
+                score = float('inf')
+                match = np.zeros(2)
+                for m in range(initMatch.shape[2]):
+                    currMatch, currScore = block_match_2d_multichannel(
+                        im0, im1, [j * PATCH_STRIDE + 1, k * PATCH_STRIDE + 1], PATCH_SIZE, SEARCH_RADIUS,
+                        initMatch[j, k, m, :])
+                    if currScore < score * 0.9999:
+                        match, score = currMatch, currScore
+                self.assertEqual(bestMatch[j, k].tolist(), match.tolist())
+                self.assertEqual(bestScore[j, k], score)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
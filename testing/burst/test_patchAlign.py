@@ -111,5 +111,29 @@ class TestPatchAlign(TestFunctions):
             matlab_inputs=matlab_inputs
         )
 
+    def test_parallel(self):
+        """Aligning the blocks in a process pool must give the same flows as the serial loop."""
+        IMG_SHAPE = (64, 128)
+        N_IMAGES = 4
+        ims = [np.random.randint(0, 2, size=IMG_SHAPE).astype(float) for _ in range(N_IMAGES)]
+        param = {
+            "refImage": 2,
+            "upsampleRatios": [1, 2, 2],
+            "numLevels": 3,
+            "patchSizes": [16, 16, 8],
+            "searchRadii": [2, 2, 2],
+            "resultDir": "./results",
+            "debug": False,
+            "dataType": 'double',
+            "numLKIters": 3,
+            "fastMode": True,
+            "doSR": False
+        }
+
+        flows_serial = patch_align(ims, param)
+        flows_parallel = patch_align(ims, dict(param, numWorkers=2))
+        for flow_serial, flow_parallel in zip(flows_serial, flows_parallel):
+            np.testing.assert_array_equal(flow_serial, flow_parallel)
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,6 +2,8 @@ import unittest
 import numpy as np
 from testing.TestFunctions import TestFunctions
 from qbp.burst.patchMerge import patch_merge
+from qbp.single_photon_imaging.src.merge.wiener_denoise_t import wiener_denoise_t, wiener_denoise_t_batch
+from qbp.single_photon_imaging.src.window_fns.raised_cos_window_2D import raised_cos_window_2D
 
 
 class TestPatchMergeFunctions(TestFunctions):
@@ -87,5 +89,41 @@ class TestPatchMergeFunctions(TestFunctions):
             rtol=0, atol=1e-3  # Allow for small differences due to floating-point
         )
 
+    def test_parallel(self):
+        """Denoising row bands in a process pool must give the same image as the serial merge."""
+        H, W, C, N = 64, 64, 2, 5
+        param = {
+            "H": H,
+            "W": W,
+            "patchSizes": [16, 16, 8],
+            "refImage": 3,
+            "wienerC": 8,
+            "debug": False,
+            "dataType": 'double',
+        }
+        patches = np.random.rand(2 * H - 16, 2 * W - 16, C, N)
+
+        S_serial = patch_merge(patches, param)
+        S_parallel = patch_merge(patches, dict(param, numWorkers=2))
+        np.testing.assert_array_equal(S_serial, S_parallel)
+        # scipy.fft with several threads, in the serial and in the pool path
+        for numWorkers in [1, 2]:
+            S_fft = patch_merge(patches, dict(param, numWorkers=numWorkers, fftWorkers=-1))
+            np.testing.assert_allclose(S_fft, S_serial, rtol=0, atol=1e-12)
+
+    def test_wiener_denoise_t_batch(self):
+        """The batched Wiener filter must match wiener_denoise_t applied to every patch."""
+        PATCH_SIZE, hs, ws, C, N = 8, 3, 4, 2, 5
+        patches = np.random.rand(hs * PATCH_SIZE, ws * PATCH_SIZE, C, N)
+        for window_fn, workers in [(None, None), (raised_cos_window_2D, None), (None, -1)]:
+            merged = wiener_denoise_t_batch(patches, PATCH_SIZE, 8, window_fn=window_fn, workers=workers)
+            self.assertEqual(merged.shape, (hs, ws, C, PATCH_SIZE, PATCH_SIZE))
+            for i in range(hs):
+                for j in range(ws):
+                    for c in range(C):
+                        patch_stack = patches[i * PATCH_SIZE:(i + 1) * PATCH_SIZE, j * PATCH_SIZE:(j + 1) * PATCH_SIZE, c, :]
+                        np.testing.assert_allclose(merged[i, j, c], wiener_denoise_t(patch_stack, 8, window_fn),
+                                                   rtol=1e-10, atol=1e-12)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import numpy as np
+from qbp.utils.interp2 import interp2
+from qbp.burst.patchWarp import PatchWarper, FrameFlows
+
+
+class TestPatchWarper(unittest.TestCase):
+    def test_equals_interp2(self):
+        """Warped frames and valid masks must equal interp2 on the repeated flow, for both methods."""
+        rng = np.random.default_rng(0)
+        H, W, patchSize = 48, 64, 16
+        patchStride = patchSize // 2
+        hs = (H - patchSize) // patchStride + 1
+        ws = (W - patchSize) // patchStride + 1
+        yv = np.repeat(np.arange(0, hs) * patchStride, patchSize) + np.tile(np.arange(1, patchSize + 1), hs)
+        xv = np.repeat(np.arange(0, ws) * patchStride, patchSize) + np.tile(np.arange(1, patchSize + 1), ws)
+        X, Y = np.meshgrid(xv, yv)
+        for method in ['linear', 'nearest']:
+            warper = PatchWarper(H, W, hs, ws, patchSize, method)
+            # half-pixel flows hit the rounding of the nearest method, also at the frame borders
+            flows = [np.round(rng.uniform(-6, 6, (hs, ws, 2)) * 4) / 4 for _ in range(4)]
+            flows += [np.full((hs, ws, 2), 3.5), np.full((hs, ws, 2), -3.5), rng.uniform(-6, 6, (hs, ws, 2))]
+            for flow in flows:
+                frame = (rng.random((H, W)) < 0.4).astype(np.uint8)
+                flowwarp = np.repeat(flow, patchSize, axis=0).repeat(patchSize, axis=1)
+                expected = interp2(frame.astype(np.float64), X + flowwarp[:, :, 0], Y + flowwarp[:, :, 1],
+                                   method=method, indexing="mat")
+                out, valid = warper.warp(frame, flow)
+                np.testing.assert_array_equal(valid, np.isfinite(expected))
+                np.testing.assert_array_equal(out, np.where(valid, expected, 0))
+
+    def test_accumulate(self):
+        """Accumulation (fused with numba if available) must equal warping and adding, also into strided views."""
+        rng = np.random.default_rng(1)
+        H, W, patchSize = 48, 64, 16
+        hs, ws = 5, 7
+        for method in ['linear', 'nearest']:
+            warper = PatchWarper(H, W, hs, ws, patchSize, method)
+            Sb = np.zeros((hs * patchSize, ws * patchSize, 2))
+            countMap = np.zeros_like(Sb)
+            Sb_expected = np.zeros_like(Sb)
+            countMap_expected = np.zeros_like(Sb)
+            for n in range(6):
+                frame = (rng.random((H, W)) < 0.4).astype(np.uint8)
+                flow = rng.uniform(-6, 6, (hs, ws, 2))
+                out, valid = warper.warp(frame, flow)
+                Sb_expected[:, :, n % 2] += out
+                countMap_expected[:, :, n % 2] += valid * 3
+                warper.accumulate(frame, flow, Sb[:, :, n % 2], countMap[:, :, n % 2], 3)
+            np.testing.assert_array_equal(Sb, Sb_expected)
+            np.testing.assert_array_equal(countMap, countMap_expected)
+
+    def test_accumulate_frames(self):
+        """Frames grouped by their rounded shift must give the same sums and counts as warping every frame."""
+        rng = np.random.default_rng(2)
+        H, W, patchSize = 48, 64, 16
+        hs, ws = 5, 7
+        # slowly varying flows, so that shifts repeat over several frames, reaching beyond the frame borders
+        flows = [np.full((hs, ws, 2), -3.0) + rng.uniform(0, 2, (hs, ws, 2)) + 0.25 * t for t in range(24)]
+        for method, dtype in [('nearest', np.uint8), ('nearest', np.float64), ('linear', np.uint8)]:
+            warper = PatchWarper(H, W, hs, ws, patchSize, method)
+            frames = [(rng.random((H, W)) < 0.4).astype(dtype) for _ in range(24)]
+            Sb = np.zeros((hs * patchSize, ws * patchSize))
+            countMap = np.zeros_like(Sb)
+            Sb_expected = np.zeros_like(Sb)
+            countMap_expected = np.zeros_like(Sb)
+            for frame, flow in zip(frames, flows):
+                warper.accumulate(frame, flow, Sb_expected, countMap_expected)
+            warper.accumulate_frames(iter(frames), iter(flows), Sb, countMap)
+            np.testing.assert_array_equal(Sb, Sb_expected)
+            np.testing.assert_array_equal(countMap, countMap_expected)
+
+
+class TestFrameFlows(unittest.TestCase):
+    def test_blend(self):
+        """Per-frame flows are the linear blend of the neighbouring block flows, extrapolated at both ends."""
+        rng = np.random.default_rng(0)
+        alignTWSize, alignTWNum = 4, 5
+        flows = [rng.uniform(-3, 3, (3, 5, 2)) for _ in range(alignTWNum)]
+        # flow k of the extended block flows belongs to frame centers[k] (1-based)
+        for alignCenFrame in [1, 2, 4]:
+            frameFlows = FrameFlows(flows, alignTWSize, alignCenFrame)
+            centers = np.arange(-1, alignTWNum + 1) * alignTWSize + alignCenFrame
+            flowsr = [2 * flows[0] - flows[1]] + flows + [2 * flows[-1] - flows[-2]]
+            for idx in range(1, alignTWSize * alignTWNum + 1):
+                k = np.searchsorted(centers, idx, side='right') - 1
+                w = (idx - centers[k]) / alignTWSize
+                np.testing.assert_allclose(frameFlows(idx), (1 - w) * flowsr[k] + w * flowsr[k + 1], atol=1e-12)
+            self.assertIs(frameFlows(1), frameFlows(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
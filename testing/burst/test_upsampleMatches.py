@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+from qbp.burst.buildAgrePyramid import build_aggre_pyramid
+from qbp.burst.patchAlign_subfuns.dc_upsampleMatches import upsample_matches, match_upsample_plans
+from qbp.burst.patchAlign_subfuns.initializeMatchesFromLevel2 import initialize_matches_from_level2
+
+
+def candidates_reference(bestMatch, yv, xv):
+    # per candidate meshgrid gathers, as in the Matlab version
+    yr = np.floor(yv).astype(int)
+    xr = np.floor(xv).astype(int)
+    yrn = yr - 1
+    masky = ((yv % 1 >= 0.5) & (yr < bestMatch.shape[0] - 1)) | (yr == 0)
+    yrn[masky] = yr[masky] + 1
+    xrn = xr - 1
+    maskx = ((xv % 1 >= 0.5) & (xr < bestMatch.shape[1] - 1)) | (xr == 0)
+    xrn[maskx] = xr[maskx] + 1
+    initMatch = np.zeros((len(yv), len(xv), 3, 2))
+    for k, (rows, cols) in enumerate([(yr, xr), (yrn, xr), (yr, xrn)]):
+        grid_y, grid_x = np.meshgrid(rows, cols, indexing='ij')
+        initMatch[:, :, k] = bestMatch[grid_y, grid_x]
+    return initMatch
+
+
+class TestUpsampleMatches(unittest.TestCase):
+    def setUp(self):
+        self.param = {'patchSizes': [16, 16, 8], 'upsampleRatios': [1, 2, 4], 'numLevels': 3,
+                      'dataType': 'float64'}
+        self.pyramid = build_aggre_pyramid(np.zeros((256, 192)), self.param['upsampleRatios'])
+        self.plans = match_upsample_plans([p.shape for p in self.pyramid], self.param)
+        self.rng = np.random.default_rng(0)
+
+    def test_upsample_matches(self):
+        """The plan of a level must give the candidates of the per-block index computation for every block."""
+        tgtImg = self.pyramid[1]
+        for _ in range(3):
+            bestMatch = self.rng.normal(0, 3, (self.pyramid[2].shape[0] // 8, self.pyramid[2].shape[1] // 8, 2))
+            initMatch, rounded = upsample_matches(bestMatch, tgtImg, 16, 8, 4, 'float64', self.plans[2])
+            np.testing.assert_array_equal(rounded, np.round(bestMatch * 4))
+            yv = np.arange(tgtImg.shape[0] // 16) * 16 / 4 / 8
+            xv = np.arange(tgtImg.shape[1] // 16) * 16 / 4 / 8
+            np.testing.assert_array_equal(initMatch, candidates_reference(rounded, yv, xv))
+            # the plan is computed on the fly if not given
+            np.testing.assert_array_equal(upsample_matches(bestMatch, tgtImg, 16, 8, 4, 'float64')[0], initMatch)
+
+    def test_initialize_matches_from_level2(self):
+        H, W = self.pyramid[0].shape
+        bestMatch = self.rng.normal(0, 3, (self.pyramid[1].shape[0] // 16, self.pyramid[1].shape[1] // 16, 2))
+        initMatch = initialize_matches_from_level2(bestMatch, [16, 16, 8], 8, self.param, (H, W), self.plans[0])
+        yv = np.arange(0, H - 16 + 1, 8) / 2 / 16
+        xv = np.arange(0, W - 16 + 1, 8) / 2 / 16
+        np.testing.assert_array_equal(initMatch, candidates_reference(np.round(bestMatch * 2), yv, xv))
+        self.assertEqual(initMatch.shape, ((H - 16) // 8 + 1, (W - 16) // 8 + 1, 3, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import contextlib
+import io
+import unittest
+import numpy as np
+from qbp.sim import (MotionModel, SyntheticPhotonCube, random_scene, gen_bin_img, gen_multi_bit_jot, gen_sum_img,
+                     gen_dcr_pattern)
+from qbp.burst.patchAlignBinary import patch_align_binary
+from qbp.utils.ps_shape.packed_photon_cube import PackedPhotonCube
+from qbp.utils.ps_shape.param_from_json import param_from_json
+
+
+class TestSensor(unittest.TestCase):
+    def test_detection_probability(self):
+        """Binary frames and sum images detect a photon with probability 1 - exp(-flux)."""
+        I = np.full((200, 200), 0.5)
+        expected = 1 - np.exp(-(0.5 * 0.8 + 0.1))
+        B = gen_bin_img(I, 0.8, dcr=0.1, rng=0)
+        self.assertEqual(B.dtype, np.uint8)
+        self.assertAlmostEqual(B.mean(), expected, delta=0.01)
+        S = gen_sum_img(I, 50, 0.8, dcr=0.1, rng=0)
+        self.assertAlmostEqual(S.mean() / 50, expected, delta=0.01)
+
+    def test_multi_bit_jot(self):
+        I = np.full((100, 100), 1.0)
+        C = gen_multi_bit_jot(I, 2, 10, rng=0)
+        self.assertTrue(np.all(C >= 0) and np.all(C <= 1))
+        counts = gen_multi_bit_jot(I, 2, 10, rng=0, normalize=False)
+        np.testing.assert_array_equal(counts / 3, C)
+
+    def test_dcr_pattern(self):
+        dcr = gen_dcr_pattern((30, 40), np.arange(1, 102), scale_median=5, rng=0)
+        self.assertEqual(dcr.shape, (30, 40))
+        self.assertAlmostEqual(np.median(dcr), 5, delta=0.5)
+
+
+class TestSyntheticPhotonCube(unittest.TestCase):
+    def setUp(self):
+        self.scene = random_scene(64, 64, seed=0)
+
+    def test_streaming(self):
+        """Frames must not depend on the order or the chunks in which they are generated."""
+        cube = SyntheticPhotonCube(self.scene, 100, MotionModel((0.1, -0.05), angular_velocity=1e-3), seed=3)
+        frames = cube.frames(0, 100)
+        self.assertEqual(frames.shape, (100, 64, 64))
+        for chunk_frames in [1, 7, 64]:
+            np.testing.assert_array_equal(np.concatenate(list(cube.chunks(chunk_frames))), frames)
+        np.testing.assert_array_equal(cube[57], frames[57])
+        np.testing.assert_array_equal(cube[20:80:3][4], frames[32])
+        np.testing.assert_array_equal(np.stack(list(cube)), frames)
+        np.testing.assert_array_equal(np.asarray(PackedPhotonCube.from_frames(cube, chunk_frames=16)), frames)
+        # a different seed gives different photon arrivals
+        self.assertFalse(np.array_equal(SyntheticPhotonCube(self.scene, 100, seed=4).frames(0, 10), frames[:10]))
+
+    def test_multi_bit(self):
+        cube = SyntheticPhotonCube(self.scene, 10, num_bits=3, max_flux=4, read_noise_sigma=0.3)
+        frames = cube.frames(0, 10)
+        self.assertEqual(frames.dtype, np.uint8)
+        self.assertLessEqual(frames.max(), 7)
+        self.assertGreater(frames.max(), 1)
+
+    def test_motion_model(self):
+        """The flow from t_ref to t maps the rendered scene of t onto the one of t_ref."""
+        motion = MotionModel((0.2, 0.1), angular_velocity=2e-3, zoom_rate=1e-3)
+        shape = (64, 64)
+        np.testing.assert_allclose(motion.flow(10, 20, 30, 30, shape), [0, 0], atol=1e-12)
+        # a scene point seen at x0 at time 0 is at matrix(t) @ x0 at time t
+        x0 = np.array([10.0, 20.0])
+        xt = motion.matrix(30, shape) @ np.append(x0, 1)
+        np.testing.assert_allclose(x0 + motion.flow(x0[0], x0[1], 30, 0, shape), xt)
+
+    def test_alignment_against_known_flows(self):
+        """patch_align_binary recovers the known flows of a translating scene to about a pixel."""
+        cube = SyntheticPhotonCube(random_scene(128, 128, seed=0), 400, MotionModel((0.04, 0.02)), seed=1)
+        param = param_from_json(None)
+        param.update({'alignTWSize': 40, 'alignTWNum': 10, 'mergeTWSize': 40, 'mergeTWNum': 10, 'refFrame': 200,
+                      'numWorkers': 1})
+        with contextlib.redirect_stdout(io.StringIO()):
+            flows = patch_align_binary(cube, param)[0]
+        errors = np.abs(np.array(flows) - np.array(cube.block_flows(param)))
+        self.assertLess(np.median(errors), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
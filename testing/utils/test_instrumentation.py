@@ -0,0 +1,78 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import numpy as np
+from qbp.utils import instrumentation
+from qbp.utils.instrumentation import StageProfiler, profile_stage
+
+
+def _add(a, b=1):
+    return a + b
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_disabled_returns_function(self):
+        """Without logging, the decorator must return the undecorated function."""
+        if instrumentation.LOGGING_ENABLED:
+            self.skipTest("ENABLE_TEST_LOGGER is set")
+        self.assertIs(instrumentation.test_logger(_add), _add)
+
+    def test_enabled_saves_inputs(self):
+        """With ENABLE_TEST_LOGGER set at import time, the inputs of every call are saved."""
+        code = ("from qbp.utils.instrumentation import test_logger\n"
+                "import testing.io\n"
+                "saved = []\n"
+                "testing.io.save_inputs = lambda name, inputs: saved.append((name, inputs))\n"
+                "def add(a, b=1):\n"
+                "    return a + b\n"
+                "f = test_logger(add)\n"
+                "assert f is not add and f.__name__ == 'add'\n"
+                "assert f(2) == 3\n"
+                "assert saved == [('add', {'a': 2, 'b': 1})], saved\n")
+        env = dict(os.environ, ENABLE_TEST_LOGGER="1")
+        result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+class TestStageProfiler(unittest.TestCase):
+    def test_stages(self):
+        """Stages are recorded by the active profiler, nested and repeated stages accumulate."""
+        with profile_stage('outside'):
+            pass
+        with StageProfiler(trace_allocations=True) as profiler:
+            for _ in range(2):
+                with profile_stage('outer'):
+                    with profile_stage('inner'):
+                        a = np.ones(2 ** 20)
+                        del a
+                    b = np.ones(2 ** 18)
+        with profile_stage('outside'):
+            pass
+
+        stages = {stage['name']: stage for stage in profiler.report()['stages']}
+        self.assertEqual(list(stages), ['outer', 'inner'])
+        self.assertEqual(stages['outer']['calls'], 2)
+        self.assertGreaterEqual(stages['outer']['wall_time'], stages['inner']['wall_time'])
+        # the 8 MB array of the inner stage is the peak of both stages, the 2 MB array is kept by the outer stage
+        self.assertGreaterEqual(stages['inner']['alloc_peak_bytes'], 8 * 2 ** 20)
+        self.assertGreaterEqual(stages['outer']['alloc_peak_bytes'], 8 * 2 ** 20)
+        self.assertLess(stages['inner']['alloc_net_bytes'], 2 ** 20)
+        self.assertGreaterEqual(stages['outer']['alloc_net_bytes'], 2 * 2 ** 20)
+        del b
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'result_profile.json')
+            profiler.save(path, dataset='synthetic')
+            with open(path) as f:
+                report = json.load(f)
+        self.assertEqual(report['dataset'], 'synthetic')
+        self.assertIn('wall_time', report['total'])
+        self.assertEqual([stage['name'] for stage in report['stages']], ['outer', 'inner'])
+
+
+if __name__ == '__main__':
+    unittest.main()
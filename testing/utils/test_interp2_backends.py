@@ -0,0 +1,103 @@
+import os
+import unittest
+from unittest import mock
+import numpy as np
+from qbp.utils.interp2 import interp2, interp2_backend, Interp2Weights, INTERP2_BACKEND_ENV, \
+    bicubic_convolution_interpolation
+
+
+class TestInterp2Backends(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.V = rng.random((20, 30))
+        self.Xq = rng.uniform(-2, 31, (12, 9))
+        self.Yq = rng.uniform(-2, 21, (12, 9))
+        # points on the border and half a pixel outside
+        self.Xq[0, :4] = [0, 29, -0.5, 29.5]
+        self.Yq[1, :4] = [0, 19, -0.5, 19.5]
+
+    def test_precomputed_equals_reference(self):
+        """The precomputed weights must give the results of the scipy reference, NaN outside the grid included."""
+        for method in ('linear', 'nearest'):
+            for V in (self.V, self.V.astype(np.float32)):
+                expected = interp2(V, self.Xq, self.Yq, method=method, method_selection='regular_grid')
+                result = interp2(V, self.Xq, self.Yq, method=method, method_selection='precomputed')
+                np.testing.assert_array_equal(result, expected)
+                # cached weights
+                result = interp2(V, self.Xq, self.Yq, method=method, method_selection='precomputed')
+                np.testing.assert_array_equal(result, expected)
+        weights = Interp2Weights(self.V.shape, self.Xq + 1, self.Yq + 1)
+        np.testing.assert_array_equal(weights(self.V),
+                                      interp2(self.V, self.Xq + 1, self.Yq + 1, method='linear'))
+
+    def test_cv2_remap(self):
+        """cv2.remap is exact for nearest neighbours and close for linear interpolation, with the same NaN border."""
+        for method, atol in (('linear', 1 / 32), ('nearest', 0)):
+            expected = interp2(self.V, self.Xq, self.Yq, method=method, method_selection='regular_grid')
+            result = interp2(self.V, self.Xq, self.Yq, method=method, method_selection='cv2_remap')
+            np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+            np.testing.assert_allclose(result, expected, rtol=0, atol=atol, equal_nan=True)
+        result = interp2(self.V.astype(np.float32), self.Xq, self.Yq, method='linear', method_selection='cv2_remap')
+        self.assertEqual(result.dtype, np.float32)
+
+    def test_cv2_remap_long_query(self):
+        """Query grids with more than SHRT_MAX points along an axis are remapped in tiles."""
+        rng = np.random.default_rng(1)
+        for shape in [(40000,), (3, 40000), (40000, 2)]:
+            Xq = rng.uniform(-1, 30, shape)
+            Yq = rng.uniform(-1, 20, shape)
+            expected = interp2(self.V, Xq, Yq, method='nearest', method_selection='regular_grid')
+            result = interp2(self.V, Xq, Yq, method='nearest', method_selection='cv2_remap')
+            self.assertEqual(result.shape, shape)
+            np.testing.assert_array_equal(result, expected)
+
+    def test_unsupported_method_falls_back(self):
+        """Methods a backend does not support use the scipy reference, also when the backend comes from the environment."""
+        expected = interp2(self.V, self.Xq, self.Yq, method='cubic', method_selection='regular_grid')
+        with mock.patch.dict(os.environ, {INTERP2_BACKEND_ENV: 'precomputed'}):
+            result = interp2(self.V, self.Xq, self.Yq, method='cubic')
+        np.testing.assert_array_equal(result, expected)
+
+    def test_bicubic_convolution(self):
+        """The vectorized bicubic convolution must equal the 4 x 4 tap sum over the padded image for every mode."""
+        def kernel(x):
+            x = abs(x)
+            return 1.5 * x ** 3 - 2.5 * x ** 2 + 1 if x <= 1 else (-0.5 * x ** 3 + 2.5 * x ** 2 - 4 * x + 2 if x < 2 else 0)
+
+        pad_modes = {'reflect': 'reflect', 'constant': 'constant', 'wrap': 'wrap', 'nearest': 'edge'}
+        Xq = np.clip(self.Xq, -1, 29)
+        Yq = np.clip(self.Yq, -1, 19)
+        for mode, np_mode in pad_modes.items():
+            V_padded = np.pad(self.V, 2, mode=np_mode)
+            expected = np.zeros(Xq.shape)
+            for i, j in np.ndindex(Xq.shape):
+                x0, y0 = int(np.floor(Xq[i, j])), int(np.floor(Yq[i, j]))
+                for m in range(-1, 3):
+                    for n in range(-1, 3):
+                        expected[i, j] += (V_padded[y0 + n + 2, x0 + m + 2] * kernel(Xq[i, j] - (x0 + m)) *
+                                           kernel(Yq[i, j] - (y0 + n)))
+            result = bicubic_convolution_interpolation(self.V, Xq, Yq, padding_mode=mode)
+            np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-12)
+
+        # grid points are reproduced, query points outside the grid are NaN in interp2
+        x, y = np.meshgrid(np.arange(30.), np.arange(20.))
+        np.testing.assert_allclose(interp2(self.V, x, y, method='cubic', method_selection='bicubic_convolution_wrap'),
+                                   self.V, atol=1e-12)
+        result = interp2(self.V, self.Xq, self.Yq, method='cubic', method_selection='bicubic_convolution_reflect')
+        expected = interp2(self.V, self.Xq, self.Yq, method='linear', method_selection='regular_grid')
+        np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+
+    def test_backend_selection(self):
+        """The default backend is read from the environment, unknown backends raise."""
+        with mock.patch.dict(os.environ, {INTERP2_BACKEND_ENV: 'cv2_remap'}):
+            self.assertEqual(interp2_backend(), 'cv2_remap')
+            self.assertEqual(interp2_backend('precomputed'), 'precomputed')
+        with mock.patch.dict(os.environ):
+            os.environ.pop(INTERP2_BACKEND_ENV, None)
+            self.assertEqual(interp2_backend(), 'regular_grid')
+        with self.assertRaises(ValueError):
+            interp2(self.V, self.Xq, self.Yq, method='linear', method_selection='unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
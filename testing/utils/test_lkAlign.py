@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+from scipy.ndimage import gaussian_filter
+from qbp.utils.lkAlign import lk_align, lk_align_batch
+from qbp.burst.buildAgrePyramid import build_aggre_pyramid, GradientPyramid
+
+
+class TestLKAlignBatch(unittest.TestCase):
+    def test_equals_lk_align(self):
+        """The batched solver must give the displacements of lk_align for every patch."""
+        rng = np.random.default_rng(0)
+        base = gaussian_filter(rng.random((100, 120)), 2)
+        ref = base[10:74, 10:106]
+        tgt = base[12:76, 9:105]
+        patchSize = 16
+        pos = [(y, x) for y in range(0, 64 - patchSize + 1, 8) for x in range(0, 96 - patchSize + 1, 8)]
+        im0s = np.stack([ref[y:y + patchSize, x:x + patchSize] for y, x in pos])
+        uv0 = np.array([[x + rng.uniform(-1, 1), y + rng.uniform(-1, 1)] for y, x in pos])
+        # a patch partly outside the target and one completely outside (rank deficient, not moved)
+        uv0[0] -= 6
+        uv0[1] += 500
+
+        uv = lk_align_batch(im0s, tgt, 3, uv0)
+        for i in range(len(pos)):
+            np.testing.assert_allclose(uv[i], lk_align(im0s[i], tgt, 3, uv0[i].copy()).ravel(), atol=1e-10)
+        np.testing.assert_array_equal(uv[1], uv0[1])
+
+    def test_gradient_pyramid(self):
+        """Cached derivatives must give the same displacements as derivatives computed per call."""
+        rng = np.random.default_rng(1)
+        base = gaussian_filter(rng.random((80, 96)), 2)
+        P0 = build_aggre_pyramid(base[:64, :80], [1, 2])
+        P1 = build_aggre_pyramid(base[1:65, 2:82], [1, 2])
+        G0, G1 = GradientPyramid(P0), GradientPyramid(P1)
+        patchSize, patchStride = 8, 4
+        Ix, Iy = G0.patch_gradients(1, patchSize, patchStride)
+        self.assertEqual(Ix.shape, (7, 9, patchSize, patchSize))
+        self.assertIs(G0.patch_gradients(1, patchSize, patchStride)[0], Ix)
+        self.assertIs(G1.gradients(1)[1], G1.gradients(1)[1])
+
+        im0s = np.stack([P0[1][y:y + patchSize, x:x + patchSize]
+                         for y in range(0, 25, patchStride) for x in range(0, 33, patchStride)])
+        uv0 = np.stack(np.meshgrid(np.arange(9) * patchStride, np.arange(7) * patchStride), axis=2).reshape((-1, 2)) + 0.5
+        uv = lk_align_batch(im0s, P1[1], 3, uv0)
+        uv_cached = lk_align_batch(im0s, P1[1], 3, uv0, grads=G1.gradients(1),
+                                   template_grads=(Ix.reshape(im0s.shape), Iy.reshape(im0s.shape)))
+        np.testing.assert_array_equal(uv_cached, uv)
+        np.testing.assert_array_equal(lk_align(im0s[10], P1[1], 3, uv0[10].copy(), grads=G1.gradients(1)),
+                                      lk_align(im0s[10], P1[1], 3, uv0[10].copy()))
+
+
+if __name__ == '__main__':
+    unittest.main()
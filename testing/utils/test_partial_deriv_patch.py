@@ -35,6 +35,27 @@ class TestPartialDerivPatch(unittest.TestCase):
         np.testing.assert_allclose(Ix, Ix_eng, rtol=1e-5, equal_nan=True)
         np.testing.assert_allclose(Iy, Iy_eng, rtol=1e-5, equal_nan=True)
 
+    def test_window_equals_full_image(self):
+        # Linear interpolation only reads a window of img2, the result must equal interpolating the whole image
+        img2 = np.random.rand(80, 90)
+        img1 = np.random.rand(16, 16)
+        x, y = np.meshgrid(np.arange(16), np.arange(16))
+        deriv_filter = np.array([1, -8, 0, 8, -1]) / 12
+        I2x = convolve(img2, deriv_filter[None, ::-1], mode='reflect')
+        I2y = convolve(img2, deriv_filter[::-1, None], mode='reflect')
+        I1x = convolve(img1, deriv_filter[None, ::-1], mode='reflect')
+        I1y = convolve(img1, deriv_filter[::-1, None], mode='reflect')
+        for uv in [(30.25, 40.5), (-3.5, 2.75), (80.5, 70.25), (0, 0), (200, 5)]:
+            uv = np.array(uv).reshape((1, 1, 2))
+            x2, y2 = x + uv[..., 0], y + uv[..., 1]
+            It = interp2(img2, x2, y2, method='linear') - img1
+            Ix = 0.5 * interp2(I2x, x2, y2, method='linear') + 0.5 * I1x
+            Iy = 0.5 * interp2(I2y, x2, y2, method='linear') + 0.5 * I1y
+            mask = ~np.isfinite(It) | ~np.isfinite(Ix) | ~np.isfinite(Iy)
+            It[mask] = Ix[mask] = Iy[mask] = 0
+            for expected, result in zip((It, Ix, Iy), partial_deriv_patch(img1, img2, uv)):
+                np.testing.assert_array_equal(result, expected)
+
     def test_non_quadratic_linear(self):
         # Test with bi-linear interpolation
         # define img1 and img as shifted sine-cos curves
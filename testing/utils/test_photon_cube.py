@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+import h5py
+import numpy as np
+from qbp.utils.ps_shape.photon_cube import PhotonCube
+from qbp.utils.ps_shape.packed_photon_cube import PackedPhotonCube
+
+
+class TestPhotonCube(unittest.TestCase):
+    def setUp(self):
+        # small (H, W, T) cube with a chunked time axis
+        self.cube = (np.random.rand(20, 30, 150) < 0.2).astype(np.uint8)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cube.h5")
+        with h5py.File(self.path, "w") as f:
+            f.create_dataset("photon_cube", data=self.cube, chunks=(20, 30, 16))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_frames(self):
+        """Frames must equal the transposed and zero padded cube."""
+        target_size = [24, 32]
+        expected = np.zeros((150, 24, 32), dtype=np.uint8)
+        expected[:, :20, :30] = np.transpose(self.cube, (2, 0, 1))
+        with PhotonCube(self.path, "/photon_cube", target_size) as imbs:
+            self.assertEqual(len(imbs), 150)
+            self.assertEqual(imbs.shape, (150, 24, 32))
+            for i in [0, 15, 16, 149, -1]:
+                np.testing.assert_array_equal(imbs[i], expected[i])
+            np.testing.assert_array_equal(np.asarray(imbs), expected)
+            np.testing.assert_array_equal(np.stack(list(imbs)), expected)
+
+            # slices are lazy sequences themselves
+            sliced = imbs[40:100]
+            self.assertIsInstance(sliced, PhotonCube)
+            self.assertEqual(len(sliced), 60)
+            np.testing.assert_array_equal(sliced[5], expected[45])
+            np.testing.assert_array_equal(sliced.frames(10, 20), expected[50:60])
+            np.testing.assert_array_equal(imbs[::7].frames(0, 3), expected[[0, 7, 14]])
+
+
+class TestPackedPhotonCube(unittest.TestCase):
+    def setUp(self):
+        self.frames = (np.random.rand(45, 12, 14) < 0.3).astype(np.uint8)
+        self.packed = PackedPhotonCube.from_frames(list(self.frames), chunk_frames=16)
+
+    def test_frames(self):
+        """Unpacked frames and slices must equal the original frames."""
+        self.assertEqual(len(self.packed), 45)
+        self.assertEqual(self.packed.bits.shape, (6, 12, 14))
+        np.testing.assert_array_equal(np.asarray(self.packed), self.frames)
+        for t in [0, 7, 8, 44, -1]:
+            np.testing.assert_array_equal(self.packed[t], self.frames[t])
+        np.testing.assert_array_equal(np.asarray(self.packed[8:37]), self.frames[8:37])
+        np.testing.assert_array_equal(np.asarray(self.packed[3:40:3]), self.frames[3:40:3])
+
+    def test_window_sum(self):
+        """Popcount based window sums must equal summing the frames."""
+        for start, stop in [(0, 45), (0, 8), (3, 5), (7, 9), (5, 44), (10, 10)]:
+            np.testing.assert_array_equal(self.packed.window_sum(start, stop),
+                                          self.frames[start:stop].sum(axis=0))
+        np.testing.assert_array_equal(self.packed.window_sums(2, 5, 8),
+                                      self.frames[2:42].reshape(8, 5, 12, 14).sum(axis=1))
+
+    def test_non_binary(self):
+        with self.assertRaises(ValueError):
+            PackedPhotonCube.from_frames(self.frames * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
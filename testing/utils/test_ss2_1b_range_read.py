@@ -0,0 +1,74 @@
+import os
+import json
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import numpy as np
+from scipy.io import savemat
+import qbp.utils.ss2_1b_range_read as range_read
+from qbp.utils.ss2_1b_range_read import ss2_1b_range_read
+from qbp.utils.ps_shape.load_dataset import load_dataset
+from qbp.utils.ps_shape.param_from_json import param_from_json
+
+
+class TestSS21bRangeRead(unittest.TestCase):
+    def setUp(self):
+        # 5 parts of 10 frames each
+        self.no_frames = 10
+        self.frames = (np.random.rand(50, 12, 16) < 0.2).astype(np.uint8)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmpdir.name, 'info.json'), 'w') as f:
+            json.dump({'no_frames': self.no_frames}, f)
+        for i in range(5):
+            part = np.transpose(self.frames[i * self.no_frames:(i + 1) * self.no_frames], (1, 2, 0))
+            savemat(os.path.join(self.tmpdir.name, f'part_{i + 1}.mat'), {'OUTPUT': part})
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_ranges(self):
+        """Ranges within one part, across part boundaries and over all parts, for any number of workers."""
+        for start_frame, end_frame in [(0, 50), (3, 7), (0, 10), (10, 20), (9, 11), (4, 47), (49, 50)]:
+            for num_workers in [1, 2, 8]:
+                imbs = ss2_1b_range_read(self.tmpdir.name, start_frame, end_frame, num_workers)
+                self.assertEqual(len(imbs), end_frame - start_frame)
+                np.testing.assert_array_equal(np.stack(imbs), self.frames[start_frame:end_frame])
+
+    def test_contiguous(self):
+        """Frames are contiguous slices of one array."""
+        imbs = ss2_1b_range_read(self.tmpdir.name, 5, 35)
+        self.assertTrue(all(imb.flags['C_CONTIGUOUS'] for imb in imbs))
+        self.assertTrue(all(imb.base is imbs[0].base for imb in imbs))
+
+    def test_load_dataset_concurrent_parts(self):
+        """load_dataset decodes several parts at once with the default parameters."""
+        dcr_path = os.path.join(self.tmpdir.name, 'dcr.mat')
+        savemat(dcr_path, {'dcr': np.zeros((12, 16))})
+        param = param_from_json(None)
+        param.update({'dataDir': self.tmpdir.name, 'dcrPath': dcr_path, 'dataset_type': 'mat',
+                      'target_size': [12, 16], 'num_ls': 1, 'PS': False, 'range': [1, 50]})
+
+        lock = threading.Lock()
+        in_flight = [0, 0]  # current, maximum
+        load_part = range_read._load_part
+
+        def slow_load_part(img_dir, part):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight[1], in_flight[0])
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return load_part(img_dir, part)
+
+        with mock.patch.object(range_read, '_load_part', slow_load_part), \
+                mock.patch.object(range_read.os, 'cpu_count', return_value=4):
+            imbs = load_dataset(param)[0]
+        np.testing.assert_array_equal(np.stack(imbs), self.frames)
+        self.assertGreater(in_flight[1], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()